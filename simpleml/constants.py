@@ -9,3 +9,6 @@ __author__ = 'Elisha Yadgaran'
 TRAIN_SPLIT: str = 'TRAIN'
 VALIDATION_SPLIT: str = 'VALIDATION'
 TEST_SPLIT: str = 'TEST'
+
+# Internal column holding the split of each row in pandas datasets
+DATAFRAME_SPLIT_COLUMN: str = 'DATASET_SPLIT'
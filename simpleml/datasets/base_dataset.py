@@ -17,9 +17,10 @@ import logging
 from future.utils import with_metaclass
 from sqlalchemy import Column, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
-from typing import Dict, List, Optional, Any, TYPE_CHECKING
+from typing import Dict, List, Optional, Any, Iterable, Tuple, TYPE_CHECKING
 
 from simpleml.persistables.base_persistable import Persistable
+from simpleml.persistables.hashing import HashableChunks, IdentityFingerprint, HASH_VERSION_COLUMNAR
 from simpleml.save_patterns.decorators import ExternalArtifactDecorators
 from simpleml.persistables.sqlalchemy_types import GUID
 from simpleml.registries import DatasetRegistry
@@ -67,12 +68,15 @@ class AbstractDataset(with_metaclass(DatasetRegistry, Persistable)):
                  has_external_files: bool = True,
                  label_columns: Optional[List[str]] = None,
                  other_named_split_sections: Optional[Dict[str, List[str]]] = None,
+                 split_views: bool = False,
                  **kwargs):
         '''
         param label_columns: Optional list of column names to register as the "y" split section
         param other_named_split_sections: Optional map of section names to lists of column names for
             other arbitrary split columns -- must match expected consumer signatures (e.g. sample_weights)
             because passed through untouched downstream (eg sklearn.fit(**split))
+        param split_views: Whether `get_split` returns read only views of the
+            data instead of copies (where supported, ex: pandas datasets)
         All other columns in the dataframe will automatically be referenced as "X"
         '''
         # If no save patterns are set, specify a default for disk_pickled
@@ -80,6 +84,8 @@ class AbstractDataset(with_metaclass(DatasetRegistry, Persistable)):
             kwargs['save_patterns'] = {'dataset': ['disk_pickled']}
         super(AbstractDataset, self).__init__(
             has_external_files=has_external_files, **kwargs)
+        # Operational setting, does not affect the hash
+        self.state['split_views'] = split_views
 
         # split sections are an optional set of inputs to register split references
         # for later use. defaults to just `X` and `y` but arbitrary inputs can
@@ -192,6 +198,29 @@ class AbstractDataset(with_metaclass(DatasetRegistry, Persistable)):
         '''
         raise NotImplementedError
 
+    def build_dataframe_chunks(self) -> Iterable[Any]:
+        '''
+        Optional hook to generate the dataframe in row chunks (dataframes or
+        ndarray blocks) without holding all of it in memory. Used to hash
+        datasets larger than memory. Should yield the same rows, in the same
+        order, as `build_dataframe`
+        '''
+        raise NotImplementedError
+
+    def _dataframe_chunks(self) -> Optional[Iterable[Any]]:
+        '''
+        Row chunks of the dataframe, if the data has not been built or loaded
+        yet and the dataset implements `build_dataframe_chunks`. Returns None
+        otherwise (the materialized dataframe should be used)
+        '''
+        materialized = getattr(self, '_external_file', None) is not None or 'dataset' in getattr(self, 'unloaded_artifacts', [])
+        if not materialized:
+            try:
+                return self.build_dataframe_chunks()
+            except NotImplementedError:
+                LOGGER.debug('Dataset does not support chunked generation, building full dataframe')
+        return None
+
     def add_pipeline(self, pipeline: 'Pipeline') -> None:
         '''
         Setter method for dataset pipeline used
@@ -217,15 +246,38 @@ class AbstractDataset(with_metaclass(DatasetRegistry, Persistable)):
             1) Dataframe
             2) Config
             3) Pipeline
+
+        From hash version 2 the dataframe is hashed in row chunks, so datasets
+        that implement `build_dataframe_chunks` can be hashed without
+        materializing the data. The digest is the same either way
         '''
-        dataframe = self.dataframe
+        chunks = self._dataframe_chunks() if self.hash_version >= HASH_VERSION_COLUMNAR else None
+        if chunks is not None:
+            dataframe = HashableChunks(chunks)
+        else:
+            dataframe = self.dataframe
         config = self.config
         if self.pipeline is not None:
-            pipeline_hash = self.pipeline.hash_ or self.pipeline._hash()
+            pipeline_hash = self.pipeline.hash_ or self.pipeline._cached_hash()
         else:
             pipeline_hash = None
 
-        return self.custom_hasher((dataframe, config, pipeline_hash))
+        return self.custom_hasher((dataframe, config, pipeline_hash), self.hash_version, hash_backend=self.hash_backend)
+
+    def _hash_fingerprint(self) -> Optional[Tuple]:
+        '''
+        Data is tracked by object identity. Pandas datasets only expose copies
+        so the data can only change by setting a new dataframe
+        '''
+        pipeline_fingerprint = self._dependency_fingerprint(self.pipeline)
+        if pipeline_fingerprint is None:
+            return None
+        return (
+            self.hash_version,
+            IdentityFingerprint(getattr(self, '_external_file', None)),
+            repr(self.config),
+            pipeline_fingerprint
+        )
 
     def save(self, **kwargs) -> None:
         '''
@@ -8,19 +8,20 @@ means unique to pandas.
 
 __author__ = 'Elisha Yadgaran'
 
+import numpy as np
 import pandas as pd
 
 from itertools import chain
-from typing import List, Union, Optional
+from typing import Any, Dict, List, Union, Optional, Tuple, Type
 
+from simpleml.constants import DATAFRAME_SPLIT_COLUMN
 from simpleml.datasets.abstract_mixin import AbstractDatasetMixin
+from simpleml.persistables.hashing import IdentityFingerprint
+from simpleml.registries import LOAD_METHOD_REGISTRY
 from simpleml.utils.errors import DatasetError
 from simpleml.pipelines.validation_split_mixins import Split
 
 
-DATAFRAME_SPLIT_COLUMN: str = 'DATASET_SPLIT'
-
-
 class BasePandasDatasetMixin(AbstractDatasetMixin):
     '''
     Pandas mixin class with control mechanism for `self.dataframe` of
@@ -30,9 +31,8 @@ class BasePandasDatasetMixin(AbstractDatasetMixin):
 
     In particular:
         A - type of pd.DataFrame:
-            - query()
+            - take()
             - columns
-            - drop()
             - squeeze()
 
     WARNING: Needs to be used as a base class for datasets because it overwrites
@@ -71,6 +71,47 @@ class BasePandasDatasetMixin(AbstractDatasetMixin):
         Allows mixins/subclasses to validate input
         '''
         self._external_file = df
+        self._get_split_index(df)
+
+    def _source_dataframe(self) -> pd.DataFrame:
+        '''
+        The stored dataframe (not a copy like `self.dataframe`). Loads or
+        builds it first, if necessary. Must not be mutated
+        '''
+        if getattr(self, '_external_file', None) is None or \
+                'dataset' in getattr(self, 'unloaded_artifacts', []):
+            # Accessor handles loading and building
+            self.dataframe
+        return self._external_file
+
+    @staticmethod
+    def build_split_index(df: pd.DataFrame) -> Dict[Any, np.ndarray]:
+        '''
+        Row positions of every split value (in row order). All positions share
+        one array, in the smallest integer dtype that fits
+        '''
+        codes, uniques = pd.factorize(df[DATAFRAME_SPLIT_COLUMN], sort=False)
+        dtype = np.int32 if len(df) < np.iinfo(np.int32).max else np.int64
+        # Stable sort keeps the row order within each split
+        order = np.argsort(codes, kind='stable').astype(dtype, copy=False)
+        # Null splits (code -1) sort first and are not indexed
+        boundaries = np.cumsum(np.bincount(codes + 1, minlength=len(uniques) + 1))
+        return {split: order[start:end] for split, start, end in zip(uniques, boundaries[:-1], boundaries[1:])}
+
+    def _get_split_index(self, df: pd.DataFrame) -> Optional[Dict[Any, np.ndarray]]:
+        '''
+        Split index of the stored dataframe, built once per dataframe. Pandas
+        datasets only expose copies, so the data can only change by setting a
+        new dataframe (tracked by identity)
+        '''
+        if not isinstance(df, pd.DataFrame) or DATAFRAME_SPLIT_COLUMN not in df.columns:
+            return None
+        fingerprint = (IdentityFingerprint(df), len(df))
+        cached = getattr(self, '_split_index', None)
+        if cached is None or cached[0] != fingerprint:
+            cached = (fingerprint, self.build_split_index(df))
+            self._split_index = cached
+        return cached[1]
 
     def _validate_dtype(self, df: pd.DataFrame) -> None:
         '''
@@ -80,22 +121,36 @@ class BasePandasDatasetMixin(AbstractDatasetMixin):
         if not isinstance(df, pd.DataFrame):
             raise DatasetError('Pandas Datasets must be of type `pd.DataFrame`')
 
-    def get(self, column: Optional[str], split: Optional[str]) -> pd.DataFrame:
+    def get(self, column: Optional[str], split: Optional[str], copy: bool = True) -> pd.DataFrame:
         '''
         Explicitly split validation splits
         Uses self.label_columns to separate x and y columns inside the returned dataframe
 
         returns empty dataframe for missing combinations of column & split
+
+        If the dataframe has not been loaded yet and was saved with a columnar
+        save pattern (ex: `disk_parquet`), only the requested columns and
+        split are read from the artifact
+
+        :param copy: False returns a read only view of the stored data instead
+            of a copy (see `_view`)
         '''
         registered_sections = self.config.get('split_section_map')
         if column is not None and column != 'X' and column not in registered_sections:
             raise ValueError(f'Only support registered sections: {registered_sections}, X, or None')
 
-        dataframe = self.dataframe  # copy
+        partial_loader = self._partial_dataframe_loader()
+        if partial_loader is not None:
+            load_cls, filepath_data = partial_loader
+            dataframe = None
+            all_columns = load_cls.column_names(filepath_data)
+        else:
+            dataframe = self._source_dataframe()  # not a copy, never mutated
+            all_columns = dataframe.columns
 
         # choose the columns to slice from the dataframe
         if column is None:  # All except internal columns
-            return_columns = [col for col in dataframe.columns if col != DATAFRAME_SPLIT_COLUMN]
+            return_columns = [col for col in all_columns if col != DATAFRAME_SPLIT_COLUMN]
 
         elif column != 'X':
             # other passthrough columns
@@ -104,57 +159,137 @@ class BasePandasDatasetMixin(AbstractDatasetMixin):
         else:  # X
             all_other_columns = list(chain(*registered_sections.values()))
             return_columns = [
-                col for col in dataframe.columns
+                col for col in all_columns
                 if col != DATAFRAME_SPLIT_COLUMN
                 and col not in all_other_columns
             ]
 
-        return self._get(dataframe=dataframe, columns=return_columns, split=split)
+        if dataframe is None:
+            return self._partial_get(load_cls, filepath_data, all_columns, return_columns, split)
+
+        positions = None
+        if split is not None:
+            split_index = self._get_split_index(dataframe)
+            if split_index is None:
+                raise DatasetError(f'Cannot retrieve dataset split `{split}` from dataframe without `{DATAFRAME_SPLIT_COLUMN}` column')
+            positions = split_index.get(split, np.empty(0, dtype=np.int64))
+        if not copy:
+            return self._view(dataframe, columns=return_columns, positions=positions)
+        return self._take(dataframe, columns=return_columns, positions=positions)
 
     @staticmethod
-    def _get(dataframe: pd.DataFrame, columns: List[str], split: str) -> pd.DataFrame:
+    def _take(dataframe: pd.DataFrame, columns: List[str], positions: Optional[np.ndarray]) -> pd.DataFrame:
         '''
-        Internal method to extract data subsets from a dataframe
+        New dataframe with the columns (in dataframe order) and row positions
+        (all rows if None)
+        '''
+        column_positions = np.flatnonzero(dataframe.columns.isin(columns))
+        # Narrow the columns first so only the selected data is copied twice
+        subset = dataframe.take(column_positions, axis=1)
+        if positions is None:
+            return subset
+        return subset.take(positions)
 
-        :param dataframe: the dataframe to subset from
-        :param columns: List of columns to slice from the dataframe
-        :param split: row identifiers to slice rows (in internal column mapped to `DATAFRAME_SPLIT_COLUMN`)
+    @staticmethod
+    def _view(dataframe: pd.DataFrame, columns: List[str], positions: Optional[np.ndarray]) -> pd.DataFrame:
         '''
-        if split is not None:  # Return the full dataset (all splits) - already a copy
-            # query automatically returns a copy wisth a weakref
-            if DATAFRAME_SPLIT_COLUMN not in dataframe.columns:
-                raise DatasetError('Cannot retrieve dataset split `{split}` from dataframe without `{DATAFRAME_SPLIT_COLUMN}` column')
-            dataframe = dataframe.query("{}=='{}'".format(DATAFRAME_SPLIT_COLUMN, split))
+        Read only equivalent of `_take` that shares the column arrays of the
+        stored dataframe instead of copying them. Rows are sliced without
+        copying when the split is a contiguous range (ex: splits joined with
+        `concatenate_dataframes`), otherwise only the selected rows are copied
 
-        # inplace drop extra columns
-        drop_columns = [col for col in dataframe.columns if col not in columns]
-        if drop_columns:
-            dataframe.drop(drop_columns, axis=1, inplace=True)
+        Replacing columns (`view[col] = ...`) only swaps in the new array.
+        Writing into the shared arrays (ex: `view.iloc[0, 0] = 1`) raises
+        '''
+        column_positions = np.flatnonzero(dataframe.columns.isin(columns))
+        rows = slice(None)
+        if positions is not None:
+            if len(positions) == 0:
+                rows = slice(0, 0)
+            elif positions[-1] - positions[0] + 1 == len(positions):
+                # Positions are sorted and unique
+                rows = slice(int(positions[0]), int(positions[-1]) + 1)
+            else:
+                dataframe = dataframe.take(column_positions, axis=1).take(positions)
+                column_positions = np.arange(dataframe.shape[1])
+
+        arrays = []
+        for position in column_positions:
+            values = dataframe.iloc[:, position]._values[rows]
+            if isinstance(values, np.ndarray):
+                values = values.view()
+                values.flags.writeable = False
+            arrays.append(values)
+
+        # Unconsolidated, so every column keeps referencing its array
+        view = pd.DataFrame(dict(enumerate(arrays)), index=dataframe.index[rows], copy=False)
+        view.columns = dataframe.columns[column_positions]
+        return view
+
+    def _partial_dataframe_loader(self) -> Optional[Tuple[Type, Any]]:
+        '''
+        Returns the (load class, filepath data) of a save pattern that can read
+        column and row subsets of the dataframe artifact, if it is unloaded
+        and was saved with one
+        '''
+        if 'dataset' not in getattr(self, 'unloaded_artifacts', []):
+            return None
+        for save_pattern, filepath_data in ((self.filepaths or {}).get('dataset') or {}).items():
+            load_cls = LOAD_METHOD_REGISTRY.get(save_pattern)
+            if load_cls is not None and callable(getattr(load_cls, 'column_names', None)):
+                return load_cls, filepath_data
+        return None
 
-        # Last check in case any of the operations created a view or weakref copy
-        if (hasattr(dataframe, '_is_view') and dataframe._is_view) or \
-                (hasattr(dataframe, '_is_copy') and dataframe._is_copy is not None):
-            dataframe = dataframe.copy()
+    @staticmethod
+    def _partial_get(load_cls: Type,
+                     filepath_data: Any,
+                     all_columns: List[str],
+                     columns: List[str],
+                     split: Optional[str]) -> pd.DataFrame:
+        '''
+        Equivalent of `_take` reading only the needed columns and split rows
+        from the saved artifact
+        '''
+        filters = None
+        if split is not None:
+            if DATAFRAME_SPLIT_COLUMN not in all_columns:
+                raise DatasetError(f'Cannot retrieve dataset split `{split}` from dataframe without `{DATAFRAME_SPLIT_COLUMN}` column')
+            filters = [(DATAFRAME_SPLIT_COLUMN, '=', split)]
 
-        return dataframe
+        # Keep the dataframe column order, like dropping columns would
+        columns = [col for col in all_columns if col in columns]
+        return load_cls.load(filepath_data, columns=columns, filters=filters)
 
-    def get_split(self, split: Optional[str]) -> Split:
+    def get_split(self, split: Optional[str], copy: Optional[bool] = None) -> Split:
         '''
         Wrapper accessor to return a split object (for internal use)
+
+        :param copy: False returns read only views of the sections instead of
+            copies. Defaults to the `split_views` dataset setting (copies)
         '''
+        if copy is None:
+            copy = not getattr(self, 'state', {}).get('split_views', False)
         registered_sections = self.config.get('split_section_map')
         return Split(
             # explicitly get X as the "other" columns
-            X=self.get(column='X', split=split),
+            X=self.get(column='X', split=split, copy=copy),
             # should include y and any others if they exist
-            **{section: self.get(split=split, column=section) for section in registered_sections}
+            **{section: self.get(split=split, column=section, copy=copy) for section in registered_sections}
         ).squeeze()
 
     def get_split_names(self) -> List[str]:
         '''
         Helper to expose the splits contained in the dataset
         '''
-        df = self.dataframe
+        partial_loader = self._partial_dataframe_loader()
+        if partial_loader is not None:
+            load_cls, filepath_data = partial_loader
+            if DATAFRAME_SPLIT_COLUMN not in load_cls.column_names(filepath_data):
+                return []
+            df = load_cls.load(filepath_data, columns=[DATAFRAME_SPLIT_COLUMN])
+        else:
+            df = self._source_dataframe()
+
         if DATAFRAME_SPLIT_COLUMN in df.columns:
             return df[DATAFRAME_SPLIT_COLUMN].unique().tolist()
         else:
@@ -233,12 +368,12 @@ class SingleLabelPandasDatasetMixin(BasePandasDatasetMixin):
 
         return labels[0]
 
-    def get(self, column: str, split: str) -> Union[pd.Series, pd.DataFrame]:
+    def get(self, column: str, split: str, copy: bool = True) -> Union[pd.Series, pd.DataFrame]:
         '''
         Extends PandasDatasetMixin.get with logic to squeeze labels to a
         series (1D frame)
         '''
-        data = super().get(column=column, split=split)
+        data = super().get(column=column, split=split, copy=copy)
 
         if column == 'X':
             return data
@@ -99,3 +99,25 @@ try:
 except ImportError:
     Provider = MissingImportFactory('libcloud.storage.types.Provider', 'apache-libcloud', 'cloud')
     get_driver = MissingImportFactory('libcloud.storage.providers.get_driver', 'apache-libcloud', 'cloud')
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = MissingImportFactory('xxhash', 'xxhash', 'hashing')
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = MissingImportFactory('pyarrow', 'pyarrow', 'parquet')
+    pq = MissingImportFactory('pyarrow.parquet', 'pyarrow', 'parquet')
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = MissingImportFactory('zstandard', 'zstandard', 'compression')
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = MissingImportFactory('lz4.frame', 'lz4', 'compression')
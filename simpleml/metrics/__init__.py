@@ -28,3 +28,5 @@ from .classification import ClassificationMetric, BinaryClassificationMetric,\
     ThresholdInformednessMetric,\
     ThresholdMarkednessMetric,\
     FprTprMetric
+from .scoring_cache import ScoringCache
+from .metric_suite import MetricSuite, score_all
@@ -6,7 +6,7 @@ import logging
 from future.utils import with_metaclass
 from sqlalchemy import Column, ForeignKey, UniqueConstraint, Index, func
 from sqlalchemy.orm import relationship
-from typing import Any
+from typing import Any, Optional, Tuple
 
 from simpleml.persistables.base_persistable import Persistable, GUID, MutableJSON
 from simpleml.datasets.base_dataset import Dataset
@@ -56,15 +56,28 @@ class AbstractMetric(with_metaclass(MetricRegistry, Persistable)):
             3) Metric
             4) Config
         '''
-        model_hash = self.model.hash_ or self.model._hash()
+        model_hash = self.model.hash_ or self.model._cached_hash()
         if self.dataset is not None:
-            dataset_hash = self.dataset.hash_ or self.dataset._hash()
+            dataset_hash = self.dataset.hash_ or self.dataset._cached_hash()
         else:
             dataset_hash = None
         metric = self.__class__.__name__
         config = self.config
 
-        return self.custom_hasher((model_hash, dataset_hash, metric, config))
+        return self.custom_hasher((model_hash, dataset_hash, metric, config), self.hash_version, hash_backend=self.hash_backend)
+
+    def _hash_fingerprint(self) -> Optional[Tuple]:
+        model_fingerprint = self._dependency_fingerprint(self.model)
+        dataset_fingerprint = self._dependency_fingerprint(self.dataset)
+        if model_fingerprint is None or dataset_fingerprint is None:
+            return None
+        return (
+            self.hash_version,
+            model_fingerprint,
+            dataset_fingerprint,
+            self.__class__.__name__,
+            repr(self.config)
+        )
 
     def _get_latest_version(self) -> int:
         '''
@@ -101,9 +114,12 @@ class AbstractMetric(with_metaclass(MetricRegistry, Persistable)):
         '''
         return self.dataset.get(**kwargs)
 
-    def save(self, **kwargs) -> None:
+    def save(self, reload_model: bool = True, **kwargs) -> None:
         '''
         Extend parent function with a few additional save routines
+
+        :param reload_model: whether to reload the model relationship after
+            saving. Batch saves can defer this to once for all metrics
         '''
         if self.model is None:
             raise MetricError('Must set model before saving')
@@ -114,7 +130,8 @@ class AbstractMetric(with_metaclass(MetricRegistry, Persistable)):
         super(AbstractMetric, self).save(**kwargs)
 
         # Sqlalchemy updates relationship references after save so reload class
-        self.model.load(load_externals=False)
+        if reload_model:
+            self.model.load(load_externals=False)
 
     def load(self, **kwargs) -> None:
         '''
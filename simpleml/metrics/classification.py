@@ -32,6 +32,7 @@ from abc import abstractmethod
 from typing import Optional, Any
 
 from simpleml.metrics.base_metric import Metric
+from simpleml.metrics.scoring_cache import ScoringCache, get_active_scoring_cache
 from simpleml.constants import TRAIN_SPLIT, VALIDATION_SPLIT, TEST_SPLIT
 from simpleml.utils.errors import MetricError
 
@@ -73,16 +74,39 @@ class ClassificationMetric(Metric):
             return self._get_pipeline_split(column=column, split=self.config.get('dataset_split'))
         return self._get_dataset_split(column=column, split=self.config.get('dataset_split'))
 
+    def add_scoring_cache(self, scoring_cache: Optional[ScoringCache]) -> None:
+        '''
+        Setter method for a scoring cache shared with sibling metrics
+        '''
+        self._scoring_cache = scoring_cache
+
     @property
-    def labels(self) -> Any:
-        if self.dataset is None:
-            raise MetricError('Must set dataset before scoring classification metrics!')
-        return self._get_split(column='y')
+    def scoring_cache(self) -> Optional[ScoringCache]:
+        '''
+        Explicitly added cache, otherwise the active `with ScoringCache()` block
+        '''
+        scoring_cache = getattr(self, '_scoring_cache', None)
+        if scoring_cache is None:
+            scoring_cache = get_active_scoring_cache()
+        return scoring_cache
+
+    def _cached(self, name: str, compute) -> Any:
+        '''
+        Route a scoring intermediate through the scoring cache, if one is set
+        '''
+        scoring_cache = self.scoring_cache
+        if scoring_cache is None:
+            return compute()
+        key = scoring_cache.build_key(self.model, self.dataset, self.config.get('dataset_split'))
+        return scoring_cache.get(key, name, compute)
 
     @property
-    def probabilities(self) -> Any:
+    def labels(self) -> Any:
         if self.dataset is None:
             raise MetricError('Must set dataset before scoring classification metrics!')
+        return self._cached('labels', lambda: self._get_split(column='y'))
+
+    def _predict_proba(self) -> Any:
         probabilities = self.model.predict_proba(
             X=self._get_split(column='X'),
             transform=True
@@ -90,10 +114,7 @@ class ClassificationMetric(Metric):
         self.validate_predictions(probabilities)
         return probabilities
 
-    @property
-    def predictions(self) -> Any:
-        if self.dataset is None:
-            raise MetricError('Must set dataset before scoring classification metrics!')
+    def _predict(self) -> Any:
         preds = self.model.predict(
             X=self._get_split(column='X'),
             transform=True
@@ -101,6 +122,18 @@ class ClassificationMetric(Metric):
         self.validate_predictions(preds)
         return preds
 
+    @property
+    def probabilities(self) -> Any:
+        if self.dataset is None:
+            raise MetricError('Must set dataset before scoring classification metrics!')
+        return self._cached('probabilities', self._predict_proba)
+
+    @property
+    def predictions(self) -> Any:
+        if self.dataset is None:
+            raise MetricError('Must set dataset before scoring classification metrics!')
+        return self._cached('predictions', self._predict)
+
     @staticmethod
     def validate_predictions(predictions: Any) -> None:
         invalid = None
@@ -165,25 +198,68 @@ class BinaryClassificationMetric(ClassificationMetric):
     def _create_confusion_matrix(thresholds, probabilities, labels):
         '''
         Independent computation method (easier testing)
-        '''
-        results = []
-        for threshold in thresholds:
-            predictions = np.where(probabilities >= threshold, 1, 0)
-            tn, fp, fn, tp = confusion_matrix(labels, predictions, labels=[0, 1]).ravel()
-            results.append((threshold, tn, fp, fn, tp))
 
-        return pd.DataFrame(results, columns=['threshold', 'tn', 'fp', 'fn', 'tp'])
+        Computes tn/fp/fn/tp for every threshold in a single pass instead of
+        rescanning the data per threshold. Probabilities are sorted once and
+        the cumulative count of positive labels gives, for any threshold, the
+        number of positives that fall below it (predicted negative). Overall
+        complexity is O(n log n + t log n) instead of O(n * t)
+
+        Predictions follow the same convention as `probabilities >= threshold`
+        so null probabilities are always predicted negative
+        '''
+        thresholds = np.asarray(thresholds, dtype=float)
+        probabilities = np.asarray(probabilities, dtype=float).ravel()
+        labels = np.asarray(labels).ravel()
+
+        # Only labels in {0, 1} contribute to the matrix (matches `labels=[0, 1]`)
+        positives = labels == 1
+        negatives = labels == 0
+
+        # Null probabilities never pass a threshold comparison
+        null_mask = np.isnan(probabilities)
+        null_positives = np.count_nonzero(positives & null_mask)
+        null_negatives = np.count_nonzero(negatives & null_mask)
+
+        valid = (positives | negatives) & ~null_mask
+        valid_probabilities = probabilities[valid]
+        valid_positives = positives[valid]
+
+        # Single sort + cumulative sum over the positive indicator
+        order = np.argsort(valid_probabilities, kind='mergesort')
+        sorted_probabilities = valid_probabilities[order]
+        cumulative_positives = np.concatenate(([0], np.cumsum(valid_positives[order], dtype=np.int64)))
+
+        # Number of samples strictly below each threshold (predicted negative)
+        below = np.searchsorted(sorted_probabilities, thresholds, side='left')
+
+        total_positives = cumulative_positives[-1]
+        total_negatives = valid_probabilities.shape[0] - total_positives
+
+        fn = cumulative_positives[below]
+        tn = below - fn
+        tp = total_positives - fn
+        fp = total_negatives - tn
+
+        return pd.DataFrame({
+            'threshold': thresholds,
+            'tn': (tn + null_negatives).astype(np.int64),
+            'fp': fp.astype(np.int64),
+            'fn': (fn + null_positives).astype(np.int64),
+            'tp': tp.astype(np.int64),
+        }, columns=['threshold', 'tn', 'fp', 'fn', 'tp'])
 
     def create_confusion_matrix(self):
         '''
-        Iterate through each threshold and compute confusion matrix
+        Compute the confusion matrix at each threshold
         '''
         # Thresholds to compute confusion matrix at (default every 0.005 increment)
         thresholds = np.linspace(0, 1, 201)
-        probabilities = self.probabilities
-        labels = self.labels
 
-        self._confusion_matrix = self._create_confusion_matrix(thresholds, probabilities, labels)
+        def compute():
+            return self._create_confusion_matrix(thresholds, self.probabilities, self.labels)
+
+        self._confusion_matrix = self._cached('confusion_matrix', compute)
 
     @staticmethod
     def dedupe_curve(keys, values, maximize=True, round_places=3):
@@ -0,0 +1,161 @@
+'''
+Module for batch metric evaluation
+
+Scoring each metric independently repeats the same dataset retrieval, pipeline
+transform, model inference and confusion matrix sweep for every metric class.
+A metric suite scores a collection of metric classes over a set of dataset
+splits in one pass, sharing those intermediates via a `ScoringCache`, and
+persists all resulting metrics in a single database transaction.
+
+Usage:
+```
+metrics = score_all(
+    model, dataset,
+    metric_classes=[RocAucMetric, ThresholdTprMetric, 'ThresholdFprMetric'],
+    dataset_splits=[TRAIN_SPLIT, TEST_SPLIT]
+)
+```
+'''
+
+__author__ = 'Elisha Yadgaran'
+
+
+import logging
+
+from typing import Any, Dict, List, Optional, Type, Union
+
+from simpleml.datasets.base_dataset import Dataset
+from simpleml.metrics.base_metric import Metric
+from simpleml.metrics.scoring_cache import ScoringCache, DEFAULT_SCORING_CACHE_BYTES
+from simpleml.models.base_model import Model
+from simpleml.registries import METRIC_REGISTRY
+from simpleml.utils.errors import MetricError
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class MetricSuite(object):
+    '''
+    Collection of metric classes scored together against a model and dataset
+
+    Metrics are scored split by split so only one split's intermediates
+    need to be held in memory at a time
+    '''
+
+    def __init__(self,
+                 metric_classes: List[Union[str, Type[Metric]]],
+                 dataset_splits: Optional[List[Optional[str]]] = None,
+                 max_cache_bytes: Optional[int] = DEFAULT_SCORING_CACHE_BYTES,
+                 **metric_kwargs):
+        '''
+        :param metric_classes: metric classes or registered class names to score
+        :param dataset_splits: dataset splits to score each metric on. Defaults
+            to a single null split (metric default)
+        :param max_cache_bytes: memory bound for the shared scoring intermediates
+        :param metric_kwargs: passed to every metric on initialization
+        '''
+        self.metric_classes = [self.retrieve_metric_class(i) for i in metric_classes]
+        self.dataset_splits = dataset_splits if dataset_splits is not None else [None]
+        self.max_cache_bytes = max_cache_bytes
+        self.metric_kwargs = metric_kwargs
+
+    @staticmethod
+    def retrieve_metric_class(metric_class: Union[str, Type[Metric]]) -> Type[Metric]:
+        '''
+        Resolve registered names to class definitions
+        '''
+        if isinstance(metric_class, str):
+            registered_class = METRIC_REGISTRY.get(metric_class)
+            if registered_class is None:
+                raise MetricError(f'Referenced metric class unregistered: {metric_class}')
+            return registered_class
+        return metric_class
+
+    def build_metrics(self, model: Model, dataset: Dataset) -> Dict[Optional[str], List[Metric]]:
+        '''
+        Initialize every (split, metric class) combination, grouped by split
+        '''
+        metrics = {}
+        for dataset_split in self.dataset_splits:
+            metrics[dataset_split] = []
+            for metric_class in self.metric_classes:
+                metric = metric_class(dataset_split=dataset_split, **self.metric_kwargs)
+                metric.add_model(model)
+                metric.add_dataset(dataset)
+                metrics[dataset_split].append(metric)
+        return metrics
+
+    def score(self, model: Model, dataset: Dataset) -> List[Metric]:
+        '''
+        Score every metric, sharing intermediates within each split
+        '''
+        scored = []
+        scoring_cache = ScoringCache(max_bytes=self.max_cache_bytes)
+        for dataset_split, metrics in self.build_metrics(model, dataset).items():
+            LOGGER.debug(f'Scoring {len(metrics)} metrics on split {dataset_split}')
+            for metric in metrics:
+                metric.add_scoring_cache(scoring_cache)
+                metric.score()
+                # Do not hold a reference to the cache after scoring
+                metric.add_scoring_cache(None)
+                scored.append(metric)
+            # Intermediates are no longer needed once the split is done
+            scoring_cache.invalidate(dataset_split=dataset_split)
+
+        LOGGER.debug(f'Scoring cache hits: {scoring_cache.hits}, misses: {scoring_cache.misses}')
+        return scored
+
+    @staticmethod
+    def save(metrics: List[Metric]) -> None:
+        '''
+        Persist all metrics in a single database transaction. Either every
+        metric is saved or none are
+        '''
+        if not metrics:
+            return
+
+        session = Metric._session
+        if session.autocommit:
+            with session.begin():
+                MetricSuite._save_metrics(metrics)
+        else:
+            try:
+                MetricSuite._save_metrics(metrics)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+
+        # Sqlalchemy updates relationship references after save so reload once
+        # for the whole batch instead of once per metric
+        for model in {id(metric.model): metric.model for metric in metrics}.values():
+            model.load(load_externals=False)
+
+    @staticmethod
+    def _save_metrics(metrics: List[Metric]) -> None:
+        for metric in metrics:
+            metric.save(reload_model=False)
+
+    def score_all(self, model: Model, dataset: Dataset, save: bool = True) -> List[Metric]:
+        '''
+        Score and (optionally) save every metric in the suite
+        '''
+        metrics = self.score(model, dataset)
+        if save:
+            self.save(metrics)
+        return metrics
+
+
+def score_all(model: Model,
+              dataset: Dataset,
+              metric_classes: List[Union[str, Type[Metric]]],
+              dataset_splits: Optional[List[Optional[str]]] = None,
+              save: bool = True,
+              **kwargs: Any) -> List[Metric]:
+    '''
+    Convenience wrapper to score (and save) a batch of metric classes over
+    multiple dataset splits in one pass. Extra kwargs are passed to `MetricSuite`
+    '''
+    suite = MetricSuite(metric_classes=metric_classes, dataset_splits=dataset_splits, **kwargs)
+    return suite.score_all(model, dataset, save=save)
@@ -0,0 +1,178 @@
+'''
+Module for the scoring cache shared across metrics
+
+Scoring many metrics against the same model and dataset split repeatedly
+runs the same pipeline transform and model inference. A scoring cache
+memoizes those intermediates (labels, probabilities, predictions, confusion
+matrix) so sibling metrics only compute them once.
+
+Usage:
+```
+with ScoringCache() as cache:
+    for metric_cls in metric_classes:
+        metric = metric_cls(dataset_split='TEST')
+        metric.add_model(model)
+        metric.add_dataset(dataset)
+        metric.score()  # inference only runs for the first metric
+```
+
+Metrics can also be explicitly bound to a cache via `metric.add_scoring_cache(cache)`
+'''
+
+__author__ = 'Elisha Yadgaran'
+
+
+import logging
+import threading
+
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple, List
+
+from simpleml.utils.memory import estimate_memory_usage
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# Default upper bound on the memory held by a single cache (1 GB)
+DEFAULT_SCORING_CACHE_BYTES: int = 1024 ** 3
+
+# Stack of caches activated via the context manager protocol
+_ACTIVE_CACHES: List['ScoringCache'] = []
+
+
+def get_active_scoring_cache() -> Optional['ScoringCache']:
+    '''
+    Returns the innermost cache activated with a `with` block, if any
+    '''
+    if _ACTIVE_CACHES:
+        return _ACTIVE_CACHES[-1]
+    return None
+
+
+class ScoringCache(object):
+    '''
+    LRU memoization of scoring intermediates keyed on
+    (model hash, dataset hash, dataset split, name)
+
+    Entries are evicted least recently used first once the tracked size
+    exceeds `max_bytes`. Setting `max_bytes` to None disables the bound
+    '''
+
+    def __init__(self, max_bytes: Optional[int] = DEFAULT_SCORING_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Tuple, Tuple[Any, int]]' = OrderedDict()
+        self._size: int = 0
+        self._lock = threading.RLock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __enter__(self) -> 'ScoringCache':
+        _ACTIVE_CACHES.append(self)
+        return self
+
+    def __exit__(self, *args) -> None:
+        _ACTIVE_CACHES.remove(self)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Tuple) -> bool:
+        return key in self._entries
+
+    @property
+    def size(self) -> int:
+        '''
+        Estimated number of bytes currently held
+        '''
+        return self._size
+
+    @staticmethod
+    def persistable_key(persistable: Any) -> Optional[str]:
+        '''
+        Identity to use for a persistable. Prefers the saved hash so that
+        separately loaded copies of the same persistable share entries. Falls
+        back to the object id for unsaved persistables (avoids recomputing
+        expensive hashes)
+        '''
+        if persistable is None:
+            return None
+        hash_ = getattr(persistable, 'hash_', None)
+        if isinstance(hash_, (str, int)):
+            return str(hash_)
+        return str(persistable.id)
+
+    @classmethod
+    def build_key(cls, model: Any, dataset: Any, dataset_split: Optional[str]) -> Tuple:
+        return (cls.persistable_key(model), cls.persistable_key(dataset), dataset_split)
+
+    def get(self, key: Tuple, name: str, compute: Callable[[], Any]) -> Any:
+        '''
+        Return the cached value for (key, name) or compute, store and return it
+        '''
+        entry_key = key + (name,)
+        with self._lock:
+            if entry_key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(entry_key)
+                return self._entries[entry_key][0]
+            self.misses += 1
+
+        value = compute()
+        self.set(key, name, value)
+        return value
+
+    def set(self, key: Tuple, name: str, value: Any) -> None:
+        '''
+        Explicitly store a value. Values larger than the whole cache are not stored
+        '''
+        entry_key = key + (name,)
+        size = estimate_memory_usage(value)
+        with self._lock:
+            self._pop(entry_key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                LOGGER.debug(f'Skipping scoring cache for {entry_key}, value exceeds max size')
+                return
+            self._entries[entry_key] = (value, size)
+            self._size += size
+            self._evict()
+
+    def _pop(self, entry_key: Tuple) -> None:
+        entry = self._entries.pop(entry_key, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def _evict(self) -> None:
+        if self.max_bytes is None:
+            return
+        while self._size > self.max_bytes and self._entries:
+            entry_key, (_, size) = self._entries.popitem(last=False)
+            self._size -= size
+            LOGGER.debug(f'Evicted {entry_key} from scoring cache')
+
+    def invalidate(self,
+                   model: Optional[Any] = None,
+                   dataset: Optional[Any] = None,
+                   dataset_split: Optional[Hashable] = None) -> None:
+        '''
+        Drop every entry matching the passed filters. No filters clears the cache
+        '''
+        model_key = self.persistable_key(model)
+        dataset_key = self.persistable_key(dataset)
+        with self._lock:
+            for entry_key in list(self._entries.keys()):
+                if model is not None and entry_key[0] != model_key:
+                    continue
+                if dataset is not None and entry_key[1] != dataset_key:
+                    continue
+                if dataset_split is not None and entry_key[2] != dataset_split:
+                    continue
+                self._pop(entry_key)
+
+    def clear(self) -> None:
+        '''
+        Drop all entries
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -123,12 +123,24 @@ class AbstractModel(with_metaclass(ModelRegistry, Persistable)):
         Any attribute that gets calculated later will result in a race condition
         that may return a different hash depending on when the function is called
         '''
-        pipeline_hash = self.pipeline.hash_ or self.pipeline._hash()
+        pipeline_hash = self.pipeline.hash_ or self.pipeline._cached_hash()
         model = self.external_model.__class__.__name__
         params = self.get_params()
         config = self.config
 
-        return self.custom_hasher((pipeline_hash, model, params, config))
+        return self.custom_hasher((pipeline_hash, model, params, config), self.hash_version, hash_backend=self.hash_backend)
+
+    def _hash_fingerprint(self):
+        pipeline_fingerprint = self._dependency_fingerprint(self.pipeline)
+        if pipeline_fingerprint is None:
+            return None
+        return (
+            self.hash_version,
+            pipeline_fingerprint,
+            self.external_model.__class__.__name__,
+            # Hashed, reprs elide large params (ex: arrays)
+            self.custom_hasher((self.get_params(), self.config), self.hash_version, hash_backend=self.hash_backend)
+        )
 
     def save(self, **kwargs):
         '''
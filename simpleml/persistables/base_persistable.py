@@ -10,20 +10,43 @@ import logging
 
 from abc import abstractmethod
 from future.utils import with_metaclass
-from collections import defaultdict
-from typing import Dict, Union, Optional, Any, Type, List
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Union, Optional, Any, Type, List, Tuple
 from sqlalchemy import Column, func, String, Boolean, Integer
 
 from simpleml.persistables.sqlalchemy_types import GUID, MutableJSON
 from simpleml.persistables.base_sqlalchemy import SimplemlCoreSqlalchemy
-from simpleml.persistables.hashing import CustomHasherMixin
+from simpleml.persistables.hashing import CustomHasherMixin, HASH_VERSIONS, HASH_VERSION_LEGACY, DEFAULT_HASH_VERSION,\
+    HASH_BACKEND_MD5, DEFAULT_HASH_BACKEND, get_hash_backend
+from simpleml.persistables.persistable_cache import PERSISTABLE_CACHE
 from simpleml.registries import MetaRegistry, SIMPLEML_REGISTRY, SAVE_METHOD_REGISTRY, LOAD_METHOD_REGISTRY
+from simpleml.save_patterns.serialization import SerializationCache, activate_serialization_cache
+from simpleml.save_patterns.compression import resolve_codec
 from simpleml.utils.library_versions import INSTALLED_LIBRARIES
+from simpleml.utils.configuration import CONFIG, PERSISTENCE_SECTION
 from simpleml.utils.errors import SimpleMLError
 
 
 LOGGER = logging.getLogger(__name__)
 
+# Concurrent artifact saving. Every (artifact, save pattern) pair is written on
+# a thread pool so save latency approaches the slowest backend instead of the
+# sum of all of them. Configured via:
+# [persistence]
+# save_workers = 4
+DEFAULT_SAVE_WORKERS: int = CONFIG.getint(PERSISTENCE_SECTION, 'save_workers', fallback=1)
+# Concurrent artifact restoring. Independent artifacts are downloaded and
+# deserialized in parallel. Fallback save patterns can also be hedged: if the
+# preferred pattern has not returned within `hedge_delay` seconds the next one
+# is started as well and the first successful restore wins (0 races all of
+# them). Configured via:
+# [persistence]
+# load_workers = 4
+# hedge_delay = 2.5
+DEFAULT_LOAD_WORKERS: int = CONFIG.getint(PERSISTENCE_SECTION, 'load_workers', fallback=1)
+DEFAULT_HEDGE_DELAY: Optional[float] = CONFIG.getfloat(PERSISTENCE_SECTION, 'hedge_delay', fallback=None)
+
 
 class Persistable(with_metaclass(MetaRegistry, SimplemlCoreSqlalchemy, CustomHasherMixin)):
     '''
@@ -113,6 +136,10 @@ class Persistable(with_metaclass(MetaRegistry, SimplemlCoreSqlalchemy, CustomHas
                  project: Optional[str] = None,
                  version_description: Optional[str] = None,
                  save_patterns: Optional[Dict[str, List[str]]] = None,
+                 hash_version: int = DEFAULT_HASH_VERSION,
+                 hash_backend: str = DEFAULT_HASH_BACKEND,
+                 compression: Optional[str] = None,
+                 compression_level: Optional[int] = None,
                  **kwargs):
         # Initialize values expected to exist at time of instantiation
         self.registered_name: str = self.__class__.__name__
@@ -132,11 +159,27 @@ class Persistable(with_metaclass(MetaRegistry, SimplemlCoreSqlalchemy, CustomHas
         self.metadata_['config'] = {}  # Place for parameters that uniquely configure an instance on initialization
         self.metadata_['state'] = {}  # Place for transitory values that may be set post initialization (and want to be persisted)
 
+        # Hashing behavior is versioned and opt-in. Persisted to compare against
+        # other persistables hashed with the same version
+        if hash_version not in HASH_VERSIONS:
+            raise SimpleMLError(f'Unsupported hash version: {hash_version}. Expected one of {HASH_VERSIONS}')
+        self.state['hash_version'] = hash_version
+        try:
+            get_hash_backend(hash_backend)
+        except ValueError as e:
+            raise SimpleMLError(str(e))
+        self.state['hash_backend'] = hash_backend
+
         # For external loading - initialize to None
         self.unloaded_artifacts: List[str] = []
         # Store save pattern in state metadata as an operational setting, otherwise
         # it could affect the hash and result in a different object per save location
         self.state['save_patterns'] = save_patterns
+        # Artifact compression codec, defaults to the configured `[persistence] compression`
+        if compression is not None:
+            resolve_codec(compression)
+        self.state['compression'] = compression
+        self.state['compression_level'] = compression_level
 
     @property
     def config(self) -> Dict[str, Any]:
@@ -150,6 +193,16 @@ class Persistable(with_metaclass(MetaRegistry, SimplemlCoreSqlalchemy, CustomHas
     def library_versions(self) -> Dict[str, str]:
         return self.metadata_.get('library_versions', {})
 
+    @property
+    def hash_version(self) -> int:
+        # Persistables created before hash versioning used the legacy behavior
+        return self.state.get('hash_version', HASH_VERSION_LEGACY)
+
+    @property
+    def hash_backend(self) -> str:
+        # Persistables created before configurable backends used md5
+        return self.state.get('hash_backend', HASH_BACKEND_MD5)
+
     @abstractmethod
     def _hash(self):
         '''
@@ -158,6 +211,41 @@ class Persistable(with_metaclass(MetaRegistry, SimplemlCoreSqlalchemy, CustomHas
         to assert identity across code definitions
         '''
 
+    def _hash_fingerprint(self) -> Optional[Tuple]:
+        '''
+        Hook for a cheap, in-process only, fingerprint of every input to `_hash`.
+        The hash is memoized until the fingerprint changes. Returning None
+        (default) disables memoization
+        '''
+        return None
+
+    @staticmethod
+    def _dependency_fingerprint(dependency: Optional['Persistable']) -> Optional[Any]:
+        '''
+        Fingerprint of an upstream persistable (hash if already computed).
+        Returns None if the dependency does not support memoization
+        '''
+        if dependency is None:
+            return ()
+        return dependency.hash_ or dependency._hash_fingerprint()
+
+    def _cached_hash(self) -> str:
+        '''
+        Memoized `_hash`. Only recomputed if the inputs (as represented by
+        `_hash_fingerprint`) changed since the last call
+        '''
+        fingerprint = self._hash_fingerprint()
+        hash_cache = getattr(self, '_hash_cache', None)
+        if fingerprint is not None and hash_cache is not None and hash_cache[0] == (self.hash_backend, fingerprint):
+            return hash_cache[1]
+
+        hash_ = self._hash()
+        # Fingerprint after hashing in case data was lazily built while hashing
+        fingerprint = self._hash_fingerprint()
+        if fingerprint is not None:
+            self._hash_cache = ((self.hash_backend, fingerprint), hash_)
+        return hash_
+
     def _get_latest_version(self) -> int:
         '''
         Versions should be autoincrementing for each object (constrained over
@@ -186,7 +274,7 @@ class Persistable(with_metaclass(MetaRegistry, SimplemlCoreSqlalchemy, CustomHas
             self.save_external_files()
 
         # Hash contents upon save
-        self.hash_ = self._hash()
+        self.hash_ = self._cached_hash()
 
         # Get the latest version for this "friendly name"
         self.version = self._get_latest_version()
@@ -196,7 +284,7 @@ class Persistable(with_metaclass(MetaRegistry, SimplemlCoreSqlalchemy, CustomHas
 
         super(Persistable, self).save()
 
-    def save_external_files(self) -> None:
+    def save_external_files(self, workers: Optional[int] = None) -> None:
         '''
         Main routine to save registered external artifacts. Each save pattern
         is defined using the standard api for the save params defined here. If
@@ -208,23 +296,91 @@ class Persistable(with_metaclass(MetaRegistry, SimplemlCoreSqlalchemy, CustomHas
             'persistable_type': the persistable type (DATASET/PIPELINE..),
             'overwrite': boolean. shortcut in case save pattern redefines a serialization routine
         }
+
+        :param workers: number of threads to save with. Defaults to the
+            configured `[persistence] save_workers` (serial). When concurrent,
+            every pattern is attempted and all failures are reported together
+
+        Artifacts saved to more than one destination are serialized once and
+        shared across their save patterns (see `SerializationCache`). Single
+        destinations are written directly
         '''
-        save_params: Dict[str, Union[str, bool]]
+        if workers is None:
+            workers = DEFAULT_SAVE_WORKERS
+
+        save_params: Dict[str, Union[str, bool, int]]
         save_params = {
             'persistable_id': str(self.id),
             'persistable_type': self.object_type,
             'overwrite': False,
         }
-        # Iterate through each artifact and save
-        for artifact_name, save_patterns in self.state.get('save_patterns', {}).items():
-            # Artifact has to be registered in self.ARTIFACTS
-            obj = self.get_artifact(artifact_name)
-            # Iterate through list of save methods
-            for save_pattern in save_patterns:
-                self.save_external_file(
-                    artifact_name=artifact_name,
-                    save_pattern=save_pattern,
-                    obj=obj, **save_params)
+        # Unset compression falls back to the save pattern defaults
+        for key in ('compression', 'compression_level'):
+            if self.state.get(key) is not None:
+                save_params[key] = self.state[key]
+        # Iterate through each artifact and list of save methods
+        # Artifact has to be registered in self.ARTIFACTS
+        save_tasks = [
+            (artifact_name, save_pattern, self.get_artifact(artifact_name))
+            for artifact_name, save_patterns in self.state.get('save_patterns', {}).items()
+            for save_pattern in save_patterns
+        ]
+
+        # Only buffer serializations that will be reused
+        destinations = Counter(id(obj) for _, _, obj in save_tasks)
+        shared = any(count > 1 for count in destinations.values())
+
+        cache = SerializationCache() if shared else None
+        try:
+            with activate_serialization_cache(cache):
+                if workers > 1 and len(save_tasks) > 1:
+                    self._parallel_save_external_files(save_tasks, workers, cache=cache, **save_params)
+                    return
+
+                for artifact_name, save_pattern, obj in save_tasks:
+                    self.save_external_file(
+                        artifact_name=artifact_name,
+                        save_pattern=save_pattern,
+                        obj=obj, **save_params)
+        finally:
+            if cache is not None:
+                cache.clear()
+
+    def _parallel_save_external_files(self,
+                                      save_tasks: List[Tuple[str, str, Any]],
+                                      workers: int,
+                                      cache: Optional[SerializationCache] = None,
+                                      **save_params) -> None:
+        '''
+        Fan out the (artifact, save pattern, object) saves to a thread pool.
+        Filepaths are recorded on the calling thread in the configured order
+        (which is the restore priority)
+
+        :param cache: serialization cache of this save, activated in the
+            worker threads
+        '''
+        def _save(save_pattern: str, obj: Any) -> Any:
+            with activate_serialization_cache(cache):
+                return self._save_with_pattern(save_pattern, obj=obj, **save_params)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                (artifact_name, save_pattern, executor.submit(_save, save_pattern, obj))
+                for artifact_name, save_pattern, obj in save_tasks
+            ]
+
+            errors = []
+            for artifact_name, save_pattern, future in futures:
+                try:
+                    filepath_data = future.result()
+                except Exception as e:
+                    LOGGER.error(f'Failed to save {artifact_name} via {save_pattern} ({e})')
+                    errors.append(f'{artifact_name} via {save_pattern} ({e!r})')
+                    continue
+                self._record_filepath(artifact_name, save_pattern, filepath_data)
+
+        if errors:
+            raise SimpleMLError(f'Unable to save artifacts: {"; ".join(errors)}')
 
     def save_external_file(self,
                            artifact_name: str,
@@ -235,6 +391,16 @@ class Persistable(with_metaclass(MetaRegistry, SimplemlCoreSqlalchemy, CustomHas
         Abstracted pattern to save an artifact via one of the registered
         patterns and update the filepaths location
         '''
+        filepath_data = self._save_with_pattern(save_pattern, cls=cls, **save_params)
+        self._record_filepath(artifact_name, save_pattern, filepath_data)
+
+    @staticmethod
+    def _save_with_pattern(save_pattern: str,
+                           cls: Optional[Type] = None,
+                           **save_params) -> Any:
+        '''
+        Save via the registered (or passed) class and return the filepath data
+        '''
         if cls is None:
             # Look up in registry
             save_cls = SAVE_METHOD_REGISTRY.get(save_pattern)
@@ -245,9 +411,12 @@ class Persistable(with_metaclass(MetaRegistry, SimplemlCoreSqlalchemy, CustomHas
         if save_cls is None:
             raise SimpleMLError(f'No registered save pattern for {save_pattern}')
 
-        filepath_data = save_cls.save(**save_params)
+        return save_cls.save(**save_params)
 
-        # Update filepaths
+    def _record_filepath(self, artifact_name: str, save_pattern: str, filepath_data: Any) -> None:
+        '''
+        Update filepaths with the location of a saved artifact
+        '''
         if self.filepaths is None:
             self.filepaths = {}
         if self.filepaths.get(artifact_name, None) is None:
@@ -292,31 +461,106 @@ class Persistable(with_metaclass(MetaRegistry, SimplemlCoreSqlalchemy, CustomHas
         if self.has_external_files and load_externals:
             self.load_external_files()
 
-    def load_external_files(self, artifact_name: Optional[str] = None) -> None:
+    def load_external_files(self,
+                            artifact_name: Optional[str] = None,
+                            workers: Optional[int] = None,
+                            hedge_delay: Optional[float] = None) -> None:
         '''
         Main routine to restore registered external artifacts. Will iterate
         through save patterns and break after the first successful restore
         (allows robustness in the event of unavailable resources)
+
+        :param workers: number of artifacts to restore concurrently. Defaults
+            to the configured `[persistence] load_workers` (serial)
+        :param hedge_delay: seconds to wait on a save pattern before also
+            starting the next one. Defaults to the configured
+            `[persistence] hedge_delay` (no hedging, fallback on failure only)
         '''
-        def _load(artifact_name: str, save_patterns: Dict[str, Any]):
+        if workers is None:
+            workers = DEFAULT_LOAD_WORKERS
+        if hedge_delay is None:
+            hedge_delay = DEFAULT_HEDGE_DELAY
+
+        def _load(artifact_name: str, save_patterns: Dict[str, Any]) -> Any:
+            if hedge_delay is not None and len(save_patterns) > 1:
+                return self._hedged_load_external_file(artifact_name, list(save_patterns), hedge_delay)
+
             # Iterate through dict of save methods and file data
             for save_pattern in save_patterns:
                 try:
-                    obj = self.load_external_file(artifact_name, save_pattern)
-                    self.restore_artifact(artifact_name, obj)
-                    break
+                    return self.load_external_file(artifact_name, save_pattern)
                 except Exception as e:
                     LOGGER.error(f'Failed to restore {artifact_name} via {save_pattern} ({e}). Trying next save pattern...')
-            else:
-                raise SimpleMLError(f'Unable to restore {artifact_name} via any registered pattern')
+            raise SimpleMLError(f'Unable to restore {artifact_name} via any registered pattern')
 
         # Iterate through each artifact and restore
         # Dont use self.unloaded_artifacts list to force a full reload
         if artifact_name is None:
-            for artifact_name, save_patterns in self.filepaths.items():
-                _load(artifact_name, save_patterns)
+            artifacts = list(self.filepaths.items())
         else:
-            _load(artifact_name, self.filepaths.get(artifact_name, {}))
+            artifacts = [(artifact_name, self.filepaths.get(artifact_name, {}))]
+
+        if workers <= 1 or len(artifacts) <= 1:
+            try:
+                for artifact_name, save_patterns in artifacts:
+                    self.restore_artifact(artifact_name, _load(artifact_name, save_patterns))
+            finally:
+                # Restored artifacts count towards the cache bounds
+                PERSISTABLE_CACHE.remeasure(self)
+            return
+
+        # Artifacts are restored on the calling thread as they complete
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                (artifact_name, executor.submit(_load, artifact_name, save_patterns))
+                for artifact_name, save_patterns in artifacts
+            ]
+            errors = []
+            for artifact_name, future in futures:
+                try:
+                    self.restore_artifact(artifact_name, future.result())
+                except Exception as e:
+                    errors.append(str(e))
+
+        PERSISTABLE_CACHE.remeasure(self)
+        if errors:
+            raise SimpleMLError(f'Unable to restore artifacts: {"; ".join(errors)}')
+
+    def _hedged_load_external_file(self,
+                                   artifact_name: str,
+                                   save_patterns: List[str],
+                                   hedge_delay: float) -> Any:
+        '''
+        Load an artifact by starting save patterns in priority order, each one
+        after the previous has failed or been outstanding for `hedge_delay`
+        seconds. Returns the first successful load (by priority if several
+        finish together). Slower loads are abandoned and left to finish in
+        the background
+        '''
+        executor = ThreadPoolExecutor(max_workers=len(save_patterns))
+        remaining = list(save_patterns)
+        futures = {}
+        try:
+            while remaining or futures:
+                if remaining:
+                    save_pattern = remaining.pop(0)
+                    futures[executor.submit(self.load_external_file, artifact_name, save_pattern)] = save_pattern
+
+                # Nothing left to hedge with, wait for the outstanding loads
+                timeout = hedge_delay if remaining else None
+                done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=lambda future: save_patterns.index(futures[future])):
+                    save_pattern = futures.pop(future)
+                    try:
+                        return future.result()
+                    except Exception as e:
+                        LOGGER.error(f'Failed to restore {artifact_name} via {save_pattern} ({e}). Trying next save pattern...')
+                if not done and remaining:
+                    LOGGER.info(f'Restore of {artifact_name} outstanding after {hedge_delay}s, hedging with next save pattern')
+
+            raise SimpleMLError(f'Unable to restore {artifact_name} via any registered pattern')
+        finally:
+            executor.shutdown(wait=False)
 
     def load_external_file(self,
                            artifact_name: str,
@@ -7,25 +7,150 @@ __author__ = 'Elisha Yadgaran'
 
 import pandas as pd
 import numpy as np
+import hashlib
 import inspect
 import logging
+import pickle
+import struct
+import weakref
 
+from concurrent.futures import ThreadPoolExecutor
 from pandas.util import hash_pandas_object
-from typing import Any, Type
+from typing import Any, Type, Tuple, Iterable, Union, Optional, Callable
 
-from simpleml._external.joblib import hash as deterministic_hash
+from simpleml._external.joblib import hash as deterministic_hash, NumpyHasher
+from simpleml.imports import xxhash
+from simpleml.utils.configuration import CONFIG, HASHING_SECTION
+from simpleml.utils.errors import SimpleMLError
 
 
 LOGGER = logging.getLogger(__name__)
 
 
+# Hash versions. Hashes are only stable within a version, so new hashing
+# behavior is opt-in via a new version and old versions are never changed
+# 1: Original implementation. Pandas objects are prehashed element-wise
+HASH_VERSION_LEGACY: int = 1
+# 2: Pandas objects are hashed natively per column. Only object columns that
+#    contain numpy arrays are prehashed element-wise. Matches version 1 for
+#    common dtypes, but skips the dtype inference of the element-wise pass
+HASH_VERSION_COLUMNAR: int = 2
+HASH_VERSIONS: Tuple[int, ...] = (HASH_VERSION_LEGACY, HASH_VERSION_COLUMNAR)
+DEFAULT_HASH_VERSION: int = HASH_VERSION_LEGACY
+
+# Parallel pandas hashing. Row blocks are hashed on a thread pool (the
+# vectorized hashing releases the GIL) and summed, which is order independent
+# so the output is identical to serial hashing. Configured via:
+# [hashing]
+# workers = 4
+DEFAULT_HASH_WORKERS: int = CONFIG.getint(HASHING_SECTION, 'workers', fallback=1)
+# Smaller objects are not worth the thread overhead
+PARALLEL_HASH_MIN_ROWS: int = CONFIG.getint(HASHING_SECTION, 'parallel_min_rows', fallback=100000)
+
+# Digest algorithms. md5 (pickle based) is the original backend. Any hashlib
+# algorithm (eg blake2b) or xxhash (optional dependency) can be configured via:
+# [hashing]
+# backend = blake2b
+# Non md5 backends also hash numpy arrays directly from their buffers
+HASH_BACKEND_MD5: str = 'md5'
+HASH_BACKEND_XXHASH: str = 'xxhash'
+DEFAULT_HASH_BACKEND: str = CONFIG.get(HASHING_SECTION, 'backend', fallback=HASH_BACKEND_MD5)
+# Pickle protocol of the md5 backend (pinned in the joblib hasher)
+LEGACY_PICKLE_PROTOCOL: int = 3
+
+
+def get_hash_backend(hash_backend: str) -> Callable[[], Any]:
+    '''
+    Returns a constructor for a hashlib compatible digest object
+    (update/hexdigest interface) for the backend name. Variable length
+    digests (ex: shake_128) are not supported since `hexdigest` needs a length
+    '''
+    if hash_backend == HASH_BACKEND_XXHASH:
+        # Missing dependency wrapper raises an informative error on call
+        return getattr(xxhash, 'xxh3_128', xxhash)
+    if hash_backend in hashlib.algorithms_available:
+        if not hashlib.new(hash_backend).digest_size:
+            raise SimpleMLError(f'Variable length digest {hash_backend} is not supported as a hash backend')
+        return lambda: hashlib.new(hash_backend)
+    raise ValueError(f'Unsupported hash backend: {hash_backend}')
+
+
+class BackendHasher(NumpyHasher):
+    '''
+    Pickle based object hasher with a configurable digest. Numpy arrays are
+    fed to the digest from their buffers instead of being pickled
+    '''
+
+    def __init__(self, hash_backend: str):
+        NumpyHasher.__init__(self)
+        self._hash = get_hash_backend(hash_backend)()
+
+
+def backend_hash(obj: Any, hash_backend: str = HASH_BACKEND_MD5) -> str:
+    '''
+    Deterministic hash of a python object with the specified digest backend.
+    md5 retains the original implementation
+    '''
+    if hash_backend == HASH_BACKEND_MD5:
+        return deterministic_hash(obj)
+    return BackendHasher(hash_backend).hash(obj)
+
+
+class IdentityFingerprint(object):
+    '''
+    Fingerprint component that compares equal only for the exact same object.
+    Holds a weak reference where possible so fingerprints do not keep large
+    objects (eg dataframes) alive
+    '''
+
+    def __init__(self, obj: Any):
+        self.is_none = obj is None
+        try:
+            self._ref = weakref.ref(obj)
+        except TypeError:
+            self._ref = lambda: obj
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, IdentityFingerprint) or self.is_none != other.is_none:
+            return False
+        # Dead references never match (the object was replaced)
+        obj = self._ref()
+        return obj is other._ref() and (obj is not None or self.is_none)
+
+    def __ne__(self, other: Any) -> bool:
+        return not self.__eq__(other)
+
+    def __repr__(self) -> str:
+        return f'IdentityFingerprint({self._ref()!r})'
+
+
+class HashableChunks(object):
+    '''
+    Wrapper to hash an iterable of row chunks as a single object without
+    materializing the whole thing. Supports chunks of:
+        - pandas objects: combined digest is identical to hashing the
+            concatenated object (row hashes are summed)
+        - numpy arrays: digest of the dtype, trailing shape and raw buffer of
+            each block, independent of where the chunk boundaries fall
+    '''
+
+    def __init__(self, chunks: Iterable[Any]):
+        self.chunks = chunks
+
+    def __repr__(self) -> str:
+        return f'HashableChunks({self.chunks!r})'
+
+
 class CustomHasherMixin(object):
     '''
     Mixin class to hash any object
     '''
     @classmethod
     def custom_hasher(cls,
-                      object_to_hash: Any) -> str:
+                      object_to_hash: Any,
+                      hash_version: int = DEFAULT_HASH_VERSION,
+                      workers: Optional[int] = None,
+                      hash_backend: Optional[str] = None) -> str:
         """
         Adapted from: https://stackoverflow.com/questions/5884066/hashing-a-dictionary
         Makes a hash from a dictionary, list, tuple or set to any level, that
@@ -43,7 +168,24 @@ class CustomHasherMixin(object):
         python 3.3+ changes the default hash method to add an additional random
         seed. Need to set the global PYTHONHASHSEED=0 or use a different hash
         function
+
+        `hash_version` selects the hashing behavior (see HASH_VERSIONS). Outputs
+        are only comparable between objects hashed with the same version
+
+        `workers` sets the thread count for hashing large pandas objects.
+        Defaults to the configured `[hashing] workers` (serial)
+
+        `hash_backend` sets the digest algorithm. Defaults to the configured
+        `[hashing] backend` (md5)
         """
+        if workers is None:
+            workers = DEFAULT_HASH_WORKERS
+        if hash_backend is None:
+            hash_backend = DEFAULT_HASH_BACKEND
+
+        def recurse(obj: Any) -> Any:
+            return cls.custom_hasher(obj, hash_version, workers, hash_backend)
+
         LOGGER.debug(f'Hashing input: {object_to_hash}')
 
         # Class attribute dict (mappingproxy class)
@@ -57,21 +199,36 @@ class CustomHasherMixin(object):
         LOGGER.debug(f'hash type: {type(object_to_hash)}')
 
         if isinstance(object_to_hash, (set, tuple, list)):
-            hash_output = deterministic_hash(tuple([cls.custom_hasher(e) for e in object_to_hash]))
+            hash_output = backend_hash(tuple([recurse(e) for e in object_to_hash]), hash_backend)
+
+        elif isinstance(object_to_hash, np.ndarray) and hash_backend != HASH_BACKEND_MD5 and not object_to_hash.dtype.hasobject:
+            hash_output = cls._array_hash(object_to_hash, hash_backend)
+
+        elif isinstance(object_to_hash, np.ndarray) and not object_to_hash.dtype.hasobject:
+            hash_output = cls._legacy_array_hash(object_to_hash)
 
         elif isinstance(object_to_hash, np.ndarray):
-            hash_output = cls.custom_hasher(object_to_hash.tostring())
+            hash_output = recurse(object_to_hash.tobytes())
+
+        elif isinstance(object_to_hash, HashableChunks):
+            hash_output = cls._chunked_hash(object_to_hash.chunks, hash_version, workers, hash_backend)
+
+        elif isinstance(object_to_hash, (pd.DataFrame, pd.Series)) and workers > 1 and len(object_to_hash) >= PARALLEL_HASH_MIN_ROWS:
+            hash_output = cls._parallel_pandas_hash(object_to_hash, hash_version, workers, hash_backend)
+
+        elif isinstance(object_to_hash, (pd.DataFrame, pd.Series)) and hash_version >= HASH_VERSION_COLUMNAR:
+            hash_output = cls._columnar_pandas_hash(object_to_hash, hash_version, hash_backend)
 
         elif isinstance(object_to_hash, pd.DataFrame):
             # Pandas is unable to hash numpy arrays so prehash those
             hash_output = hash_pandas_object(object_to_hash.applymap(
-                lambda element: cls.custom_hasher(element) if isinstance(element, np.ndarray) else element),
+                lambda element: recurse(element) if isinstance(element, np.ndarray) else element),
                 index=False).sum()
 
         elif isinstance(object_to_hash, pd.Series):
             # Pandas is unable to hash numpy arrays so prehash those
             hash_output = hash_pandas_object(object_to_hash.apply(
-                lambda element: cls.custom_hasher(element) if isinstance(element, np.ndarray) else element),
+                lambda element: recurse(element) if isinstance(element, np.ndarray) else element),
                 index=False).sum()
 
         elif object_to_hash is None:
@@ -79,15 +236,15 @@ class CustomHasherMixin(object):
             hash_output = -12345678987654321
 
         elif isinstance(object_to_hash, dict):
-            hash_output = deterministic_hash(tuple(
-                sorted([cls.custom_hasher(item) for item in object_to_hash.items()])
-            ))
+            hash_output = backend_hash(tuple(
+                sorted([recurse(item) for item in object_to_hash.items()])
+            ), hash_backend)
 
         elif isinstance(object_to_hash, type(lambda: 0)):
             # Functions dont hash consistently because of the halting problem
             # https://stackoverflow.com/questions/33998594/hash-for-lambda-function-in-python
             # Attempt to use the source code string
-            hash_output = cls.custom_hasher(inspect.getsource(object_to_hash))
+            hash_output = recurse(inspect.getsource(object_to_hash))
 
         elif isinstance(object_to_hash, type):  # uninitialized classes
             # Have to keep this at the end of the try list
@@ -101,14 +258,14 @@ class CustomHasherMixin(object):
             # WARNING: module paths reflect import paths and will be different
             # depending on how a class is imported (from a import cls != from library.a import cls)
             LOGGER.warning(f'Hashing class import path for {object_to_hash}, if a fully qualified import path is not used, calling again from a different location will yield different results!')
-            hash_output = cls.custom_hasher(f"{object_to_hash.__module__}.{object_to_hash.__name__}")
+            hash_output = recurse(f"{object_to_hash.__module__}.{object_to_hash.__name__}")
             # return self.custom_hasher(inspect.getsource(object_to_hash))
 
         elif isinstance(object_to_hash, object) and hasattr(object_to_hash, '__dict__'):
             # Everything is an object so keep this at the very end.
             # Should only match initialized objects at this point
             # Represent as a tuple of (class, __dict__)
-            hash_output = cls.custom_hasher((object_to_hash.__class__, object_to_hash.__dict__))
+            hash_output = recurse((object_to_hash.__class__, object_to_hash.__dict__))
 
         else:
             # primitives (str, int, float)
@@ -116,7 +273,145 @@ class CustomHasherMixin(object):
             # decomposition for the object
             if not isinstance(object_to_hash, (float, str, int)):
                 LOGGER.warning(f'Unable to find suitable representation of {object_to_hash}, passing through to hash function directly. (This may result in future breaking changes)')
-            hash_output = deterministic_hash(object_to_hash)
+            hash_output = backend_hash(object_to_hash, hash_backend)
 
         LOGGER.debug(f'Hashing output: {hash_output}')
         return hash_output
+
+    @classmethod
+    def _prehash_arrays(cls, column: pd.Series, hash_version: int, hash_backend: str) -> pd.Series:
+        '''
+        Pandas is unable to hash numpy arrays so prehash those. Only object
+        columns can hold arrays, everything else is returned as is
+        '''
+        if column.dtype != object:
+            return column
+        if not any(isinstance(element, np.ndarray) for element in column.values):
+            return column
+        return column.map(
+            lambda element: cls.custom_hasher(element, hash_version, 1, hash_backend) if isinstance(element, np.ndarray) else element)
+
+    @classmethod
+    def _columnar_pandas_hash(cls, object_to_hash: Any, hash_version: int, hash_backend: str) -> np.int64:
+        '''
+        Hash pandas objects natively (vectorized per column). Per element work
+        is only done for object columns that contain numpy arrays
+        '''
+        try:
+            return hash_pandas_object(object_to_hash, index=False).sum()
+        except TypeError:
+            LOGGER.debug('Unable to natively hash pandas object, prehashing array elements')
+
+        if isinstance(object_to_hash, pd.Series):
+            prehashed = cls._prehash_arrays(object_to_hash, hash_version, hash_backend)
+        else:
+            # Positional access to support duplicate column names
+            prehashed = pd.concat(
+                [cls._prehash_arrays(object_to_hash.iloc[:, i], hash_version, hash_backend)
+                 for i in range(object_to_hash.shape[1])],
+                axis=1
+            )
+        return hash_pandas_object(prehashed, index=False).sum()
+
+    @classmethod
+    def _chunked_hash(cls,
+                      chunks: Iterable[Any],
+                      hash_version: int,
+                      workers: int,
+                      hash_backend: str) -> Union[np.int64, str]:
+        '''
+        Streaming hash over row chunks. Only a single chunk is held at a time
+        '''
+        pandas_sum = None
+        array_hash = None
+        array_signature = None
+
+        for chunk in chunks:
+            if isinstance(chunk, (pd.DataFrame, pd.Series)):
+                if array_hash is not None:
+                    raise TypeError('Cannot mix pandas and numpy chunks')
+                pandas_sum = (pandas_sum or 0) + int(cls.custom_hasher(chunk, hash_version, workers, hash_backend))
+
+            elif isinstance(chunk, np.ndarray):
+                if pandas_sum is not None:
+                    raise TypeError('Cannot mix pandas and numpy chunks')
+                if chunk.dtype.hasobject:
+                    raise TypeError('Object arrays cannot be hashed from their buffer')
+                signature = (chunk.dtype.str, chunk.shape[1:])
+                if array_hash is None:
+                    array_hash = get_hash_backend(hash_backend)()
+                    array_hash.update(repr(signature).encode())
+                    array_signature = signature
+                elif signature != array_signature:
+                    raise TypeError(f'Inconsistent chunk dtype or shape: {signature} != {array_signature}')
+                array_hash.update(np.ascontiguousarray(chunk).reshape(-1).view(np.uint8).data)
+
+            else:
+                raise TypeError(f'Unsupported chunk type for streaming hash: {type(chunk)}')
+
+        if array_hash is not None:
+            return array_hash.hexdigest()
+        return cls._combine_row_hash_sums([pandas_sum or 0])
+
+    @classmethod
+    def _parallel_pandas_hash(cls, object_to_hash: Any, hash_version: int, workers: int, hash_backend: str) -> np.int64:
+        '''
+        Hash row blocks on a thread pool and combine. Row hashes are summed so
+        the result does not depend on the blocking
+        '''
+        block_size = -(-len(object_to_hash) // workers)
+        blocks = [object_to_hash.iloc[i:i + block_size] for i in range(0, len(object_to_hash), block_size)]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            block_hashes = list(executor.map(lambda block: cls.custom_hasher(block, hash_version, 1, hash_backend), blocks))
+
+        return cls._combine_row_hash_sums(block_hashes)
+
+    @staticmethod
+    def _array_hash(array: np.ndarray, hash_backend: str) -> str:
+        '''
+        Digest of the dtype, shape and raw buffer of an array. No pickling or
+        intermediate bytes copy for contiguous arrays
+        '''
+        digest = get_hash_backend(hash_backend)()
+        digest.update(repr((array.dtype.str, array.shape)).encode())
+        digest.update(np.ascontiguousarray(array).reshape(-1).view(np.uint8).data)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _legacy_array_hash(array: np.ndarray) -> str:
+        '''
+        md5 digest of an array, identical to hashing its bytes copy
+        (`recurse(array.tobytes())`) but fed from the array buffer. The pickle
+        stream of a bytes object is reproduced around the raw data so existing
+        hashes are unchanged without doubling peak memory. Only non contiguous
+        arrays are copied (C order, like `tobytes`)
+        '''
+        data = np.ascontiguousarray(array).reshape(-1).view(np.uint8)
+        size = data.nbytes
+        if size <= 0xff:
+            header = pickle.SHORT_BINBYTES + struct.pack('<B', size)
+        elif size <= 0xffffffff:
+            header = pickle.BINBYTES + struct.pack('<I', size)
+        else:
+            # Protocol 3 cannot pickle >4GB bytes objects so there is no
+            # legacy hash to match. Use the protocol 4 opcode
+            header = pickle.BINBYTES8 + struct.pack('<Q', size)
+
+        digest = hashlib.md5()
+        digest.update(pickle.PROTO + struct.pack('<B', LEGACY_PICKLE_PROTOCOL) + header)
+        digest.update(data.data)
+        digest.update(pickle.STOP)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _combine_row_hash_sums(row_hash_sums: Iterable[Any]) -> np.int64:
+        '''
+        Combine partial `hash_pandas_object(...).sum()` outputs into the same
+        value as the sum over the whole object (pandas returns the 64 bit
+        wraparound sum as a signed int64)
+        '''
+        total = sum(int(i) for i in row_hash_sums) % 2 ** 64
+        if total >= 2 ** 63:
+            total -= 2 ** 64
+        return np.int64(total)
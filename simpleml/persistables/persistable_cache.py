@@ -0,0 +1,207 @@
+'''
+Module for the process wide cache of loaded persistables
+
+Loading a persistable queries the database, reinstantiates the class and
+(lazily) restores its external artifacts. Long running processes (ex: a
+scoring service) repeatedly load the same persistables, so hydrated
+persistables are kept in a bounded LRU cache keyed on id and hash. The
+database lookup still runs (to resolve filters like the latest version), but
+a matching cached persistable is returned instead of being reloaded.
+
+Disabled by default: every caller shares the same cached object, so
+mutations (ex: setting attributes, restoring artifacts) are visible to all
+of them instead of each load returning a fresh persistable. Configured via:
+```
+[persistence]
+persistable_cache_entries = 64  # 0 (default) disables the cache
+persistable_cache_bytes = 1073741824
+```
+'''
+
+__author__ = 'Elisha Yadgaran'
+
+
+import logging
+import threading
+
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from simpleml.utils.configuration import CONFIG, PERSISTENCE_SECTION
+from simpleml.utils.memory import estimate_memory_usage
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+DEFAULT_PERSISTABLE_CACHE_ENTRIES: int = CONFIG.getint(PERSISTENCE_SECTION, 'persistable_cache_entries', fallback=0)
+DEFAULT_PERSISTABLE_CACHE_BYTES: int = CONFIG.getint(PERSISTENCE_SECTION, 'persistable_cache_bytes', fallback=1024 ** 3)
+
+
+def estimate_persistable_size(persistable: Any) -> int:
+    '''
+    Approximate memory held by a persistable's restored artifacts. Artifacts
+    that have not been loaded yet do not count
+    '''
+    unloaded = getattr(persistable, 'unloaded_artifacts', [])
+    size = 0
+    for attribute in dir(type(persistable)):
+        if not attribute.startswith('_ARTIFACT_') or attribute[len('_ARTIFACT_'):] in unloaded:
+            continue
+        restore_attribute = getattr(persistable, attribute)['restore']
+        size += estimate_memory_usage(persistable.__dict__.get(restore_attribute))
+    return size
+
+
+class PersistableCache(object):
+    '''
+    LRU cache of loaded persistables keyed on (id, hash)
+
+    Bounded by number of entries and by the estimated size of the restored
+    artifacts. Sizes are measured when a persistable is added and again
+    whenever it restores artifacts (see `remeasure`), so lazily loaded
+    artifacts count towards the bound
+    '''
+
+    def __init__(self,
+                 max_entries: int = DEFAULT_PERSISTABLE_CACHE_ENTRIES,
+                 max_bytes: Optional[int] = DEFAULT_PERSISTABLE_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Tuple[str, str], Tuple[Any, int]]' = OrderedDict()
+        self._size: int = 0
+        self._lock = threading.RLock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, persistable: Any) -> bool:
+        return self.build_key(persistable.id, persistable.hash_) in self._entries
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @property
+    def size(self) -> int:
+        '''
+        Estimated number of bytes currently held
+        '''
+        return self._size
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self._size,
+        }
+
+    @staticmethod
+    def build_key(id: Any, hash_: Any) -> Tuple[str, str]:
+        return (str(id), str(hash_))
+
+    def get(self, id: Any, hash_: Any) -> Optional[Any]:
+        '''
+        Return the cached persistable for the id, if the hash still matches
+        '''
+        if not self.enabled:
+            return None
+
+        key = self.build_key(id, hash_)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, persistable: Any) -> None:
+        '''
+        Add (or refresh) a loaded persistable. Persistables larger than the
+        whole cache are not stored
+        '''
+        if not self.enabled:
+            return
+
+        key = self.build_key(persistable.id, persistable.hash_)
+        size = estimate_persistable_size(persistable)
+        with self._lock:
+            self._pop(key)
+            # Drop stale entries for the same id (ex: recalculated hash)
+            for stale_key in [i for i in self._entries if i[0] == key[0]]:
+                self._pop(stale_key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                LOGGER.debug(f'Skipping persistable cache for {key}, exceeds max size')
+                return
+            self._entries[key] = (persistable, size)
+            self._size += size
+            self._evict()
+
+    def remeasure(self, persistable: Any) -> None:
+        '''
+        Update the size of a cached persistable (ex: after restoring
+        artifacts) and evict to stay within the bounds. No-op for
+        persistables that are not cached
+        '''
+        if not self.enabled or not self._entries:
+            return
+
+        key = self.build_key(persistable.id, persistable.hash_)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not persistable:
+                return
+        size = estimate_persistable_size(persistable)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not persistable:
+                return
+            self._size += size - entry[1]
+            self._entries[key] = (persistable, size)
+            if self.max_bytes is not None and size > self.max_bytes:
+                LOGGER.debug(f'Dropping {key} from persistable cache, exceeds max size')
+                self._pop(key)
+                return
+            self._evict()
+
+    def _pop(self, key: Tuple[str, str]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def _evict(self) -> None:
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and self._size > self.max_bytes)
+        ):
+            key, (_, size) = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            LOGGER.debug(f'Evicted {key} from persistable cache')
+
+    def invalidate(self, id: Optional[Any] = None) -> None:
+        '''
+        Drop the entries for a persistable id. No id clears the cache
+        '''
+        with self._lock:
+            if id is None:
+                self._entries.clear()
+                self._size = 0
+                return
+            for key in [i for i in self._entries if i[0] == str(id)]:
+                self._pop(key)
+
+    def clear(self) -> None:
+        self.invalidate()
+
+
+# Process wide instance
+PERSISTABLE_CACHE = PersistableCache()
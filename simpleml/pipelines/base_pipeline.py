@@ -11,7 +11,7 @@ import pandas as pd
 from sqlalchemy import Column, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from future.utils import with_metaclass
-from typing import Optional, List, Any, Union, Generator, TYPE_CHECKING
+from typing import Optional, List, Any, Union, Generator, Tuple, TYPE_CHECKING
 
 from simpleml.constants import TRAIN_SPLIT
 from simpleml.imports import Sequence
@@ -156,12 +156,25 @@ class AbstractPipeline(with_metaclass(PipelineRegistry, Persistable)):
             3) Transformer Params
             4) Pipeline Config
         '''
-        dataset_hash = self.dataset.hash_ or self.dataset._hash()
+        dataset_hash = self.dataset.hash_ or self.dataset._cached_hash()
         transformers = self.get_transformers()
         transformer_params = self.get_params(params_only=True)
         pipeline_config = self.config
 
-        return self.custom_hasher((dataset_hash, transformers, transformer_params, pipeline_config))
+        return self.custom_hasher((dataset_hash, transformers, transformer_params, pipeline_config), self.hash_version, hash_backend=self.hash_backend)
+
+    def _hash_fingerprint(self) -> Optional[Tuple]:
+        dataset_fingerprint = self._dependency_fingerprint(self.dataset)
+        if dataset_fingerprint is None:
+            return None
+        return (
+            self.hash_version,
+            dataset_fingerprint,
+            # Hashed, reprs elide large params (ex: arrays)
+            self.custom_hasher(
+                (self.get_transformers(), self.get_params(params_only=True), self.config),
+                self.hash_version, hash_backend=self.hash_backend)
+        )
 
     def save(self, **kwargs) -> None:
         '''
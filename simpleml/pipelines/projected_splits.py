@@ -1,19 +1,156 @@
 '''
 Module for dataset projection into pipelines. Defines transfer objects
 returned from pipelines
+
+Projected splits can memoize the materialized split so accessing several
+sections (ex: `split.X` then `split.y`) only retrieves and projects the
+dataset split once. Memoized splits are held in a shared LRU cache that is
+bounded across all projected splits and drops entries when their projected
+split is garbage collected. Memoized sections are shared between accesses,
+so memoization is opt-in. Configured via:
+```
+[persistence]
+projected_split_cache_entries = 16  # 0 (default) disables memoization
+projected_split_cache_bytes = 1073741824
+```
 '''
 
 __author__ = 'Elisha Yadgaran'
 
 
+import itertools
+import logging
+import threading
+import weakref
+
 import pandas as pd
 import numpy as np
 
-from typing import Optional
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
 from abc import ABCMeta, abstractmethod
 
 from simpleml.datasets.base_dataset import Dataset
 from simpleml.datasets.dataset_splits import Split
+from simpleml.persistables.hashing import IdentityFingerprint
+from simpleml.utils.configuration import CONFIG, PERSISTENCE_SECTION
+from simpleml.utils.errors import PipelineError
+from simpleml.utils.memory import estimate_memory_usage
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+DEFAULT_PROJECTED_SPLIT_CACHE_ENTRIES: int = CONFIG.getint(PERSISTENCE_SECTION, 'projected_split_cache_entries', fallback=0)
+DEFAULT_PROJECTED_SPLIT_CACHE_BYTES: int = CONFIG.getint(PERSISTENCE_SECTION, 'projected_split_cache_bytes', fallback=1024 ** 3)
+
+
+class ProjectedSplitCache(object):
+    '''
+    LRU cache of materialized splits keyed on the projected split. Each entry
+    holds the dataset fingerprint it was computed from and is only returned
+    while the fingerprint still matches
+
+    Bounded by number of entries and by the estimated size of the splits.
+    Entries are dropped as soon as the owning projected split is garbage
+    collected, so the cache never keeps splits alive on its own
+    '''
+
+    def __init__(self,
+                 max_entries: int = DEFAULT_PROJECTED_SPLIT_CACHE_ENTRIES,
+                 max_bytes: Optional[int] = DEFAULT_PROJECTED_SPLIT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[int, Tuple[Tuple, Split, int]]' = OrderedDict()
+        self._size: int = 0
+        self._lock = threading.RLock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @property
+    def size(self) -> int:
+        '''
+        Estimated number of bytes currently held
+        '''
+        return self._size
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self._size,
+        }
+
+    def get(self, key: int, fingerprint: Tuple) -> Optional[Split]:
+        '''
+        Return the memoized split, if it was computed for the same fingerprint
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != fingerprint:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: int, fingerprint: Tuple, split: Split) -> None:
+        '''
+        Memoize a split. Splits larger than the whole cache are not stored
+        '''
+        if not self.enabled:
+            return
+
+        size = estimate_memory_usage(dict(split))
+        with self._lock:
+            self._pop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                LOGGER.debug(f'Skipping projected split cache for {key}, exceeds max size')
+                return
+            self._entries[key] = (fingerprint, split, size)
+            self._size += size
+            self._evict()
+
+    def discard(self, key: int) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key: int) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+    def _evict(self) -> None:
+        while self._entries and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes is not None and self._size > self.max_bytes)):
+            key, (_, _, size) = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            LOGGER.debug(f'Evicted projected split {key} from cache')
+
+    def clear(self) -> None:
+        '''
+        Drop all entries
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+PROJECTED_SPLIT_CACHE = ProjectedSplitCache()
+_CACHE_KEYS = itertools.count()
 
 
 class ProjectedDatasetSplit(metaclass=ABCMeta):
@@ -26,13 +163,23 @@ class ProjectedDatasetSplit(metaclass=ABCMeta):
 
     Wraps the normal Split object but delegates behavior so can be used
     interchangeably
+
+    If enabled, the projected split is memoized (see
+    `PROJECTED_SPLIT_CACHE`) until the dataset, its version or its data
+    object change. Sections are shared between accesses, so in place mutations of the data persist until the
+    memoized split is invalidated or evicted
     '''
 
     def __init__(self,
                  dataset: Dataset,
-                 split: Optional[str]):
+                 split: Optional[str],
+                 memoize: bool = True):
         self.dataset = dataset
         self.split = split
+        self.memoize = memoize
+        self._cache_key = next(_CACHE_KEYS)
+        # Clear the memoized split with the projection
+        weakref.finalize(self, PROJECTED_SPLIT_CACHE.discard, self._cache_key)
 
     @property
     def dataset_split(self) -> Split:
@@ -48,13 +195,42 @@ class ProjectedDatasetSplit(metaclass=ABCMeta):
         Returns a new Split with the data subset
         '''
 
+    def dataset_fingerprint(self) -> Tuple:
+        '''
+        Identity of the data the projection is computed from. Datasets only
+        change data by setting a new dataframe, so identity (plus version) is
+        enough to detect changes
+        '''
+        return (
+            IdentityFingerprint(self.dataset),
+            getattr(self.dataset, 'version', None),
+            IdentityFingerprint(getattr(self.dataset, '_external_file', None)),
+        )
+
     @property
     def projected_split(self) -> Split:
         '''
         Wrapper property to retrieve the dataset split and manipulate into a
         projected split. Returns a split object already parsed
+
+        Returns a new Split over the memoized sections, so setting sections
+        does not affect later accesses
+        '''
+        if not self.memoize or not PROJECTED_SPLIT_CACHE.enabled:
+            return self.apply_projection(self.dataset_split)
+
+        fingerprint = self.dataset_fingerprint()
+        split = PROJECTED_SPLIT_CACHE.get(self._cache_key, fingerprint)
+        if split is None:
+            split = self.apply_projection(self.dataset_split)
+            PROJECTED_SPLIT_CACHE.put(self._cache_key, fingerprint, split)
+        return Split(**split)
+
+    def clear_memoized_split(self) -> None:
         '''
-        return self.apply_projection(self.dataset_split)
+        Explicitly drop the memoized split (ex: after mutating the dataset in place)
+        '''
+        PROJECTED_SPLIT_CACHE.discard(self._cache_key)
 
     def __getattr__(self, attr):
         '''
@@ -81,11 +257,50 @@ class IdentityProjectedDatasetSplit(ProjectedDatasetSplit):
 class IndexBasedProjectedDatasetSplit(ProjectedDatasetSplit):
     '''
     Index based subset. Compatible with dataset splits that support indexing
+
+    Rows are selected by index labels (`indices`) or by row positions
+    (`positions`, a sequence of positions or a boolean mask). Either way the
+    rows are applied as a compact int64 position array with `take`: labels
+    are resolved against the index of each pandas section (numpy sections
+    are labeled by position). None selects all rows
     '''
 
-    def __init__(self, indices, **kwargs):
+    def __init__(self, indices: Any = None, positions: Any = None, **kwargs):
         super().__init__(**kwargs)
+        if indices is not None and positions is not None:
+            raise PipelineError('Pass either index labels (`indices`) or row positions (`positions`), not both')
         self.indices = indices
+        self.positions = self.positional_indices(positions)
+
+    @staticmethod
+    def positional_indices(indices: Any) -> Optional[np.ndarray]:
+        '''
+        Normalize positions (sequence of positions or boolean mask) into an int64 position array
+        '''
+        if indices is None:
+            return None
+        indices = np.asarray(indices)
+        if indices.size == 0:
+            return np.empty(0, dtype=np.int64)
+        if indices.dtype == np.bool_:
+            return np.flatnonzero(indices).astype(np.int64, copy=False)
+        if not np.issubdtype(indices.dtype, np.integer):
+            raise PipelineError(f'Projected split positions must be integers or a boolean mask, found {indices.dtype}')
+        return indices.astype(np.int64, copy=False).ravel()
+
+    @classmethod
+    def label_positions(cls, df: Any, indices: Any) -> np.ndarray:
+        '''
+        Positions of the index labels (or boolean mask) in the section
+        '''
+        labels = np.asarray(indices)
+        if labels.dtype == np.bool_ or not isinstance(df, (pd.DataFrame, pd.Series)):
+            return cls.positional_indices(labels)
+        positions = df.index.get_indexer_for(labels.ravel())
+        missing = positions < 0
+        if missing.any():
+            raise PipelineError(f'Projected split indices not found in the split index: {labels.ravel()[missing][:10].tolist()}')
+        return positions.astype(np.int64, copy=False)
 
     @classmethod
     def indexing_method(cls, df, *args, **kwargs):
@@ -103,16 +318,24 @@ class IndexBasedProjectedDatasetSplit(ProjectedDatasetSplit):
 
     @staticmethod
     def pandas_indexing(df, indices):
-        return df.loc[indices]
+        return df.take(indices)
 
     @staticmethod
     def numpy_indexing(df, indices):
-        return df[indices]
+        return df.take(indices, axis=0)
 
     def apply_projection(self, dataset_split: Split) -> Split:
         '''
         Index subset return
         '''
+        if self.indices is None and self.positions is None:
+            return dataset_split.squeeze()
+
+        def positions(section: Any) -> np.ndarray:
+            if self.indices is None:
+                return self.positions
+            return self.label_positions(section, self.indices)
+
         return Split(
-            **{k: self.indexing_method(v, self.indices) for k, v in dataset_split.items()}
+            **{k: self.indexing_method(v, positions(v)) for k, v in dataset_split.items()}
         ).squeeze()
@@ -10,7 +10,7 @@ Module for different pipeline split methods for cross validation
 
 __author__ = 'Elisha Yadgaran'
 
-import pandas as pd
+import numpy as np
 
 from abc import ABCMeta, abstractmethod
 from sklearn.model_selection import train_test_split
@@ -79,13 +79,21 @@ class RandomSplitMixin(SplitMixin):
                  test_size: Optional[Union[float, int]] = None,
                  validation_size: Union[float, int] = 0.0,
                  random_state: int = 123,
-                 shuffle: bool = True, **kwargs):
+                 shuffle: bool = True,
+                 persist_split_indices: bool = False, **kwargs):
         '''
         Set splitting params:
         By default validation is 0.0 because it is only used for hyperparameter
         tuning
+
+        :param persist_split_indices: save the row positions of each split in
+            the pipeline metadata so loaded pipelines reuse them instead of
+            re-splitting. Stored as json lists so only advisable for modest
+            dataset sizes
         '''
         super(RandomSplitMixin, self).__init__(**kwargs)
+        # Operational setting, does not affect the hash
+        self.state['persist_split_indices'] = persist_split_indices
 
         if train_size is None:
             train_size = 1.0 - validation_size
@@ -103,54 +111,78 @@ class RandomSplitMixin(SplitMixin):
         })
 
     @staticmethod
-    def get_index(data) -> List[int]:
+    def get_positions(data) -> np.ndarray:
         '''
-        Helper to extract the index from a dataset. Generates a range index
-        if none exists
+        Helper to generate the row positions of a dataset split section
         '''
-        if isinstance(data, (pd.DataFrame, pd.Series)):
-            return data.index
-
-        else:
-            # no named index, use a linear range
-            return range(len(data))
+        return np.arange(len(data), dtype=np.int64)
 
-    def split_dataset(self) -> None:
+    def split_positions(self) -> Dict[str, np.ndarray]:
         '''
-        Overwrite method to split by percentage
+        Randomly assign the row positions of the dataset to each split
         '''
         train_size = self.config.get('train_size')
         validation_size = self.config.get('validation_size')
         test_size = self.config.get('test_size')
         random_state = self.config.get('random_state')
         shuffle = self.config.get('shuffle')
+        empty = np.empty(0, dtype=np.int64)
 
         # Sklearn's train test split can only accomodate one split per iteration
-        # find the indices that match to each split
+        # find the positions that match to each split
         # use the X split section
-        index = self.get_index(self.dataset.X)
+        positions = self.get_positions(self.dataset.X)
 
         if test_size == 0:  # No split necessary
-            test_indices = []
-            remaining_indices = index
+            test_positions = empty
+            remaining_positions = positions
         else:
-            remaining_indices, test_indices = train_test_split(
-                index, test_size=test_size, random_state=random_state, shuffle=shuffle)
+            remaining_positions, test_positions = train_test_split(
+                positions, test_size=test_size, random_state=random_state, shuffle=shuffle)
 
         calibrated_validation_size = float(validation_size) / (validation_size + train_size)
         if calibrated_validation_size == 0:  # No split necessary
-            train_indices = remaining_indices
-            validation_indices = []
+            train_positions = remaining_positions
+            validation_positions = empty
         else:
-            train_indices, validation_indices = train_test_split(
-                remaining_indices, test_size=calibrated_validation_size, random_state=random_state, shuffle=shuffle)
+            train_positions, validation_positions = train_test_split(
+                remaining_positions, test_size=calibrated_validation_size, random_state=random_state, shuffle=shuffle)
+
+        return {
+            TRAIN_SPLIT: train_positions,
+            VALIDATION_SPLIT: validation_positions,
+            TEST_SPLIT: test_positions
+        }
+
+    def split_dataset(self) -> None:
+        '''
+        Overwrite method to split by percentage. Reuses persisted split
+        positions if the pipeline was saved with them
+        '''
+        persisted = self.metadata_.get('split_indices')
+        if persisted is not None:
+            positions = {split: np.asarray(split_positions, dtype=np.int64) for split, split_positions in persisted.items()}
+        else:
+            positions = self.split_positions()
 
         self._dataset_splits = self.containerize_split({
-            TRAIN_SPLIT: IndexBasedProjectedDatasetSplit(dataset=self.dataset, split=None, indices=train_indices),
-            VALIDATION_SPLIT: IndexBasedProjectedDatasetSplit(dataset=self.dataset, split=None, indices=validation_indices),
-            TEST_SPLIT: IndexBasedProjectedDatasetSplit(dataset=self.dataset, split=None, indices=test_indices)
+            split: IndexBasedProjectedDatasetSplit(dataset=self.dataset, split=None, positions=split_positions)
+            for split, split_positions in positions.items()
         })
 
+    def save(self, **kwargs) -> None:
+        '''
+        Extend parent function to persist the split positions, if enabled
+        '''
+        if self.state.get('persist_split_indices', False):
+            if not hasattr(self, '_dataset_splits') or self._dataset_splits is None:
+                self.split_dataset()
+            self.metadata_['split_indices'] = {
+                split: self._dataset_splits[split].positions.tolist()
+                for split in (TRAIN_SPLIT, VALIDATION_SPLIT, TEST_SPLIT)
+            }
+        super(RandomSplitMixin, self).save(**kwargs)
+
 
 class ChronologicalSplitMixin(SplitMixin):
     def __init__(self, **kwargs):
@@ -13,10 +13,13 @@ Nomenclature -> Save Location : Save Format
     - disk_pickled: Pickled file on local disk
     - disk_hdf5: HDF5 file on local disk
     - disk_keras_hdf5: Keras formatted HDF5 file on local disk
+    - disk_npy_mmap: Pickled object graph with raw numpy arrays memory mapped on load
+    - disk_parquet: Parquet file on local disk (dataframes only)
 - Cloud Storage
     - cloud_pickled: Pickled file on cloud backend
     - cloud_hdf5: HDF5 file on cloud backend
     - cloud_keras_hdf5: Keras formatted HDF5 file on cloud backend
+    - cloud_parquet: Parquet file on cloud backend (dataframes only)
   Supported Backends:
     - Amazon S3
     - Google Cloud Platform
@@ -38,6 +41,7 @@ __author__ = 'Elisha Yadgaran'
 # Auto import all submodules to ensure registration on library import
 from .base import SavePatternMixin, BaseSavePattern
 from .decorators import SavePatternDecorators, register_save_pattern, deregister_save_pattern
+from .serialization import SerializationCache
 
 from . import database
 from . import libcloud
@@ -0,0 +1,232 @@
+'''
+Module for the content addressed local cache of downloaded artifacts
+
+Remote save patterns download artifacts into the local filestore before
+deserializing. Multiple worker processes on the same node would each
+download (and store) their own copy. The artifact cache keeps a single copy
+of each downloaded artifact under the SimpleML home directory:
+
+    artifact_cache/
+    ├── blobs/<sha256>   -- artifact contents, named by their checksum
+    ├── refs/<key hash>  -- remote artifact key -> "<sha256> <size>"
+    └── locks/           -- file locks coordinating processes
+
+Downloads go to a temporary file that is checksummed and atomically renamed
+into place, so readers never see partial files. Blobs are read in place and
+must be treated as read only. Entries are evicted least recently used first
+once the cache exceeds its size cap. Configured via:
+```
+[persistence]
+artifact_cache_bytes = 10737418240  # 0 disables the cache
+artifact_cache_verify = false  # re-checksum blobs on every read
+```
+'''
+
+__author__ = 'Elisha Yadgaran'
+
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from contextlib import contextmanager
+from os.path import join, getsize
+from typing import Callable, Iterator, Optional, Tuple
+
+from simpleml.utils.configuration import CONFIG, PERSISTENCE_SECTION, ARTIFACT_CACHE_DIRECTORY, safe_makedirs
+from simpleml.utils.errors import SimpleMLError
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+DEFAULT_ARTIFACT_CACHE_BYTES: int = CONFIG.getint(PERSISTENCE_SECTION, 'artifact_cache_bytes', fallback=10 * 1024 ** 3)
+ARTIFACT_CACHE_VERIFY: bool = CONFIG.getboolean(PERSISTENCE_SECTION, 'artifact_cache_verify', fallback=False)
+# Block size to checksum files with
+CHECKSUM_BUFFER_BYTES: int = 1024 ** 2
+# Recently used blobs are never evicted so readers in other processes have
+# time to open them
+EVICTION_GRACE_SECONDS: int = 60
+
+
+def file_checksums(filepath: str) -> Tuple[str, str]:
+    '''
+    Streaming (sha256, md5) hex digests of a file. md5 is computed to compare
+    against provider checksums (ex: S3 and GCS etags)
+    '''
+    sha256, md5 = hashlib.sha256(), hashlib.md5()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(CHECKSUM_BUFFER_BYTES), b''):
+            sha256.update(block)
+            md5.update(block)
+    return sha256.hexdigest(), md5.hexdigest()
+
+
+class ArtifactCache(object):
+    '''
+    Content addressed on disk cache shared across processes
+    '''
+
+    def __init__(self,
+                 directory: str = ARTIFACT_CACHE_DIRECTORY,
+                 max_bytes: int = DEFAULT_ARTIFACT_CACHE_BYTES,
+                 verify: bool = ARTIFACT_CACHE_VERIFY):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.verify = verify
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, *parts: str) -> str:
+        return join(self.directory, *parts)
+
+    def _ensure_directories(self) -> None:
+        for folder in ('blobs', 'refs', 'locks', 'tmp'):
+            safe_makedirs(self._path(folder))
+
+    @staticmethod
+    def _key_hash(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def blob_path(self, checksum: str) -> str:
+        return self._path('blobs', checksum)
+
+    @contextmanager
+    def lock(self, name: str) -> Iterator[None]:
+        '''
+        Exclusive inter process lock. No-op where file locking is unavailable
+        '''
+        self._ensure_directories()
+        with open(self._path('locks', f'{name}.lock'), 'a+') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def get(self, key: str) -> Optional[str]:
+        '''
+        Return the blob path for the key, if cached and intact
+        '''
+        ref_path = self._path('refs', self._key_hash(key))
+        try:
+            with open(ref_path) as ref_file:
+                checksum, size = ref_file.read().split()
+        except (OSError, ValueError):
+            return None
+
+        blob_path = self.blob_path(checksum)
+        try:
+            intact = getsize(blob_path) == int(size)
+            if intact and self.verify:
+                intact = file_checksums(blob_path)[0] == checksum
+        except OSError:
+            return None
+        if not intact:
+            LOGGER.warning(f'Corrupted artifact cache entry for {key}, discarding')
+            self._remove(blob_path)
+            return None
+
+        # Track recency for eviction
+        try:
+            os.utime(blob_path)
+        except OSError:
+            return None
+        return blob_path
+
+    def put(self,
+            key: str,
+            download: Callable[[str], None],
+            expected_md5: Optional[str] = None) -> str:
+        '''
+        Download the artifact into the cache and return the blob path
+
+        :param download: function that writes the artifact to the passed filepath
+        :param expected_md5: provider checksum to validate the download against
+        '''
+        self._ensure_directories()
+        temp_dir = tempfile.mkdtemp(dir=self._path('tmp'))
+        try:
+            temp_path = join(temp_dir, 'artifact')
+            download(temp_path)
+            checksum, md5 = file_checksums(temp_path)
+            if expected_md5 is not None and md5 != expected_md5.lower():
+                raise SimpleMLError(f'Checksum mismatch downloading {key}: expected {expected_md5}, got {md5}')
+            size = getsize(temp_path)
+
+            blob_path = self.blob_path(checksum)
+            os.replace(temp_path, blob_path)
+            # Reference is written after the blob so it never points to partial data
+            ref_temp_path = join(temp_dir, 'ref')
+            with open(ref_temp_path, 'w') as ref_file:
+                ref_file.write(f'{checksum} {size}')
+            os.replace(ref_temp_path, self._path('refs', self._key_hash(key)))
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        return blob_path
+
+    def fetch(self,
+              key: str,
+              download: Callable[[str], None],
+              expected_md5: Optional[str] = None) -> str:
+        '''
+        Return the local (read only) path to the artifact, downloading into
+        the cache only if no process has already done so
+        '''
+        with self.lock(self._key_hash(key)):
+            blob_path = self.get(key)
+            if blob_path is None:
+                LOGGER.debug(f'Artifact cache miss for {key}')
+                blob_path = self.put(key, download, expected_md5)
+
+        self.evict()
+        return blob_path
+
+    def evict(self) -> None:
+        '''
+        Remove least recently used blobs until the cache fits the size cap.
+        Blobs used within the grace period are kept
+        '''
+        cutoff = time.time() - EVICTION_GRACE_SECONDS
+        with self.lock('eviction'):
+            blobs = []
+            blob_directory = self._path('blobs')
+            for name in os.listdir(blob_directory):
+                path = join(blob_directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(i[1] for i in blobs)
+            for last_used, size, path in sorted(blobs):
+                if total <= self.max_bytes or last_used > cutoff:
+                    break
+                LOGGER.debug(f'Evicting {path} from artifact cache')
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# Process default instance
+ARTIFACT_CACHE = ArtifactCache()
@@ -5,19 +5,52 @@ Module for base save pattern definition
 __author__ = 'Elisha Yadgaran'
 
 
+import io
+import logging
+
+import numpy as np
 import pandas as pd
 import cloudpickle as pickle
 
-from os.path import join, isfile
-from typing import Optional, Any, Union, Dict
-from io import StringIO
+from os.path import join, isfile, isdir
+from itertools import chain
+from typing import Optional, Any, Union, Dict, List, Tuple, Iterable, Iterator, BinaryIO
 from abc import abstractmethod, ABCMeta
 
+from simpleml.constants import DATAFRAME_SPLIT_COLUMN
 from simpleml.utils.configuration import PICKLED_FILESTORE_DIRECTORY,\
-    HDF5_FILESTORE_DIRECTORY
+    HDF5_FILESTORE_DIRECTORY, MMAP_FILESTORE_DIRECTORY, PARQUET_FILESTORE_DIRECTORY,\
+    CONFIG, PERSISTENCE_SECTION
 from simpleml.registries import KERAS_REGISTRY
+from simpleml.save_patterns.serialization import get_active_serialization_cache
+from simpleml.save_patterns.memory_mapped import dump_memory_mapped, load_memory_mapped
+from simpleml.save_patterns.out_of_band import dump_out_of_band, load_out_of_band, loads_out_of_band, is_out_of_band,\
+    DEFAULT_PICKLE_MMAP, OUT_OF_BAND_MAGIC
+from simpleml.save_patterns.compression import compress, decompress, compressed_writer, compressed_reader,\
+    hdf5_compression_options
+from simpleml.save_patterns.bulk_copy import IteratorStream, csv_copy_chunks, binary_copy_chunks,\
+    COPY_FORMATS, DEFAULT_COPY_FORMAT, DEFAULT_COPY_CHUNKSIZE
 # Import optional dependencies
-from simpleml.imports import load_model, hickle
+from simpleml.imports import load_model, hickle, pa, pq
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# Maximum rows per parquet row group. Configured via:
+# [persistence]
+# parquet_row_group_size = 1000000
+DEFAULT_PARQUET_ROW_GROUP_SIZE: int = CONFIG.getint(PERSISTENCE_SECTION, 'parquet_row_group_size', fallback=1000000)
+# Maximum runs of `row_group_column` values to align row groups with. Above
+# it (ex: shuffled splits) row groups are only split by size. Configured via:
+# [persistence]
+# parquet_max_aligned_row_groups = 64
+DEFAULT_PARQUET_MAX_ALIGNED_ROW_GROUPS: int = CONFIG.getint(
+    PERSISTENCE_SECTION, 'parquet_max_aligned_row_groups', fallback=64)
+# Rows per chunk when reading tables. Configured via:
+# [persistence]
+# sql_chunksize = 100000
+DEFAULT_SQL_CHUNKSIZE: int = CONFIG.getint(PERSISTENCE_SECTION, 'sql_chunksize', fallback=100000)
 
 
 class SavePatternMixin(object):
@@ -33,10 +66,15 @@ class SavePatternMixin(object):
                   if_exists: str = 'replace',
                   sep: str = '|',
                   encoding: str = 'utf8',
-                  index: bool = False) -> None:
+                  index: bool = False,
+                  copy_format: str = DEFAULT_COPY_FORMAT,
+                  chunksize: int = DEFAULT_COPY_CHUNKSIZE) -> None:
         '''
         Utility to bulk insert pandas dataframe via `copy from`
 
+        Rows are streamed to the database in chunks as they are encoded, so
+        memory use is bounded by the chunksize instead of the table size
+
         :param df: dataframe to insert
         :param table: destination table
         :param dtype: column schema of destination table
@@ -46,40 +84,56 @@ class SavePatternMixin(object):
         :param sep: separator key between cells
         :param encoding: character encoding to use
         :param index: whether to output index with data
+        :param copy_format: `csv` or `binary` (Postgres binary copy format,
+            avoids text formatting for numeric data)
+        :param chunksize: number of rows to encode at a time
         '''
         NULL_STRING = 'SIMPLEML_NULL'
 
+        if copy_format not in COPY_FORMATS:
+            raise ValueError(f'Unsupported copy format {copy_format}, expected one of {COPY_FORMATS}')
+
         # Create Table
         df.head(0).to_sql(table, con=engine, if_exists=if_exists,
                           index=index, schema=schema, dtype=dtype)
 
+        if index:
+            # Same column names to_sql creates for the index
+            df = df.reset_index()
+
         # Prepare data
-        output = StringIO()
-        df.to_csv(output, sep=sep, header=False, encoding=encoding, index=index, na_rep=NULL_STRING)
-        output.seek(0)
+        if copy_format == 'binary':
+            stream = IteratorStream(binary_copy_chunks(df, chunksize=chunksize, encoding=encoding))
+            options = 'FORMAT BINARY'
+        else:
+            stream = IteratorStream(csv_copy_chunks(df, chunksize=chunksize, sep=sep, encoding=encoding, null=NULL_STRING))
+            options = f"FORMAT CSV, NULL '{NULL_STRING}', DELIMITER '{sep}', ENCODING '{encoding}'"
 
         # Insert data
         connection = engine.raw_connection()
-        cursor = connection.cursor()
-        # Use copy expert for CSV formatting (handles character escapes, copy_from does not)
-        cursor.copy_expert(
-            """COPY "{schema}"."{table}" ({columns}) FROM STDIN WITH (FORMAT CSV, NULL '{null}', DELIMITER '{sep}')""".format(
-                schema=schema,
-                table=table,
-                columns=', '.join(['"{}"'.format(i) for i in df.columns]),
-                null=NULL_STRING,
-                sep=sep
-            ),
-            output
-        )
-        connection.commit()
-        connection.close()
+        try:
+            cursor = connection.cursor()
+            # Use copy expert for CSV formatting (handles character escapes, copy_from does not)
+            cursor.copy_expert(
+                """COPY "{schema}"."{table}" ({columns}) FROM STDIN WITH ({options})""".format(
+                    schema=schema,
+                    table=table,
+                    columns=', '.join(['"{}"'.format(i) for i in df.columns]),
+                    options=options
+                ),
+                stream
+            )
+            connection.commit()
+        finally:
+            connection.close()
 
     @staticmethod
     def pickle_object(obj: Any,
                       filepath: Optional[str] = None,
                       overwrite: bool = True,
-                      root_directory: str = PICKLED_FILESTORE_DIRECTORY) -> Union[str, None]:
+                      root_directory: str = PICKLED_FILESTORE_DIRECTORY,
+                      compression: Optional[str] = None,
+                      compression_level: Optional[int] = None) -> Union[str, None]:
         '''
         Pickles an object to a string or to the filesystem. Assumes that a NULL
         filepath expects a serialized string returned
@@ -91,9 +145,25 @@ class SavePatternMixin(object):
             object is already serialized. Defaults to not checking, but can be
             leverage by implementations that want the same artifact in multiple
             places
+        :param compression: codec to compress the pickle with (see
+            `simpleml.save_patterns.compression`), None for uncompressed
+
+        Inside an active `SerializationCache` the object is only pickled once
+        and the buffered bytes are reused for every destination
+
+        Large contiguous buffers (ex: numpy arrays) are written out of band
+        with pickle protocol 5 (see `simpleml.save_patterns.out_of_band`)
         '''
+        cache = get_active_serialization_cache()
+
         if filepath is None:  # Return string instead of saving to file
-            return pickle.dumps(obj)  # , protocol=pickle.HIGHEST_PROTOCOL)
+            if cache is not None:
+                stream = cache.serialize(obj, 'pickle', dump_out_of_band).getvalue()
+            else:
+                buffer = io.BytesIO()
+                dump_out_of_band(obj, buffer)
+                stream = buffer.getvalue()
+            return compress(stream, compression, compression_level)
 
         # Append the filepath to the pickle storage directory
         filepath = join(root_directory, filepath)
@@ -103,31 +173,104 @@ class SavePatternMixin(object):
             if isfile(filepath):
                 return
 
-        with open(filepath, 'wb') as pickled_file:
-            pickle.dump(obj, pickled_file)  # , protocol=pickle.HIGHEST_PROTOCOL)
+        def write(path: str) -> None:
+            with open(path, 'wb') as pickled_file:
+                SavePatternMixin.pickle_to_fileobj(obj, pickled_file, compression, compression_level)
+
+        if cache is not None:
+            cache.write_once(obj, f'pickle:{compression}:{compression_level}', filepath, write)
+        else:
+            write(filepath)
 
     @staticmethod
     def load_pickled_object(filepath: str,
                             stream: bool = False,
-                            root_directory: str = PICKLED_FILESTORE_DIRECTORY) -> Any:
+                            root_directory: str = PICKLED_FILESTORE_DIRECTORY,
+                            compression: Optional[str] = None,
+                            mmap_mode: bool = DEFAULT_PICKLE_MMAP) -> Any:
         '''
         Loads an object from a serialized string or filesystem. When stream is
-        True, it tries to load the file directly from the string.
+        True, it tries to load the file directly from the string (out of band
+        arrays are read only views of the string).
 
         Prepends path to SimpleML Pickle directory before loading. ONLY pass in
         a relative filepath from that location
+
+        :param compression: codec the pickle was compressed with
+        :param mmap_mode: memory map out of band buffers (read only) instead
+            of reading them. Ignored for streams and compressed files
         '''
         if stream:
-            return pickle.loads(filepath)
+            data = decompress(filepath, compression)
+            if is_out_of_band(data):
+                return loads_out_of_band(data)
+            return pickle.loads(data)
 
         with open(join(root_directory, filepath), 'rb') as pickled_file:
-            return pickle.load(pickled_file)
+            return SavePatternMixin.load_pickled_fileobj(pickled_file, compression, mmap_mode=mmap_mode)
+
+    @staticmethod
+    def pickle_to_fileobj(obj: Any,
+                          fileobj: BinaryIO,
+                          compression: Optional[str] = None,
+                          compression_level: Optional[int] = None) -> None:
+        '''
+        Pickles an object into a writable file object (shares the active
+        `SerializationCache`)
+        '''
+        cache = get_active_serialization_cache()
+        with compressed_writer(fileobj, compression, compression_level) as output_file:
+            if cache is not None:
+                cache.serialize(obj, 'pickle', dump_out_of_band).copy_to(output_file)
+            else:
+                dump_out_of_band(obj, output_file)
+
+    @staticmethod
+    def load_pickled_fileobj(fileobj: BinaryIO,
+                             compression: Optional[str] = None,
+                             mmap_mode: bool = False) -> Any:
+        '''
+        Loads an object from a readable file object (needs `peek`, like
+        `io.BufferedReader`)
+
+        :param mmap_mode: memory map out of band buffers. Only for real,
+            uncompressed files
+        '''
+        reader = compressed_reader(fileobj, compression)
+        if is_out_of_band(reader.peek(len(OUT_OF_BAND_MAGIC))):
+            return load_out_of_band(reader, mmap_mode=mmap_mode and compression is None)
+        return pickle.load(reader)
+
+    @staticmethod
+    def compressed_filepath_data(reference: str,
+                                 compression: Optional[str],
+                                 compression_level: Optional[int],
+                                 reference_key: str = 'filename') -> Union[str, Dict[str, Any]]:
+        '''
+        Filepath data for a (possibly) compressed artifact. Uncompressed
+        artifacts keep the plain reference so existing records are unchanged
+        '''
+        if compression is None:
+            return reference
+        return {reference_key: reference, 'compression': compression, 'compression_level': compression_level}
+
+    @staticmethod
+    def parse_filepath_data(filepath_data: Union[str, Dict[str, Any]],
+                            reference_key: str = 'filename') -> Tuple[str, Optional[str]]:
+        '''
+        Inverse of `compressed_filepath_data`: (reference, codec)
+        '''
+        if isinstance(filepath_data, dict):
+            return filepath_data[reference_key], filepath_data.get('compression')
+        return filepath_data, None
 
     @staticmethod
     def hickle_object(obj: Any,
                       filepath: str,
                       overwrite: bool = True,
-                      root_directory: str = HDF5_FILESTORE_DIRECTORY) -> None:
+                      root_directory: str = HDF5_FILESTORE_DIRECTORY,
+                      compression: Optional[str] = None,
+                      compression_level: Optional[int] = None) -> None:
         '''
         Serializes an object to the filesystem in HDF5 format.
 
@@ -138,6 +281,8 @@ class SavePatternMixin(object):
             object is already serialized. Defaults to not checking, but can be
             leverage by implementations that want the same artifact in multiple
             places
+        :param compression: HDF5 dataset filter (gzip or lzf). Defaults to
+            gzip level 9
         '''
         # Append the filepath to the HDF5 storage directory
         hickle_file = join(root_directory, filepath)
@@ -145,7 +290,17 @@ class SavePatternMixin(object):
             # Check if file was already serialized
             if isfile(hickle_file):
                 return
-        hickle.dump(obj, hickle_file, compression='gzip', compression_opts=9)
+
+        options = hdf5_compression_options(compression, compression_level)
+
+        def write(path: str) -> None:
+            hickle.dump(obj, path, **options)
+
+        cache = get_active_serialization_cache()
+        if cache is not None:
+            cache.write_once(obj, f'hdf5:{sorted(options.items())}', hickle_file, write)
+        else:
+            write(hickle_file)
 
     @staticmethod
     def load_hickled_object(filepath: str,
@@ -181,7 +336,12 @@ class SavePatternMixin(object):
             # Check if file was already serialized
             if isfile(hdf5_file):
                 return
-        obj.save(hdf5_file)
+
+        cache = get_active_serialization_cache()
+        if cache is not None:
+            cache.write_once(obj, 'keras_hdf5', hdf5_file, obj.save)
+        else:
+            obj.save(hdf5_file)
 
     @staticmethod
     def load_keras_object(filepath: str,
@@ -196,6 +356,143 @@ class SavePatternMixin(object):
             str(join(root_directory, filepath)),
             custom_objects=KERAS_REGISTRY.registry)
 
+    @staticmethod
+    def mmap_object(obj: Any,
+                    filepath: str,
+                    overwrite: bool = True,
+                    root_directory: str = MMAP_FILESTORE_DIRECTORY) -> None:
+        '''
+        Serializes an object to the filesystem in the memory mapped layout
+        (a directory with the pickled object graph and raw .npy arrays)
+
+        Prepends path to SimpleML mmap directory before saving. ONLY pass in
+        a relative filepath from that location
+
+        :param overwrite: Boolean indicating whether to first check if the
+            object is already serialized. Defaults to not checking, but can be
+            leverage by implementations that want the same artifact in multiple
+            places
+        '''
+        directory = join(root_directory, filepath)
+        if not overwrite:
+            # Check if object was already serialized
+            if isdir(directory):
+                return
+
+        cache = get_active_serialization_cache()
+        if cache is not None:
+            cache.write_once(obj, 'npy_mmap', directory, lambda path: dump_memory_mapped(obj, path))
+        else:
+            dump_memory_mapped(obj, directory)
+
+    @staticmethod
+    def load_mmapped_object(filepath: str,
+                            root_directory: str = MMAP_FILESTORE_DIRECTORY) -> Any:
+        '''
+        Loads an object from the filesystem with numeric arrays memory mapped
+        (read only)
+
+        Prepends path to SimpleML mmap directory before loading. ONLY pass in
+        a relative filepath from that location
+        '''
+        return load_memory_mapped(join(root_directory, filepath))
+
+    @staticmethod
+    def parquet_row_groups(df: pd.DataFrame,
+                           row_group_column: Optional[str] = DATAFRAME_SPLIT_COLUMN,
+                           row_group_size: int = DEFAULT_PARQUET_ROW_GROUP_SIZE,
+                           max_aligned_row_groups: int = DEFAULT_PARQUET_MAX_ALIGNED_ROW_GROUPS) -> List[Tuple[int, int]]:
+        '''
+        (start, stop) row positions of parquet row groups. Groups break every
+        time the value of `row_group_column` changes so each row group holds a
+        single value (ex: dataset split) and readers can skip whole groups
+        from the column statistics
+
+        Interleaved values (more than `max_aligned_row_groups` runs) would
+        produce tiny row groups, so those frames are only split by size
+        '''
+        length = len(df)
+        boundaries = set(range(0, length, row_group_size))
+        boundaries.add(length)
+        if row_group_column is not None and row_group_column in df.columns and length:
+            codes = pd.factorize(df[row_group_column])[0]
+            changes = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+            if len(changes) < max_aligned_row_groups:
+                boundaries.update(changes.tolist())
+            else:
+                LOGGER.debug(f'{len(changes) + 1} runs of {row_group_column}, not aligning parquet row groups')
+        boundaries = sorted(boundaries)
+        return list(zip(boundaries[:-1], boundaries[1:])) or [(0, 0)]
+
+    @classmethod
+    def parquet_object(cls,
+                       df: pd.DataFrame,
+                       filepath: str,
+                       overwrite: bool = True,
+                       row_group_column: Optional[str] = DATAFRAME_SPLIT_COLUMN,
+                       root_directory: str = PARQUET_FILESTORE_DIRECTORY) -> None:
+        '''
+        Serializes a dataframe to the filesystem in parquet format. The index
+        is stored as a column so row subsets keep their labels
+
+        Prepends path to SimpleML parquet directory before saving. ONLY pass in
+        a relative filepath from that location
+
+        :param overwrite: Boolean indicating whether to first check if parquet
+            object is already serialized. Defaults to not checking, but can be
+            leverage by implementations that want the same artifact in multiple
+            places
+        :param row_group_column: column to align row groups with, for row
+            group filtering on load
+        '''
+        # Append the filepath to the parquet storage directory
+        parquet_file = join(root_directory, filepath)
+        if not overwrite:
+            # Check if file was already serialized
+            if isfile(parquet_file):
+                return
+
+        def write(path: str) -> None:
+            table = pa.Table.from_pandas(df, preserve_index=True)
+            with pq.ParquetWriter(path, table.schema) as writer:
+                for start, stop in cls.parquet_row_groups(df, row_group_column):
+                    writer.write_table(table.slice(start, stop - start))
+
+        cache = get_active_serialization_cache()
+        if cache is not None:
+            cache.write_once(df, 'parquet', parquet_file, write)
+        else:
+            write(parquet_file)
+
+    @staticmethod
+    def load_parquet_object(filepath: str,
+                            columns: Optional[List[str]] = None,
+                            filters: Optional[List[Tuple[str, str, Any]]] = None,
+                            root_directory: str = PARQUET_FILESTORE_DIRECTORY) -> pd.DataFrame:
+        '''
+        Loads a dataframe from the filesystem. Only the passed columns are
+        read and row groups that cannot match the filters are skipped
+
+        Prepends path to SimpleML parquet directory before loading. ONLY pass in
+        a relative filepath from that location
+
+        :param filters: pyarrow filters, ex: `[('DATASET_SPLIT', '=', 'TRAIN')]`
+        '''
+        table = pq.read_table(
+            join(root_directory, filepath), columns=columns, filters=filters,
+            use_pandas_metadata=True)
+        return table.to_pandas()
+
+    @staticmethod
+    def load_parquet_columns(filepath: str,
+                             root_directory: str = PARQUET_FILESTORE_DIRECTORY) -> List[str]:
+        '''
+        Reads the dataframe column names from the parquet footer (no data is loaded)
+        '''
+        metadata = pq.read_schema(join(root_directory, filepath)).pandas_metadata
+        index_columns = [i for i in metadata['index_columns'] if isinstance(i, str)]
+        return [i['name'] for i in metadata['columns'] if i['field_name'] not in index_columns]
+
     @staticmethod
     def load_sql(query: str,
                  connection,
@@ -203,6 +500,69 @@ class SavePatternMixin(object):
         '''Helper method to read in sql data'''
         return pd.read_sql_query(query, connection, **kwargs)
 
+    @staticmethod
+    def load_sql_chunks(query: Any,
+                        engine,
+                        chunksize: int = DEFAULT_SQL_CHUNKSIZE,
+                        **kwargs) -> Iterator[pd.DataFrame]:
+        '''
+        Helper method to read in sql data in chunks of rows. Results are
+        streamed with a server side cursor (where the dialect supports it)
+        instead of being buffered by the client
+        '''
+        with engine.connect() as connection:
+            connection = connection.execution_options(stream_results=True)
+            for chunk in pd.read_sql_query(query, connection, chunksize=chunksize, **kwargs):
+                yield chunk
+
+    @staticmethod
+    def concatenate_chunks(chunks: Iterable[pd.DataFrame], total_rows: int) -> pd.DataFrame:
+        '''
+        Concatenate row chunks into a dataframe preallocated for `total_rows`
+        with the dtypes of the first chunk, without holding all the chunks in
+        memory. Chunks without a meaningful index (default range index) get a
+        continuous range index
+
+        Falls back to `pd.concat` if a later chunk does not fit (ex: nulls in
+        an integer column or more rows than expected)
+        '''
+        chunks = iter(chunks)
+        first = next(chunks, None)
+        if first is None:
+            return pd.DataFrame()
+        range_index = isinstance(first.index, pd.RangeIndex)
+        if not all(isinstance(dtype, np.dtype) for dtype in first.dtypes):
+            # Extension dtypes cannot be preallocated
+            return pd.concat(chain([first], chunks), ignore_index=range_index)
+
+        result = pd.DataFrame({i: np.empty(total_rows, dtype=dtype) for i, dtype in enumerate(first.dtypes)})
+        result.columns = first.columns
+        index = None if range_index else np.empty(total_rows, dtype=first.index.dtype)
+
+        filled = 0
+        for chunk in chain([first], chunks):
+            stop = filled + len(chunk)
+            fits = stop <= total_rows and (chunk.dtypes.values == result.dtypes.values).all() and \
+                (range_index or chunk.index.dtype == index.dtype)
+            if not fits:
+                LOGGER.debug('Chunk does not fit preallocated dataframe, concatenating instead')
+                partial = result.iloc[:filled]
+                if index is not None:
+                    partial.index = pd.Index(index[:filled], name=first.index.name)
+                return pd.concat(chain([partial, chunk], chunks), ignore_index=range_index)
+
+            for i in range(chunk.shape[1]):
+                result.iloc[filled:stop, i] = chunk.iloc[:, i].to_numpy()
+            if index is not None:
+                index[filled:stop] = chunk.index.to_numpy()
+            filled = stop
+
+        if filled < total_rows:
+            result = result.iloc[:filled]
+        if index is not None:
+            result.index = pd.Index(index[:filled], name=first.index.name)
+        return result
+
 
 class BaseSavePattern(SavePatternMixin, metaclass=ABCMeta):
     '''
@@ -0,0 +1,192 @@
+'''
+Module for streaming dataframes into Postgres via `COPY FROM STDIN`
+
+Rows are encoded in chunks as the database consumes them, so only a single
+chunk is ever held in memory regardless of the table size. Two formats are
+supported:
+    - csv: text rows rendered with pandas (same output as `DataFrame.to_csv`)
+    - binary: the Postgres binary copy format, encoded directly from the
+      numpy buffers. Skips string formatting and parsing for numeric data
+
+Configured via:
+```
+[persistence]
+copy_format = csv
+copy_chunksize = 100000
+```
+'''
+
+__author__ = 'Elisha Yadgaran'
+
+
+import io
+import struct
+
+import numpy as np
+import pandas as pd
+
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from simpleml.utils.configuration import CONFIG, PERSISTENCE_SECTION
+from simpleml.utils.errors import SimpleMLError
+
+
+DEFAULT_COPY_FORMAT: str = CONFIG.get(PERSISTENCE_SECTION, 'copy_format', fallback='csv')
+DEFAULT_COPY_CHUNKSIZE: int = CONFIG.getint(PERSISTENCE_SECTION, 'copy_chunksize', fallback=100000)
+COPY_FORMATS: Tuple[str, ...] = ('csv', 'binary')
+
+BINARY_COPY_HEADER: bytes = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+BINARY_COPY_TRAILER: bytes = struct.pack('!h', -1)
+# Postgres timestamps count microseconds from 2000-01-01
+POSTGRES_EPOCH_MICROSECONDS: int = 946684800 * 10 ** 6
+
+
+class IteratorStream(io.RawIOBase):
+    '''
+    Read only file object over an iterator of byte chunks. Lets consumers that
+    expect a file (ex: `cursor.copy_expert`) pull data as it is produced
+    '''
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def iter_row_chunks(df: pd.DataFrame, chunksize: int) -> Iterator[pd.DataFrame]:
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+def csv_copy_chunks(df: pd.DataFrame,
+                    chunksize: int = DEFAULT_COPY_CHUNKSIZE,
+                    sep: str = '|',
+                    encoding: str = 'utf8',
+                    null: str = '') -> Iterator[bytes]:
+    '''
+    CSV encoded rows (no header), one chunk of rows at a time
+    '''
+    for chunk in iter_row_chunks(df, chunksize):
+        yield chunk.to_csv(sep=sep, header=False, index=False, na_rep=null).encode(encoding)
+
+
+def _fixed_width_encoder(series: pd.Series) -> Optional[Tuple[str, Callable[[pd.Series], np.ndarray]]]:
+    '''
+    Big endian numpy dtype and value conversion for columns with a fixed
+    width binary representation. None for variable width (text) columns.
+    Matches the column types pandas creates in `to_sql`
+    '''
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return '>i1', lambda s: s.to_numpy(dtype=np.int8)
+    if pd.api.types.is_integer_dtype(dtype):
+        # pandas creates INTEGER columns for int32, BIGINT otherwise
+        if dtype == np.int32:
+            return '>i4', lambda s: s.to_numpy()
+        return '>i8', lambda s: s.to_numpy(dtype=np.int64)
+    if pd.api.types.is_float_dtype(dtype):
+        if dtype == np.float32:
+            return '>f4', lambda s: s.to_numpy()
+        return '>f8', lambda s: s.to_numpy(dtype=np.float64)
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        def to_postgres_timestamp(s: pd.Series) -> np.ndarray:
+            if getattr(s.dt, 'tz', None) is not None:
+                s = s.dt.tz_convert('UTC').dt.tz_localize(None)
+            return s.to_numpy(dtype='datetime64[us]').view(np.int64) - POSTGRES_EPOCH_MICROSECONDS
+        return '>i8', to_postgres_timestamp
+    return None
+
+
+def _binary_columns(df: pd.DataFrame) -> List[Optional[Tuple[str, Callable]]]:
+    encoders = []
+    for column in df.columns:
+        series = df[column]
+        encoder = _fixed_width_encoder(series)
+        if encoder is None:
+            if pd.api.types.is_timedelta64_dtype(series.dtype) or \
+                    pd.api.types.infer_dtype(series, skipna=True) in ('datetime', 'date', 'time', 'timedelta', 'period'):
+                raise SimpleMLError(f'Binary COPY does not support column {column} ({series.dtype}), use the csv format')
+        encoders.append(encoder)
+    return encoders
+
+
+def _encode_fast(chunk: pd.DataFrame, encoders: List[Tuple[str, Callable]]) -> bytes:
+    '''
+    Vectorized encoding for chunks of only fixed width, non null values
+    '''
+    fields = [('count', '>i2')]
+    for i, (dtype, _) in enumerate(encoders):
+        fields.extend([(f'length_{i}', '>i4'), (f'value_{i}', dtype)])
+    records = np.empty(len(chunk), dtype=np.dtype(fields))
+    records['count'] = len(encoders)
+    for i, (dtype, convert) in enumerate(encoders):
+        records[f'length_{i}'] = np.dtype(dtype).itemsize
+        records[f'value_{i}'] = convert(chunk.iloc[:, i])
+    return records.tobytes()
+
+
+def _encode_rows(chunk: pd.DataFrame, encoders: List[Optional[Tuple[str, Callable]]], encoding: str) -> bytes:
+    '''
+    Row by row encoding for chunks with nulls or text columns
+    '''
+    columns = []
+    for i, encoder in enumerate(encoders):
+        series = chunk.iloc[:, i]
+        nulls = series.isna().to_numpy()
+        if encoder is None:
+            values = [None if null else str(value).encode(encoding) for value, null in zip(series, nulls)]
+        else:
+            dtype, convert = encoder
+            size = np.dtype(dtype).itemsize
+            packed = memoryview(convert(series[~nulls]).astype(dtype).tobytes())
+            values, offset = [], 0
+            for null in nulls:
+                if null:
+                    values.append(None)
+                else:
+                    values.append(packed[offset:offset + size])
+                    offset += size
+        columns.append(values)
+
+    field_count = struct.pack('!h', len(encoders))
+    null_field = struct.pack('!i', -1)
+    rows = []
+    for row in zip(*columns):
+        rows.append(field_count)
+        for value in row:
+            if value is None:
+                rows.append(null_field)
+            else:
+                rows.append(struct.pack('!i', len(value)))
+                rows.append(value)
+    return b''.join(rows)
+
+
+def binary_copy_chunks(df: pd.DataFrame,
+                       chunksize: int = DEFAULT_COPY_CHUNKSIZE,
+                       encoding: str = 'utf8') -> Iterator[bytes]:
+    '''
+    Postgres binary COPY stream (header, tuples, trailer), one chunk of rows
+    at a time. NaN/NaT/None are written as NULL
+    '''
+    encoders = _binary_columns(df)
+    yield BINARY_COPY_HEADER
+    for chunk in iter_row_chunks(df, chunksize):
+        if all(encoder is not None for encoder in encoders) and not chunk.isna().to_numpy().any():
+            yield _encode_fast(chunk, encoders)
+        else:
+            yield _encode_rows(chunk, encoders, encoding)
+    yield BINARY_COPY_TRAILER
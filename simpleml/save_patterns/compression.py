@@ -0,0 +1,186 @@
+'''
+Module for compressing serialized artifacts
+
+Codecs:
+    - zstd: zstandard (`compression` extra). Best size/speed tradeoff
+    - lz4: lz4 frames (`compression` extra). Fastest, larger output
+    - gzip, bz2, lzma: standard library
+    - auto: the first available of zstd, lz4 and gzip
+    - HDF5 artifacts use h5py dataset filters instead (gzip or lzf)
+
+Codecs compress the pickle stream as it is written so artifacts are never
+held uncompressed and compressed at the same time. The codec and level are
+recorded in the persistable filepaths so loads decompress automatically.
+Configured via:
+```
+[persistence]
+compression = none
+compression_level = 3
+```
+'''
+
+__author__ = 'Elisha Yadgaran'
+
+
+import bz2
+import gzip
+import io
+import lzma
+import logging
+import pickle
+import time
+
+import pandas as pd
+
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Union
+
+from simpleml.imports import zstandard, lz4_frame, MissingImportWrapper
+from simpleml.utils.configuration import CONFIG, PERSISTENCE_SECTION
+from simpleml.utils.errors import SimpleMLError
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+COMPRESSION_CODECS = ('zstd', 'lz4', 'gzip', 'bz2', 'lzma')
+COMPRESSION_EXTENSIONS: Dict[str, str] = {'zstd': '.zst', 'lz4': '.lz4', 'gzip': '.gz', 'bz2': '.bz2', 'lzma': '.xz'}
+DEFAULT_COMPRESSION: Optional[str] = CONFIG.get(PERSISTENCE_SECTION, 'compression', fallback=None)
+DEFAULT_COMPRESSION_LEVEL: Optional[int] = CONFIG.getint(PERSISTENCE_SECTION, 'compression_level', fallback=None)
+
+
+def codec_available(codec: str) -> bool:
+    module = {'zstd': zstandard, 'lz4': lz4_frame}.get(codec)
+    return not (isinstance(module, type) and issubclass(module, MissingImportWrapper))
+
+
+def resolve_codec(codec: Optional[str]) -> Optional[str]:
+    '''
+    Normalize a codec name. None (or `none`) disables compression and `auto`
+    picks the best available codec
+    '''
+    if codec is None or codec.lower() == 'none':
+        return None
+    codec = codec.lower()
+    if codec == 'auto':
+        return next(i for i in ('zstd', 'lz4', 'gzip') if codec_available(i))
+    if codec not in COMPRESSION_CODECS:
+        raise SimpleMLError(f'Unsupported compression codec: {codec}. Expected one of {COMPRESSION_CODECS}, auto or none')
+    return codec
+
+
+@contextmanager
+def compressed_writer(fileobj: BinaryIO, codec: Optional[str], level: Optional[int] = None) -> Iterator[BinaryIO]:
+    '''
+    Writable file object that compresses into `fileobj`. Passthrough without a codec
+    '''
+    if codec is None:
+        yield fileobj
+        return
+
+    if codec == 'zstd':
+        writer = zstandard.ZstdCompressor(level=3 if level is None else level).stream_writer(fileobj, closefd=False)
+    elif codec == 'lz4':
+        writer = lz4_frame.LZ4FrameFile(fileobj, mode='wb', compression_level=level or 0)
+    elif codec == 'gzip':
+        # No name or mtime in the header, so output only depends on the data
+        writer = gzip.GzipFile(filename='', fileobj=fileobj, mode='wb', compresslevel=6 if level is None else level, mtime=0)
+    elif codec == 'bz2':
+        writer = bz2.BZ2File(fileobj, mode='wb', compresslevel=9 if level is None else level)
+    elif codec == 'lzma':
+        writer = lzma.LZMAFile(fileobj, mode='wb', preset=level)
+    else:
+        raise SimpleMLError(f'Unsupported compression codec: {codec}')
+
+    try:
+        yield writer
+    finally:
+        writer.close()
+
+
+def compressed_reader(fileobj: BinaryIO, codec: Optional[str]) -> BinaryIO:
+    '''
+    Readable file object that decompresses from `fileobj`. Passthrough without a codec
+    '''
+    if codec is None:
+        return fileobj
+    if codec == 'zstd':
+        # Buffered for `readline` (used by pickle)
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False))
+    if codec == 'lz4':
+        return lz4_frame.LZ4FrameFile(fileobj, mode='rb')
+    if codec == 'gzip':
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    if codec == 'bz2':
+        return bz2.BZ2File(fileobj, mode='rb')
+    if codec == 'lzma':
+        return lzma.LZMAFile(fileobj, mode='rb')
+    raise SimpleMLError(f'Unsupported compression codec: {codec}')
+
+
+def hdf5_compression_options(codec: Optional[str], level: Optional[int] = None) -> Dict[str, Any]:
+    '''
+    h5py dataset filter options for a codec. HDF5 files need random access so
+    datasets are compressed inside the file instead of compressing the file
+    stream. Only gzip and lzf ship with every h5py install, other codecs fall
+    back to gzip. Filters are stored in the file so loads need no options
+
+    The level only applies to gzip (clamped to the gzip range 0-9). Other
+    codecs' levels (ex: zstd 19) are meaningless for the gzip fallback so
+    the default level 9 is used instead
+    '''
+    codec = None if codec is None or codec.lower() in ('none', 'auto') else codec.lower()
+    if codec == 'lzf':
+        return {'compression': 'lzf'}
+    if codec not in (None, 'gzip'):
+        LOGGER.warning(f'HDF5 artifacts do not support {codec} compression, using gzip')
+    if codec != 'gzip' or level is None:
+        level = 9
+    return {'compression': 'gzip', 'compression_opts': min(max(level, 0), 9)}
+
+
+def compress(data: bytes, codec: Optional[str], level: Optional[int] = None) -> bytes:
+    output = io.BytesIO()
+    with compressed_writer(output, codec, level) as writer:
+        writer.write(data)
+    return output.getvalue()
+
+
+def decompress(data: bytes, codec: Optional[str]) -> bytes:
+    if codec is None:
+        return data
+    with compressed_reader(io.BytesIO(data), codec) as reader:
+        return reader.read()
+
+
+def benchmark_compression(obj: Any,
+                          codecs: Optional[List[str]] = None,
+                          levels: Optional[Dict[str, List[Optional[int]]]] = None) -> pd.DataFrame:
+    '''
+    Size/time tradeoff of each codec for a (pickled) object. Useful to pick
+    a codec for the artifacts of a project
+
+    :param codecs: codecs to compare, defaults to all installed
+    :param levels: levels to try per codec, defaults to the codec default
+    '''
+    data = pickle.dumps(obj)
+    if codecs is None:
+        codecs = [i for i in COMPRESSION_CODECS if codec_available(i)]
+    levels = levels or {}
+
+    results: List[Dict[str, Union[str, int, float, None]]] = [{
+        'codec': 'none', 'level': None, 'bytes': len(data), 'ratio': 1.0,
+        'compress_seconds': 0.0, 'decompress_seconds': 0.0}]
+    for codec in codecs:
+        for level in levels.get(codec, [None]):
+            start = time.perf_counter()
+            compressed = compress(data, codec, level)
+            compress_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            decompress(compressed, codec)
+            decompress_seconds = time.perf_counter() - start
+            results.append({
+                'codec': codec, 'level': level, 'bytes': len(compressed),
+                'ratio': len(data) / max(len(compressed), 1),
+                'compress_seconds': compress_seconds, 'decompress_seconds': decompress_seconds})
+    return pd.DataFrame(results)
@@ -5,13 +5,24 @@ Module for save patterns registered for database persistence
 __author__ = 'Elisha Yadgaran'
 
 
+import numpy as np
 import pandas as pd
-from typing import Any, Dict
+from sqlalchemy import Column, Index, MetaData, Table, text
+from sqlalchemy.sql.elements import TextClause
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
+from simpleml.constants import DATAFRAME_SPLIT_COLUMN
 from simpleml.persistables.base_sqlalchemy import DatasetStorageSqlalchemy
 from simpleml.save_patterns.decorators import SavePatternDecorators
-from simpleml.save_patterns.base import BaseSavePattern
-from simpleml.utils.binary_blob import BinaryBlob
+from simpleml.save_patterns.base import BaseSavePattern, DEFAULT_SQL_CHUNKSIZE
+from simpleml.save_patterns.compression import resolve_codec, DEFAULT_COMPRESSION, DEFAULT_COMPRESSION_LEVEL
+from simpleml.utils.binary_blob import BinaryBlob, DEFAULT_BLOB_CHUNK_BYTES
+
+
+# Column with the position of each row, written when the table is saved.
+# Filtered loads select and order on it to keep row positions
+ROW_NUMBER_COLUMN: str = 'simpleml_row_number'
+SQL_FILTER_OPERATORS = ('=', '!=', '<', '<=', '>', '>=', 'in', 'not in')
 
 
 @SavePatternDecorators.register_save_pattern
@@ -30,28 +41,157 @@ class DatabaseTableSavePattern(BaseSavePattern):
         '''
         Save method to save dataframe into a new table with name = GUID
         Updates filepath for the artifact with the schema and table
+
+        The position of each row is stored in an extra indexed column (with
+        the split column, if present) so filtered loads can keep positions
+        without numbering the whole table
         '''
         engine = DatasetStorageSqlalchemy.metadata.bind
-        cls.df_to_sql(engine, df=obj, table=persistable_id, schema=schema)
+        # Shallow copy, only the position column is allocated
+        df = obj.copy(deep=False)
+        df[ROW_NUMBER_COLUMN] = np.arange(len(df), dtype=np.int64)
+        cls.df_to_sql(engine, df=df, table=persistable_id, schema=schema)
 
-        return {'schema': schema, 'table': persistable_id}
+        index_columns = [ROW_NUMBER_COLUMN]
+        if DATAFRAME_SPLIT_COLUMN in obj.columns:
+            index_columns.insert(0, DATAFRAME_SPLIT_COLUMN)
+        # Dialect specific DDL (index schemas are placed differently)
+        table = Table(persistable_id, MetaData(), *[Column(column) for column in index_columns], schema=schema)
+        Index(f'{persistable_id}_row_number', *table.columns).create(bind=engine)
+
+        return {'schema': schema, 'table': persistable_id, 'row_number_column': ROW_NUMBER_COLUMN}
 
     @classmethod
     def load(cls,
              filepath_data: Dict[str, str],
-             **kwargs) -> pd.DataFrame:
+             columns: Optional[List[str]] = None,
+             filters: Optional[List[Tuple[str, str, Any]]] = None,
+             chunksize: int = DEFAULT_SQL_CHUNKSIZE,
+             iterator: bool = False,
+             **kwargs) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
         '''
         Load method to load dataframe from database
+
+        Rows are streamed in chunks through a server side cursor and copied
+        into a preallocated dataframe (or returned as an iterator of chunks).
+        Column selection and filters are executed by the database, so only
+        the matching rows are transferred and materialized
+
+        Filtered rows keep their saved position as the index, so they match
+        a filtered full load. The positions are read from the stored row
+        number column (filtered and ordered via its index). Tables saved
+        without it are numbered with a window function instead, which scans
+        the whole table and has engine dependent positions. Unfiltered loads
+        are not ordered
+
+        :param columns: columns to select, defaults to all
+        :param filters: list of (column, operator, value) conditions joined
+            with AND. Operators: =, !=, <, <=, >, >=, in, not in
+        :param iterator: return an iterator of dataframe chunks instead
         '''
         schema = filepath_data['schema']
         table = filepath_data['table']
+        row_number_column = filepath_data.get('row_number_column')
         engine = DatasetStorageSqlalchemy.metadata.bind
-        df = cls.load_sql(
-            'select * from "{}"."{}"'.format(schema, table),
-            engine
-        )
 
-        return df
+        if columns is None and row_number_column is not None:
+            columns = cls.column_names(filepath_data)
+        query, params = cls.select_query(schema, table, columns=columns, filters=filters,
+                                         row_number_column=row_number_column)
+        index_col = (row_number_column or ROW_NUMBER_COLUMN) if filters else None
+        chunks = cls.load_sql_chunks(query, engine, chunksize=chunksize, params=params, index_col=index_col)
+        if index_col is not None:
+            chunks = (chunk.rename_axis(None) for chunk in chunks)
+        if iterator:
+            return chunks
+
+        count_query, count_params = cls.select_query(schema, table, filters=filters, count=True)
+        with engine.connect() as connection:
+            total_rows = connection.execute(count_query, count_params).scalar()
+        return cls.concatenate_chunks(chunks, total_rows)
+
+    @classmethod
+    def column_names(cls, filepath_data: Dict[str, str]) -> List[str]:
+        '''
+        Column names of the saved table (no rows are read)
+        '''
+        query, _ = cls.select_query(filepath_data['schema'], filepath_data['table'], limit=0)
+        with DatasetStorageSqlalchemy.metadata.bind.connect() as connection:
+            names = list(connection.execute(query).keys())
+        return [name for name in names if name != filepath_data.get('row_number_column')]
+
+    @staticmethod
+    def quote_identifier(name: str) -> str:
+        return '"{}"'.format(str(name).replace('"', '""'))
+
+    @classmethod
+    def select_query(cls,
+                     schema: str,
+                     table: str,
+                     columns: Optional[List[str]] = None,
+                     filters: Optional[List[Tuple[str, str, Any]]] = None,
+                     count: bool = False,
+                     limit: Optional[int] = None,
+                     row_number_column: Optional[str] = None) -> Tuple[TextClause, Dict[str, Any]]:
+        '''
+        Build a parameterized select statement for the table
+
+        Filtered selects also return the row positions (the stored
+        `row_number_column` or a `ROW_NUMBER_COLUMN` window numbering)
+
+        :param row_number_column: stored column with the row positions
+        '''
+        source = f'{cls.quote_identifier(schema)}.{cls.quote_identifier(table)}'
+        if columns is None:
+            selection = '*'
+        else:
+            selection = ', '.join(cls.quote_identifier(column) for column in columns)
+
+        params: Dict[str, Any] = {}
+        conditions = []
+        for column, operator, value in filters or []:
+            operator = operator.lower()
+            if operator == '==':
+                operator = '='
+            if operator not in SQL_FILTER_OPERATORS:
+                raise ValueError(f'Unsupported filter operator {operator}, expected one of {SQL_FILTER_OPERATORS}')
+            if operator in ('in', 'not in'):
+                names = [f'filter_{len(params) + i}' for i in range(len(value))]
+                params.update(zip(names, value))
+                if names:
+                    placeholders = ', '.join(f':{name}' for name in names)
+                    conditions.append(f'{cls.quote_identifier(column)} {operator} ({placeholders})')
+                elif operator == 'in':
+                    conditions.append('1 = 0')
+            else:
+                name = f'filter_{len(params)}'
+                params[name] = value
+                conditions.append(f'{cls.quote_identifier(column)} {operator} :{name}')
+
+        order_by = None
+        if count:
+            query = f'SELECT count(*) FROM {source}'
+        elif filters and row_number_column is not None:
+            if columns is not None:
+                selection += f', {cls.quote_identifier(row_number_column)}'
+            query = f'SELECT {selection} FROM {source}'
+            order_by = cls.quote_identifier(row_number_column)
+        elif filters:
+            # Number rows before filtering to keep their positions
+            if columns is not None:
+                selection += f', {ROW_NUMBER_COLUMN}'
+            query = f'SELECT {selection} FROM ' \
+                f'(SELECT *, row_number() OVER () - 1 AS {ROW_NUMBER_COLUMN} FROM {source}) AS numbered'
+        else:
+            query = f'SELECT {selection} FROM {source}'
+
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        if order_by is not None:
+            query += f' ORDER BY {order_by}'
+        if limit is not None:
+            query += f' LIMIT {int(limit)}'
+        return text(query), params
 
 
 @SavePatternDecorators.register_save_pattern
@@ -66,27 +206,42 @@ class DatabasePickleSavePattern(BaseSavePattern):
              obj: Any,
              persistable_type: str,
              persistable_id: str,
-             **kwargs) -> str:
+             compression: Optional[str] = DEFAULT_COMPRESSION,
+             compression_level: Optional[int] = DEFAULT_COMPRESSION_LEVEL,
+             chunk_size: int = DEFAULT_BLOB_CHUNK_BYTES,
+             **kwargs) -> Dict[str, Any]:
         '''
         Save method to save files into binary schema
 
+        The pickle is streamed into fixed size chunk rows as it is serialized,
+        so memory use is bounded by the chunk size
+
         Hardcoded to only store pickled objects in database so overwrite to use
         other storage mechanism
         '''
-        pickled_stream = cls.pickle_object(obj, as_stream=True)
-        pickled_record = BinaryBlob.create(
-            object_type=persistable_type, object_id=persistable_id, binary_blob=pickled_stream)
-        return str(pickled_record.id)
+        compression = resolve_codec(compression)
+        blob_id, chunks = BinaryBlob.write_chunked(
+            object_type=persistable_type, object_id=persistable_id, chunk_size=chunk_size,
+            write=lambda fileobj: cls.pickle_to_fileobj(obj, fileobj, compression, compression_level))
+        return {'primary_key': blob_id, 'chunks': chunks,
+                'compression': compression, 'compression_level': compression_level}
 
     @classmethod
     def load(cls,
-             primary_key: str,
+             filepath_data: Union[str, Dict[str, Any]],
              **kwargs) -> Any:
         '''
-        Load method to load files from database
+        Load method to load files from database. Chunked blobs are streamed
+        and verified chunk by chunk
 
         Hardcoded to only pull from pickled so overwrite to use
         other storage mechanism
         '''
+        primary_key, compression = cls.parse_filepath_data(filepath_data, reference_key='primary_key')
+        if isinstance(filepath_data, dict) and 'chunks' in filepath_data:
+            with BinaryBlob.open_chunked(primary_key, filepath_data['chunks']) as blob_file:
+                return cls.load_pickled_fileobj(blob_file, compression)
+
+        # Single row blobs
         pickled_stream = BinaryBlob.find(primary_key).binary_blob
-        return cls.load_pickled_object(pickled_stream, stream=True)
+        return cls.load_pickled_object(pickled_stream, stream=True, compression=compression)
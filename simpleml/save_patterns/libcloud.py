@@ -6,17 +6,26 @@ Uses Apache Libcloud as a universal engine
 __author__ = 'Elisha Yadgaran'
 
 
+import re
+
 from os.path import join, isfile
-from typing import Any
+from typing import Any, Dict, Optional, List, Tuple, Union
 
+from simpleml.save_patterns.artifact_cache import ARTIFACT_CACHE
 from simpleml.save_patterns.base import BaseSavePattern
+from simpleml.save_patterns.compression import resolve_codec, COMPRESSION_EXTENSIONS,\
+    DEFAULT_COMPRESSION, DEFAULT_COMPRESSION_LEVEL
 from simpleml.save_patterns.decorators import SavePatternDecorators
 from simpleml.utils.configuration import PICKLED_FILESTORE_DIRECTORY,\
-    HDF5_FILESTORE_DIRECTORY, PICKLE_DIRECTORY, HDF5_DIRECTORY, CONFIG, CLOUD_SECTION
+    HDF5_FILESTORE_DIRECTORY, PICKLE_DIRECTORY, HDF5_DIRECTORY, CONFIG, CLOUD_SECTION,\
+    PARQUET_FILESTORE_DIRECTORY, PARQUET_DIRECTORY
 from simpleml.imports import Provider
 from simpleml.imports import get_driver
 
 
+MD5_PATTERN = re.compile(r'^[0-9a-fA-F]{32}$')
+
+
 class CloudSavePatternMixin(object):
     '''
     Mixin class to save/load objects via Apache Libcloud
@@ -70,21 +79,34 @@ class CloudSavePatternMixin(object):
 
     # Global initialization of cloud provider. Avoids reauthentication per persistable
     CLOUD_DRIVER = None
+    # folder: (local filestore directory, cloud directory). Unknown folders use HDF5
+    CLOUD_FOLDERS = {
+        'pickle': (PICKLED_FILESTORE_DIRECTORY, PICKLE_DIRECTORY),
+        'hdf5': (HDF5_FILESTORE_DIRECTORY, HDF5_DIRECTORY),
+        'parquet': (PARQUET_FILESTORE_DIRECTORY, PARQUET_DIRECTORY),
+    }
 
-    @property
-    def driver(self):
+    @classmethod
+    def get_cloud_driver(cls):
         '''
-        "classproperty" to return and optionally globally set the cloud provider
+        Return and optionally globally set the cloud provider
         '''
-        if self.__class__.CLOUD_DRIVER is None:
+        if cls.CLOUD_DRIVER is None:
             cloud_section = CONFIG.get(CLOUD_SECTION, 'section')
             connection_params = CONFIG.getlist(cloud_section, 'connection_params')
 
             driver_cls = get_driver(getattr(Provider, CONFIG.get(cloud_section, 'driver')))
             driver = driver_cls(**{param: CONFIG.get(cloud_section, param) for param in connection_params})
 
-            self.__class__.CLOUD_DRIVER = driver
-        return self.__class__.CLOUD_DRIVER
+            cls.CLOUD_DRIVER = driver
+        return cls.CLOUD_DRIVER
+
+    @property
+    def driver(self):
+        '''
+        Instance accessor for the (globally set) cloud provider
+        '''
+        return self.get_cloud_driver()
 
     @classmethod
     def reset_driver(cls):
@@ -94,60 +116,83 @@ class CloudSavePatternMixin(object):
         '''
         cls.CLOUD_DRIVER = None
 
-    def upload_to_cloud(self,
+    @classmethod
+    def cloud_paths(cls, folder: str, filename: str, root_path: str) -> Tuple[str, str]:
+        '''
+        Local filepath and cloud object name for a file
+        '''
+        filestore_directory, cloud_directory = cls.CLOUD_FOLDERS.get(folder, cls.CLOUD_FOLDERS['hdf5'])
+        return join(filestore_directory, filename), join(root_path, cloud_directory, filename)
+
+    @classmethod
+    def upload_to_cloud(cls,
                         folder: str,
                         filename: str) -> None:
         '''
         Upload any file from disk to cloud
         '''
+        driver = cls.get_cloud_driver()
         cloud_section = CONFIG.get(CLOUD_SECTION, 'section')
         root_path = CONFIG.get(cloud_section, 'path', fallback='')
-        container = self.driver.get_container(container_name=CONFIG.get(cloud_section, 'container'))
+        container = driver.get_container(container_name=CONFIG.get(cloud_section, 'container'))
         extra = {'content_type': 'application/octet-stream'}
+        filepath, object_name = cls.cloud_paths(folder, filename, root_path)
 
-        if folder == 'pickle':
-            filepath = join(PICKLED_FILESTORE_DIRECTORY, filename)
-            object_name = join(root_path, PICKLE_DIRECTORY, filename)
-        else:
-            filepath = join(HDF5_FILESTORE_DIRECTORY, filename)
-            object_name = join(root_path, HDF5_DIRECTORY, filename)
+        driver.upload_object(filepath,
+                             container=container,
+                             object_name=object_name,
+                             extra=extra)
 
-        self.driver.upload_object(filepath,
-                                  container=container,
-                                  object_name=object_name,
-                                  extra=extra)
+    @staticmethod
+    def _provider_md5(obj: Any) -> Optional[str]:
+        '''
+        Provider checksum of the object, when it is a plain md5 (multipart
+        uploads and some providers use other formats)
+        '''
+        checksum = str(getattr(obj, 'hash', '') or '').strip('"')
+        if MD5_PATTERN.match(checksum):
+            return checksum
+        return None
 
-    def download_from_cloud(self,
+    @classmethod
+    def download_from_cloud(cls,
                             folder: str,
-                            filename: str) -> None:
+                            filename: str) -> str:
         '''
-        Download any file from cloud to disk
+        Download any file from cloud to disk. Returns the local filepath to
+        read the artifact from
+
+        With the artifact cache enabled, downloads are shared by every process
+        on the machine and the returned path points into the (read only) cache
         '''
         cloud_section = CONFIG.get(CLOUD_SECTION, 'section')
         root_path = CONFIG.get(cloud_section, 'path', fallback='')
         container = CONFIG.get(cloud_section, 'container')
+        filepath, object_name = cls.cloud_paths(folder, filename, root_path)
+
+        # Check if file was already saved or downloaded before initiating cloud connection
+        if isfile(filepath):
+            return filepath
 
-        if folder == 'pickle':
-            filepath = join(PICKLED_FILESTORE_DIRECTORY, filename)
-            # Check if file was already downloaded before initiating cloud connection
-            if isfile(filepath):
-                return
-            obj = self.driver.get_object(
-                container_name=container,
-                object_name=join(root_path, PICKLE_DIRECTORY, filename))
-        else:
-            filepath = join(HDF5_FILESTORE_DIRECTORY, filename)
-            # Check if file was already downloaded before initiating cloud connection
-            if isfile(filepath):
-                return
-            obj = self.driver.get_object(
-                container_name=container,
-                object_name=join(root_path, HDF5_DIRECTORY, filename))
-
-        self.driver.download_object(obj,
-                                    destination_path=filepath,
-                                    overwrite_existing=True,
-                                    delete_on_failure=True)
+        driver = cls.get_cloud_driver()
+        obj = driver.get_object(container_name=container, object_name=object_name)
+
+        if not ARTIFACT_CACHE.enabled:
+            driver.download_object(obj,
+                                   destination_path=filepath,
+                                   overwrite_existing=True,
+                                   delete_on_failure=True)
+            return filepath
+
+        def download(path: str) -> None:
+            driver.download_object(obj,
+                                   destination_path=path,
+                                   overwrite_existing=True,
+                                   delete_on_failure=True)
+
+        # Keyed on the provider checksum so overwritten objects are refetched
+        key = f'{container}/{object_name}@{obj.hash}'
+        return ARTIFACT_CACHE.fetch(key, download, expected_md5=cls._provider_md5(obj))
 
 
 class CloudBase(BaseSavePattern, CloudSavePatternMixin):
@@ -168,28 +213,32 @@ class CloudPickleSavePattern(CloudBase):
     def save(cls,
              obj: Any,
              persistable_id: str,
-             **kwargs) -> str:
+             compression: Optional[str] = DEFAULT_COMPRESSION,
+             compression_level: Optional[int] = DEFAULT_COMPRESSION_LEVEL,
+             **kwargs) -> Union[str, Dict[str, Any]]:
         '''
-        Save method to save files to disk in pickled format
+        Save method to save files to disk in pickled format (optionally compressed)
         Then upload pickled file from disk to cloud
         '''
-        filename = f'{persistable_id}.pkl'
+        compression = resolve_codec(compression)
+        filename = f'{persistable_id}.pkl{COMPRESSION_EXTENSIONS.get(compression, "")}'
         folder = 'pickle'
-        cls.pickle_object(obj, filename)
+        cls.pickle_object(obj, filename, compression=compression, compression_level=compression_level)
         cls.upload_to_cloud(folder, filename)
-        return filename
+        return cls.compressed_filepath_data(filename, compression, compression_level)
 
     @classmethod
     def load(cls,
-             filename: str,
+             filepath_data: Union[str, Dict[str, Any]],
              **kwargs) -> Any:
         '''
         Download pickled file from cloud to disk
         Then load files from disk in pickled format
         '''
+        filename, compression = cls.parse_filepath_data(filepath_data)
         folder = 'pickle'
-        cls.download_from_cloud(folder, filename)
-        return cls.load_pickled_object(filename)
+        filepath = cls.download_from_cloud(folder, filename)
+        return cls.load_pickled_object(filepath, root_directory='', compression=compression)
 
 
 @SavePatternDecorators.register_save_pattern
@@ -203,6 +252,8 @@ class CloudHDF5SavePattern(CloudBase):
     def save(cls,
              obj: Any,
              persistable_id: str,
+             compression: Optional[str] = DEFAULT_COMPRESSION,
+             compression_level: Optional[int] = DEFAULT_COMPRESSION_LEVEL,
              **kwargs) -> str:
         '''
         Save method to save files to disk in HDF5 format
@@ -210,7 +261,7 @@ class CloudHDF5SavePattern(CloudBase):
         '''
         filename = f'{persistable_id}.h5'
         folder = 'hdf5'
-        cls.hickle_object(obj, filename)
+        cls.hickle_object(obj, filename, compression=compression, compression_level=compression_level)
         cls.upload_to_cloud(folder, filename)
         return filename
 
@@ -223,8 +274,8 @@ class CloudHDF5SavePattern(CloudBase):
         Then load files from disk in HDF5 format
         '''
         folder = 'hdf5'
-        cls.download_from_cloud(folder, filename)
-        return cls.load_hickled_object(filename)
+        filepath = cls.download_from_cloud(folder, filename)
+        return cls.load_hickled_object(filepath, root_directory='')
 
 
 @SavePatternDecorators.register_save_pattern
@@ -258,5 +309,51 @@ class CloudKerasHDF5SavePattern(CloudBase):
         Then load files from disk in HDF5 format
         '''
         folder = 'hdf5'
-        cls.download_from_cloud(folder, filename)
-        return cls.load_keras_object(filename)
+        filepath = cls.download_from_cloud(folder, filename)
+        return cls.load_keras_object(filepath, root_directory='')
+
+
+@SavePatternDecorators.register_save_pattern
+class CloudParquetSavePattern(CloudBase):
+    '''
+    Save pattern implementation to save dataframes to Cloud in parquet format.
+    Supports partial loads of columns and row groups from the downloaded file
+    '''
+    SAVE_PATTERN = 'cloud_parquet'
+
+    @classmethod
+    def save(cls,
+             obj: Any,
+             persistable_id: str,
+             **kwargs) -> str:
+        '''
+        Save method to save files to disk in parquet format
+        Then upload parquet file from disk to cloud
+        '''
+        filename = f'{persistable_id}.parquet'
+        folder = 'parquet'
+        cls.parquet_object(obj, filename)
+        cls.upload_to_cloud(folder, filename)
+        return filename
+
+    @classmethod
+    def load(cls,
+             filename: str,
+             columns: Optional[List[str]] = None,
+             filters: Optional[List[Tuple[str, str, Any]]] = None,
+             **kwargs) -> Any:
+        '''
+        Download parquet file from cloud to disk
+        Then load (a subset of) the file from disk in parquet format
+        '''
+        folder = 'parquet'
+        filepath = cls.download_from_cloud(folder, filename)
+        return cls.load_parquet_object(filepath, columns=columns, filters=filters, root_directory='')
+
+    @classmethod
+    def column_names(cls, filename: str) -> List[str]:
+        '''
+        Column names of the saved dataframe
+        '''
+        filepath = cls.download_from_cloud('parquet', filename)
+        return cls.load_parquet_columns(filepath, root_directory='')
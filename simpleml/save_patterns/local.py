@@ -5,10 +5,12 @@ Module for save patterns registered for local persistence
 __author__ = 'Elisha Yadgaran'
 
 
-from typing import Any
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from simpleml.save_patterns.decorators import SavePatternDecorators
 from simpleml.save_patterns.base import BaseSavePattern
+from simpleml.save_patterns.compression import resolve_codec, COMPRESSION_EXTENSIONS,\
+    DEFAULT_COMPRESSION, DEFAULT_COMPRESSION_LEVEL
 
 
 @SavePatternDecorators.register_save_pattern
@@ -19,20 +21,28 @@ class DiskPickleSavePattern(BaseSavePattern):
     SAVE_PATTERN = 'disk_pickled'
 
     @classmethod
-    def save(cls, obj: Any, persistable_id: str, **kwargs) -> str:
+    def save(cls,
+             obj: Any,
+             persistable_id: str,
+             compression: Optional[str] = DEFAULT_COMPRESSION,
+             compression_level: Optional[int] = DEFAULT_COMPRESSION_LEVEL,
+             **kwargs) -> Union[str, Dict[str, Any]]:
         '''
-        Save method to save files to disk in pickled format
+        Save method to save files to disk in pickled format, optionally
+        compressed. Compressed artifacts record the codec with the filename
         '''
-        filename = f'{persistable_id}.pkl'
-        cls.pickle_object(obj, filename)
-        return filename
+        compression = resolve_codec(compression)
+        filename = f'{persistable_id}.pkl{COMPRESSION_EXTENSIONS.get(compression, "")}'
+        cls.pickle_object(obj, filename, compression=compression, compression_level=compression_level)
+        return cls.compressed_filepath_data(filename, compression, compression_level)
 
     @classmethod
-    def load(cls, filename: str, **kwargs) -> Any:
+    def load(cls, filepath_data: Union[str, Dict[str, Any]], **kwargs) -> Any:
         '''
         Load method to load files from disk in pickled format
         '''
-        return cls.load_pickled_object(filename)
+        filename, compression = cls.parse_filepath_data(filepath_data)
+        return cls.load_pickled_object(filename, compression=compression)
 
 
 @SavePatternDecorators.register_save_pattern
@@ -43,12 +53,18 @@ class DiskHDF5SavePattern(BaseSavePattern):
     SAVE_PATTERN = 'disk_hdf5'
 
     @classmethod
-    def save(cls, obj: Any, persistable_id: str, **kwargs) -> str:
+    def save(cls,
+             obj: Any,
+             persistable_id: str,
+             compression: Optional[str] = DEFAULT_COMPRESSION,
+             compression_level: Optional[int] = DEFAULT_COMPRESSION_LEVEL,
+             **kwargs) -> str:
         '''
-        Save method to save files to disk in hickle's HDF5 format
+        Save method to save files to disk in hickle's HDF5 format. Compression
+        is applied as HDF5 dataset filters, so the filename is unchanged
         '''
         filename = f'{persistable_id}.h5'
-        cls.hickle_object(obj, filename)
+        cls.hickle_object(obj, filename, compression=compression, compression_level=compression_level)
         return filename
 
     @classmethod
@@ -82,3 +98,65 @@ class KerasDiskHDF5SavePattern(BaseSavePattern):
         Load method to load files from disk in Keras's HDF5 format
         '''
         return cls.load_keras_object(filename)
+
+
+@SavePatternDecorators.register_save_pattern
+class DiskMemoryMappedSavePattern(BaseSavePattern):
+    '''
+    Save pattern implementation to save objects to disk with numeric arrays
+    in a raw layout that is memory mapped on load. Processes loading the same
+    artifact share the array data through the page cache
+    '''
+    SAVE_PATTERN = 'disk_npy_mmap'
+
+    @classmethod
+    def save(cls, obj: Any, persistable_id: str, **kwargs) -> str:
+        '''
+        Save method to save files to disk in the memory mapped layout
+        '''
+        filename = f'{persistable_id}.mmap'
+        cls.mmap_object(obj, filename)
+        return filename
+
+    @classmethod
+    def load(cls, filename: str, **kwargs) -> Any:
+        '''
+        Load method to load files from disk with memory mapped (read only) arrays
+        '''
+        return cls.load_mmapped_object(filename)
+
+
+@SavePatternDecorators.register_save_pattern
+class DiskParquetSavePattern(BaseSavePattern):
+    '''
+    Save pattern implementation to save dataframes to disk in parquet format.
+    Supports partial loads of columns and row groups
+    '''
+    SAVE_PATTERN = 'disk_parquet'
+
+    @classmethod
+    def save(cls, obj: Any, persistable_id: str, **kwargs) -> str:
+        '''
+        Save method to save dataframes to disk in parquet format
+        '''
+        filename = f'{persistable_id}.parquet'
+        cls.parquet_object(obj, filename)
+        return filename
+
+    @classmethod
+    def load(cls,
+             filename: str,
+             columns: Optional[List[str]] = None,
+             filters: Optional[List[Tuple[str, str, Any]]] = None,
+             **kwargs) -> Any:
+        '''
+        Load method to load (a subset of) dataframes from disk in parquet format
+        '''
+        return cls.load_parquet_object(filename, columns=columns, filters=filters)
+
+    @classmethod
+    def column_names(cls, filename: str) -> List[str]:
+        '''
+        Column names of the saved dataframe
+        '''
+        return cls.load_parquet_columns(filename)
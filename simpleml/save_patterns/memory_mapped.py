@@ -0,0 +1,131 @@
+'''
+Module for the memory mapped artifact format
+
+Pickled artifacts are fully deserialized into process memory, so every worker
+scoring with the same model or dataset holds a private copy of its arrays.
+The memory mapped format pickles the object graph as usual, but writes every
+large numeric ndarray (including the blocks backing pandas objects) to its
+own `.npy` file. Loads map those files read only with
+`np.load(mmap_mode='r')`, so processes share the arrays through the page
+cache and only touched pages are read from disk.
+
+Layout:
+```
+<artifact>/
+├── object.pkl   -- object graph with arrays replaced by references
+└── <n>.npy      -- raw array data (64 byte aligned npy format)
+```
+
+Loaded arrays are read only. Arrays smaller than the threshold are kept inline
+in the pickle. Configured via:
+```
+[persistence]
+mmap_min_bytes = 65536
+```
+'''
+
+__author__ = 'Elisha Yadgaran'
+
+
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+
+import cloudpickle
+import numpy as np
+
+from os.path import join, isdir, dirname, basename
+from typing import Any, BinaryIO, Dict, Tuple
+
+from simpleml.utils.configuration import CONFIG, PERSISTENCE_SECTION
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+DEFAULT_MMAP_MIN_BYTES: int = CONFIG.getint(PERSISTENCE_SECTION, 'mmap_min_bytes', fallback=64 * 1024)
+OBJECT_FILENAME: str = 'object.pkl'
+PERSISTENT_ID_PREFIX: str = 'simpleml_npy'
+
+
+class ArrayExtractingPickler(cloudpickle.Pickler):
+    '''
+    Pickler that writes numeric arrays out of band to .npy files
+    '''
+
+    def __init__(self, file: BinaryIO, directory: str, min_bytes: int = DEFAULT_MMAP_MIN_BYTES, **kwargs):
+        super(ArrayExtractingPickler, self).__init__(file, **kwargs)
+        self.directory = directory
+        self.min_bytes = min_bytes
+        # Shared arrays are only written once
+        self.written_arrays: Dict[int, Tuple[str, str]] = {}
+        self._references = []
+
+    def persistent_id(self, obj: Any) -> Any:
+        if not isinstance(obj, np.ndarray) or obj.dtype.hasobject or obj.nbytes < self.min_bytes:
+            return None
+
+        key = id(obj)
+        if key not in self.written_arrays:
+            filename = f'{len(self.written_arrays)}.npy'
+            np.save(join(self.directory, filename), obj, allow_pickle=False)
+            self.written_arrays[key] = (PERSISTENT_ID_PREFIX, filename)
+            # Keep the array alive so its id is not reused during the dump
+            self._references.append(obj)
+        return self.written_arrays[key]
+
+
+class ArrayMappingUnpickler(pickle.Unpickler):
+    '''
+    Unpickler that restores out of band arrays as read only memory maps
+    '''
+
+    def __init__(self, file: BinaryIO, directory: str, **kwargs):
+        super(ArrayMappingUnpickler, self).__init__(file, **kwargs)
+        self.directory = directory
+        # Shared arrays map to the same object, like regular pickle memoization
+        self.loaded_arrays: Dict[str, np.ndarray] = {}
+
+    def persistent_load(self, pid: Any) -> np.ndarray:
+        prefix, filename = pid
+        if prefix != PERSISTENT_ID_PREFIX:
+            raise pickle.UnpicklingError(f'Unsupported persistent id: {pid}')
+        if filename not in self.loaded_arrays:
+            self.loaded_arrays[filename] = np.load(join(self.directory, filename), mmap_mode='r', allow_pickle=False)
+        return self.loaded_arrays[filename]
+
+
+def dump_memory_mapped(obj: Any, directory: str, min_bytes: int = DEFAULT_MMAP_MIN_BYTES) -> int:
+    '''
+    Write the object to the directory in the memory mapped layout. Written to
+    a temporary directory first and swapped into place, so concurrent readers
+    never see partial artifacts. Returns the number of extracted arrays
+    '''
+    directory = directory.rstrip('/')
+    temp_directory = tempfile.mkdtemp(prefix=f'.{basename(directory)}.', dir=dirname(directory))
+    try:
+        with open(join(temp_directory, OBJECT_FILENAME), 'wb') as object_file:
+            pickler = ArrayExtractingPickler(object_file, temp_directory, min_bytes=min_bytes)
+            pickler.dump(obj)
+
+        if isdir(directory):
+            # Existing maps keep referencing the unlinked files
+            shutil.rmtree(directory)
+        os.rename(temp_directory, directory)
+    except BaseException:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        raise
+
+    LOGGER.debug(f'Wrote {len(pickler.written_arrays)} memory mapped arrays to {directory}')
+    return len(pickler.written_arrays)
+
+
+def load_memory_mapped(directory: str) -> Any:
+    '''
+    Load an object written with `dump_memory_mapped`. Extracted arrays are
+    read only memory maps
+    '''
+    with open(join(directory, OBJECT_FILENAME), 'rb') as object_file:
+        return ArrayMappingUnpickler(object_file, directory).load()
@@ -0,0 +1,190 @@
+'''
+Module for pickling with out of band buffers (pickle protocol 5)
+
+Regular pickles copy every ndarray into the pickle stream, and loading copies
+them out again into new arrays, so loads hold two copies of the data at
+peak. Protocol 5 hands contiguous buffers (numpy arrays, pandas blocks, etc)
+to a callback instead. The buffers are written as separate segments after
+the pickle stream and passed back to the unpickler as views, so arrays are
+reconstructed without copying. Uncompressed files can optionally be memory
+mapped, in which case loaded arrays are read only and shared through the
+page cache.
+
+Layout:
+```
+magic (8 bytes) | header length (uint64) | json header | padding
+pickle stream | buffer segments (64 byte aligned)
+```
+
+The header holds the (offset, length) of the pickle stream and each buffer
+relative to the (aligned) data section. Files without the magic prefix are
+regular pickles and load as before. Buffers smaller than the threshold are
+kept in band. Configured via:
+```
+[persistence]
+pickle_protocol = 5  # lower protocols write regular pickles
+pickle_buffer_min_bytes = 65536
+pickle_mmap = false
+```
+'''
+
+__author__ = 'Elisha Yadgaran'
+
+
+import json
+import mmap
+import pickle
+import struct
+
+import cloudpickle
+import numpy as np
+
+from typing import Any, BinaryIO, Dict, List, Tuple, Union
+
+from simpleml.utils.configuration import CONFIG, PERSISTENCE_SECTION
+from simpleml.utils.errors import SimpleMLError
+
+
+DEFAULT_PICKLE_PROTOCOL: int = CONFIG.getint(PERSISTENCE_SECTION, 'pickle_protocol', fallback=pickle.HIGHEST_PROTOCOL)
+DEFAULT_PICKLE_BUFFER_MIN_BYTES: int = CONFIG.getint(PERSISTENCE_SECTION, 'pickle_buffer_min_bytes', fallback=64 * 1024)
+DEFAULT_PICKLE_MMAP: bool = CONFIG.getboolean(PERSISTENCE_SECTION, 'pickle_mmap', fallback=False)
+
+OUT_OF_BAND_MAGIC: bytes = b'SMLPKL5\x00'
+HEADER_PREFIX = struct.Struct('<8sQ')
+BUFFER_ALIGNMENT: int = 64
+# Out of band buffers need pickle protocol 5 (python 3.8+)
+OUT_OF_BAND_SUPPORTED: bool = pickle.HIGHEST_PROTOCOL >= 5
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // BUFFER_ALIGNMENT) * BUFFER_ALIGNMENT
+
+
+def _read_exact(fileobj: BinaryIO, size: int) -> bytes:
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise SimpleMLError('Truncated out of band pickle')
+    return data
+
+
+def is_out_of_band(prefix: bytes) -> bool:
+    '''
+    Whether serialized bytes (or their first bytes) are in the out of band layout
+    '''
+    return bytes(prefix[:len(OUT_OF_BAND_MAGIC)]) == OUT_OF_BAND_MAGIC
+
+
+def dump_out_of_band(obj: Any,
+                     fileobj: BinaryIO,
+                     protocol: int = DEFAULT_PICKLE_PROTOCOL,
+                     min_bytes: int = DEFAULT_PICKLE_BUFFER_MIN_BYTES) -> int:
+    '''
+    Pickle the object into the file object with large buffers out of band.
+    Writes a regular pickle for protocols below 5. Returns the number of out
+    of band buffers
+    '''
+    if protocol < 5 or not OUT_OF_BAND_SUPPORTED:
+        cloudpickle.dump(obj, fileobj, protocol=min(protocol, pickle.HIGHEST_PROTOCOL))
+        return 0
+
+    buffers: List[memoryview] = []
+
+    def buffer_callback(buffer: 'pickle.PickleBuffer') -> bool:
+        # Truthy return values keep the buffer in band
+        try:
+            view = buffer.raw()
+        except BufferError:  # Not contiguous
+            return True
+        if view.nbytes < min_bytes:
+            return True
+        buffers.append(view)
+        return False
+
+    stream = cloudpickle.dumps(obj, protocol=protocol, buffer_callback=buffer_callback)
+
+    # Segment offsets are relative to the data section
+    segments: List[Tuple[int, int]] = []
+    offset = len(stream)
+    for view in buffers:
+        offset = _aligned(offset)
+        segments.append((offset, view.nbytes))
+        offset += view.nbytes
+    header = json.dumps({'pickle': [0, len(stream)], 'buffers': segments, 'size': offset}).encode()
+    data_start = _aligned(HEADER_PREFIX.size + len(header))
+
+    fileobj.write(HEADER_PREFIX.pack(OUT_OF_BAND_MAGIC, len(header)))
+    fileobj.write(header)
+    fileobj.write(b'\x00' * (data_start - HEADER_PREFIX.size - len(header)))
+    fileobj.write(stream)
+    position = len(stream)
+    for (segment_offset, _), view in zip(segments, buffers):
+        fileobj.write(b'\x00' * (segment_offset - position))
+        fileobj.write(view)
+        position = segment_offset + view.nbytes
+    return len(buffers)
+
+
+def _read_header(fileobj: BinaryIO) -> Tuple[Dict[str, Any], int, int]:
+    '''
+    Returns the header, the offset of the data section and the bytes read
+    '''
+    magic, header_length = HEADER_PREFIX.unpack(_read_exact(fileobj, HEADER_PREFIX.size))
+    if magic != OUT_OF_BAND_MAGIC:
+        raise SimpleMLError('Not an out of band pickle')
+    header = json.loads(_read_exact(fileobj, header_length))
+    read = HEADER_PREFIX.size + header_length
+    return header, _aligned(read), read
+
+
+def _load_data(data: Union[np.ndarray, memoryview], header: Dict[str, Any]) -> Any:
+    view = memoryview(data)
+    pickle_offset, pickle_length = header['pickle']
+    buffers = [view[offset:offset + length] for offset, length in header['buffers']]
+    return pickle.loads(view[pickle_offset:pickle_offset + pickle_length], buffers=buffers)
+
+
+def load_out_of_band(fileobj: BinaryIO, mmap_mode: bool = False) -> Any:
+    '''
+    Load an object written with `dump_out_of_band`. The data section is read
+    into a single buffer that the arrays are reconstructed on, without copying.
+
+    :param mmap_mode: map the file (read only) instead of reading it. Only
+        for real, uncompressed files
+    '''
+    header, data_start, read = _read_header(fileobj)
+    if mmap_mode:
+        # Offsets need to be page aligned so map the whole file and slice
+        mapped = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        return _load_data(memoryview(mapped)[data_start:data_start + header['size']], header)
+
+    _read_exact(fileobj, data_start - read)
+    # Uninitialized (unlike bytearray) since every byte is read into
+    data = np.empty(header['size'], dtype=np.uint8)
+    view = memoryview(data)
+    position = 0
+    while position < len(data):
+        count = fileobj.readinto(view[position:])
+        if not count:
+            raise SimpleMLError('Truncated out of band pickle')
+        position += count
+    return _load_data(data, header)
+
+
+def loads_out_of_band(data: Union[bytes, bytearray, memoryview]) -> Any:
+    '''
+    Load an object from `dump_out_of_band` bytes (ex: a database stream).
+    Arrays are reconstructed on views of the passed buffer, without copying,
+    so they are read only unless the buffer is writable (ex: bytearray)
+    '''
+    view = memoryview(data)
+    if len(view) < HEADER_PREFIX.size:
+        raise SimpleMLError('Truncated out of band pickle')
+    magic, header_length = HEADER_PREFIX.unpack_from(view)
+    if magic != OUT_OF_BAND_MAGIC:
+        raise SimpleMLError('Not an out of band pickle')
+    read = HEADER_PREFIX.size + header_length
+    header = json.loads(bytes(view[HEADER_PREFIX.size:read]))
+    data_start = _aligned(read)
+    if len(view) < data_start + header['size']:
+        raise SimpleMLError('Truncated out of band pickle')
+    return _load_data(view[data_start:data_start + header['size']], header)
@@ -0,0 +1,231 @@
+'''
+Module for serializing an artifact once and writing it to many save patterns
+
+Persistables can save the same artifact via multiple save patterns (ex:
+`disk_pickled`, `cloud_pickled` and `database_pickled`). Each pattern
+independently serializes the object, so a large model gets pickled once per
+pattern. A serialization cache holds the serialized bytes of each object in a
+shared buffer (spooled to a temporary file above a size threshold) so every
+pattern consumes the same serialization. Patterns that write the same local
+file (ex: disk and cloud pickles) only write it once.
+
+Usage:
+```
+with SerializationCache():
+    for save_pattern in save_patterns:
+        save_cls.save(obj=obj, ...)  # obj is only pickled for the first pattern
+```
+'''
+
+__author__ = 'Elisha Yadgaran'
+
+
+import logging
+import shutil
+import tempfile
+import threading
+
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, IO, Iterator, List, Optional, Tuple
+
+from simpleml.utils.configuration import CONFIG, PERSISTENCE_SECTION
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# Serialized artifacts larger than this are spooled to a temporary file
+# instead of being held in memory. Configured via:
+# [persistence]
+# spool_max_bytes = 67108864
+DEFAULT_SPOOL_MAX_BYTES: int = CONFIG.getint(PERSISTENCE_SECTION, 'spool_max_bytes', fallback=64 * 1024 ** 2)
+# Block size to stream spooled buffers with
+COPY_BUFFER_BYTES: int = 1024 ** 2
+
+# Stack of caches activated via the context manager protocol. Thread local so
+# concurrent saves of different persistables never share (or clear) each
+# other's caches. Worker threads of a save are handed its cache explicitly
+# (see `activate_serialization_cache`)
+_ACTIVE = threading.local()
+
+
+def _active_caches() -> List['SerializationCache']:
+    if not hasattr(_ACTIVE, 'caches'):
+        _ACTIVE.caches = []
+    return _ACTIVE.caches
+
+
+def get_active_serialization_cache() -> Optional['SerializationCache']:
+    '''
+    Returns the innermost cache activated on the current thread, if any
+    '''
+    caches = _active_caches()
+    if caches:
+        return caches[-1]
+    return None
+
+
+@contextmanager
+def activate_serialization_cache(cache: Optional['SerializationCache']) -> Iterator[Optional['SerializationCache']]:
+    '''
+    Activate a cache on the current thread without taking ownership (the
+    cache is not cleared on exit). Used to share a cache with worker threads.
+    None is a no-op
+    '''
+    if cache is None:
+        yield None
+        return
+    caches = _active_caches()
+    caches.append(cache)
+    try:
+        yield cache
+    finally:
+        caches.remove(cache)
+
+
+class SerializedBuffer(object):
+    '''
+    Serialized bytes of an object. Kept in memory up to `max_memory_bytes`,
+    then rolled over to a temporary file on disk
+    '''
+
+    def __init__(self, max_memory_bytes: int = DEFAULT_SPOOL_MAX_BYTES):
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory_bytes)
+        # Reads seek the shared file so concurrent consumers need to serialize
+        self._lock = threading.Lock()
+
+    @property
+    def fileobj(self) -> IO[bytes]:
+        '''
+        Writable file object to serialize into
+        '''
+        return self._file
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            self._file.seek(0, 2)
+            return self._file.tell()
+
+    @property
+    def spooled(self) -> bool:
+        '''
+        Whether the buffer rolled over to disk
+        '''
+        return bool(getattr(self._file, '_rolled', False))
+
+    def getvalue(self) -> bytes:
+        with self._lock:
+            self._file.seek(0)
+            return self._file.read()
+
+    def copy_to(self, fileobj: IO[bytes]) -> None:
+        '''
+        Stream the serialized bytes into a file object
+        '''
+        with self._lock:
+            self._file.seek(0)
+            shutil.copyfileobj(self._file, fileobj, COPY_BUFFER_BYTES)
+
+    def write_to(self, filepath: str) -> None:
+        with open(filepath, 'wb') as output_file:
+            self.copy_to(output_file)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class SerializationCache(object):
+    '''
+    Memoization of serialized objects, keyed on (serialization format, object identity)
+
+    Objects are referenced for the lifetime of the cache so identities cannot
+    be reused. Buffers are released when the `with` block exits
+    '''
+
+    def __init__(self, spool_max_bytes: int = DEFAULT_SPOOL_MAX_BYTES):
+        self.spool_max_bytes = spool_max_bytes
+        self._buffers: Dict[Tuple[str, int], SerializedBuffer] = {}
+        self._references: Dict[int, Any] = {}
+        self._written_files: Dict[str, Tuple[str, int]] = {}
+        self._lock = threading.Lock()
+        # One lock per entry so the same object is never serialized concurrently
+        self._entry_locks: Dict[Any, threading.Lock] = defaultdict(threading.Lock)
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __enter__(self) -> 'SerializationCache':
+        _active_caches().append(self)
+        return self
+
+    def __exit__(self, *args) -> None:
+        _active_caches().remove(self)
+        self.clear()
+
+    def __len__(self) -> int:
+        return len(self._buffers)
+
+    def _entry_lock(self, key: Any) -> threading.Lock:
+        with self._lock:
+            return self._entry_locks[key]
+
+    def serialize(self,
+                  obj: Any,
+                  serialization_format: str,
+                  serializer: Callable[[Any, IO[bytes]], None]) -> SerializedBuffer:
+        '''
+        Return the buffered serialization of the object, serializing on the
+        first request
+
+        :param serializer: function that writes the object to a file object
+            (ex: `pickle.dump`)
+        '''
+        key = (serialization_format, id(obj))
+        with self._entry_lock(key):
+            if key in self._buffers:
+                self.hits += 1
+                return self._buffers[key]
+
+            self.misses += 1
+            buffer = SerializedBuffer(self.spool_max_bytes)
+            serializer(obj, buffer.fileobj)
+            LOGGER.debug(f'Serialized {type(obj)} to {serialization_format} ({buffer.size} bytes)')
+            with self._lock:
+                self._buffers[key] = buffer
+                self._references[id(obj)] = obj
+            return buffer
+
+    def write_once(self,
+                   obj: Any,
+                   serialization_format: str,
+                   filepath: str,
+                   write: Callable[[str], None]) -> None:
+        '''
+        Write the object to the filepath unless the same object was already
+        written there in the same format (ex: disk and cloud save patterns
+        staging the same local file)
+
+        :param write: function that writes the object to the filepath
+        '''
+        key = (serialization_format, id(obj))
+        with self._entry_lock(filepath):
+            if self._written_files.get(filepath) == key:
+                LOGGER.debug(f'{filepath} already written, skipping')
+                return
+            write(filepath)
+            with self._lock:
+                self._written_files[filepath] = key
+                self._references[id(obj)] = obj
+
+    def clear(self) -> None:
+        '''
+        Release all buffers and references
+        '''
+        with self._lock:
+            for buffer in self._buffers.values():
+                buffer.close()
+            self._buffers.clear()
+            self._references.clear()
+            self._written_files.clear()
+            self._entry_locks.clear()
@@ -6,6 +6,7 @@ __author__ = 'Elisha Yadgaran'
 
 
 import unittest
+import tracemalloc
 import numpy as np
 import pandas as pd
 import itertools
@@ -18,6 +19,8 @@ from simpleml.datasets.numpy_mixin import NumpyDatasetMixin
 from simpleml.datasets.pandas_mixin import BasePandasDatasetMixin, \
     SingleLabelPandasDatasetMixin, MultiLabelPandasDatasetMixin, DATAFRAME_SPLIT_COLUMN
 from simpleml.utils.errors import DatasetError
+from simpleml.save_patterns.decorators import register_save_pattern, deregister_save_pattern
+from simpleml.persistables.hashing import CustomHasherMixin, HashableChunks, HASH_VERSION_COLUMNAR
 
 
 class AbstractMixinTests(unittest.TestCase):
@@ -555,6 +558,187 @@ class MultiLabelPandasDatasetTests(MultiLabelPandasMixinTests):
         return dataset
 
 
+class PandasPartialLoadTests(unittest.TestCase):
+    '''
+    Tests for column and split pushdown into columnar save patterns
+    '''
+    def setUp(self):
+        data = pd.DataFrame(
+            [
+                {'a': 1, 'b': 2, 'label': 3, DATAFRAME_SPLIT_COLUMN: 'TRAIN'},
+                {'a': 11, 'b': 22, 'label': 33, DATAFRAME_SPLIT_COLUMN: 'VALIDATION'},
+                {'a': 111, 'b': 222, 'label': 333, DATAFRAME_SPLIT_COLUMN: 'TEST'},
+            ],
+            index=[10, 20, 30]
+        )
+        calls = self.calls = []
+
+        class FakeColumnarSavePattern(object):
+            @classmethod
+            def load(cls, filepath_data, columns=None, filters=None):
+                calls.append((columns, filters))
+                df = data
+                for column, _, value in filters or []:
+                    df = df[df[column] == value]
+                return df[columns or df.columns].copy()
+
+            @classmethod
+            def column_names(cls, filepath_data):
+                return data.columns.tolist()
+
+        register_save_pattern(FakeColumnarSavePattern, 'fake_columnar', overwrite=True)
+        self.addCleanup(deregister_save_pattern, save_pattern='fake_columnar')
+        self.data = data
+
+    def dataset(self):
+        dataset = PandasDataset(label_columns=['label'], save_patterns={'dataset': ['fake_columnar']})
+        dataset.filepaths = {'dataset': {'fake_columnar': 'dataset.parquet'}}
+        dataset.unloaded_artifacts = ['dataset']
+        return dataset
+
+    def test_columns_and_split_pushed_down(self):
+        dataset = self.dataset()
+        assert_frame_equal(dataset.get(column='X', split='TRAIN'), self.data.loc[[10], ['a', 'b']])
+        self.assertEqual(self.calls, [(['a', 'b'], [(DATAFRAME_SPLIT_COLUMN, '=', 'TRAIN')])])
+
+        assert_frame_equal(dataset.get(column='y', split=None), self.data[['label']])
+        self.assertEqual(self.calls[-1], (['label'], None))
+        self.assertEqual(dataset.get_split_names(), ['TRAIN', 'VALIDATION', 'TEST'])
+        self.assertEqual(self.calls[-1], ([DATAFRAME_SPLIT_COLUMN], None))
+        # Never fully restored
+        self.assertEqual(dataset.unloaded_artifacts, ['dataset'])
+
+    def test_matches_full_load(self):
+        dataset = self.dataset()
+        loaded = PandasDataset(label_columns=['label'])
+        loaded.dataframe = self.data
+        for column, split in itertools.product(['X', 'y', None], ['TRAIN', 'TEST', None]):
+            with self.subTest(column=column, split=split):
+                assert_frame_equal(dataset.get(column=column, split=split), loaded.get(column=column, split=split))
+
+    def test_loaded_dataframe_not_pushed_down(self):
+        dataset = self.dataset()
+        dataset.load_external_files()
+        self.assertEqual(self.calls, [(None, None)])
+        dataset.get(column='X', split='TRAIN')
+        self.assertEqual(len(self.calls), 1)
+
+
+class PandasSplitIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'a': np.arange(8),
+            'label': np.arange(8.),
+            DATAFRAME_SPLIT_COLUMN: ['TRAIN', 'TEST', 'TRAIN', None, 'VALIDATION', 'TEST', 'TRAIN', 'TRAIN'],
+        }, index=list('hgfedcba'))
+        self.dataset = PandasDataset(label_columns=['label'])
+        self.dataset.dataframe = self.df
+
+    def test_index_built_on_set(self):
+        split_index = self.dataset._split_index[1]
+        self.assertEqual(list(split_index), ['TRAIN', 'TEST', 'VALIDATION'])
+        np.testing.assert_array_equal(split_index['TRAIN'], [0, 2, 6, 7])
+        np.testing.assert_array_equal(split_index['TEST'], [1, 5])
+        self.assertEqual(split_index['TRAIN'].dtype, np.int32)
+
+    def test_get_matches_filter(self):
+        for split in ('TRAIN', 'TEST', 'VALIDATION', 'NONSENSE'):
+            with self.subTest(split=split):
+                rows = self.df[self.df[DATAFRAME_SPLIT_COLUMN] == split]
+                assert_frame_equal(self.dataset.get(column='X', split=split), rows[['a']])
+                assert_frame_equal(self.dataset.get(column=None, split=split), rows[['a', 'label']])
+
+    def test_index_reused(self):
+        split_index = self.dataset._get_split_index(self.dataset._external_file)
+        self.dataset.get(column='X', split='TRAIN')
+        self.assertIs(self.dataset._get_split_index(self.dataset._external_file), split_index)
+
+    def test_index_invalidated_with_new_dataframe(self):
+        self.dataset.get(column='X', split='TRAIN')
+        df = self.df.assign(**{DATAFRAME_SPLIT_COLUMN: 'TEST'})
+        # Restores bypass the setter
+        self.dataset._external_file = df
+        assert_frame_equal(self.dataset.get(column='X', split='TEST'), df[['a']])
+        self.assertEqual(len(self.dataset.get(column='X', split='TRAIN')), 0)
+
+    def test_stored_dataframe_not_mutated(self):
+        X = self.dataset.get(column='X', split='TRAIN')
+        X['a'] = -1
+        assert_frame_equal(self.dataset._external_file, self.df)
+
+
+class PandasSplitViewTests(unittest.TestCase):
+    def setUp(self):
+        # Concatenated splits are contiguous row ranges
+        self.df = pd.DataFrame({
+            'a': np.arange(10.),
+            'b': np.arange(10.) * 2,
+            'label': np.arange(10),
+            DATAFRAME_SPLIT_COLUMN: ['TRAIN'] * 6 + ['TEST'] * 4,
+        })
+        self.dataset = SingleLabelPandasDataset(label_columns=['label'])
+        self.dataset.dataframe = self.df
+
+    def test_views_disabled_by_default(self):
+        self.assertFalse(self.dataset.state['split_views'])
+        split = self.dataset.get_split('TRAIN')
+        self.assertFalse(np.shares_memory(split.X['a'].values, self.dataset._external_file['a'].values))
+
+    def test_view_matches_copy(self):
+        for split in ('TRAIN', 'TEST'):
+            with self.subTest(split=split):
+                view = self.dataset.get_split(split, copy=False)
+                copy = self.dataset.get_split(split)
+                assert_frame_equal(view.X, copy.X)
+                assert_series_equal(view.y, copy.y)
+        assert_frame_equal(self.dataset.get('X', 'NONSENSE', copy=False), self.dataset.get('X', 'NONSENSE'))
+
+    def test_view_shares_memory(self):
+        dataset = SingleLabelPandasDataset(label_columns=['label'], split_views=True)
+        dataset.dataframe = self.df
+        split = dataset.get_split('TEST')
+        stored = dataset._external_file
+        self.assertTrue(np.shares_memory(split.X['a'].values, stored['a'].values))
+        self.assertTrue(np.shares_memory(split.y.values, stored['label'].values))
+
+    def test_view_is_read_only(self):
+        X = self.dataset.get_split('TRAIN', copy=False).X
+        with self.assertRaises(ValueError):
+            X.iloc[0, 0] = -1.
+        # Replacing columns leaves the stored frame untouched
+        X['a'] = -1.
+        assert_frame_equal(self.dataset._external_file, self.df)
+
+    def test_scattered_split_falls_back_to_copy(self):
+        df = self.df.assign(**{DATAFRAME_SPLIT_COLUMN: ['TRAIN', 'TEST'] * 5})
+        self.dataset.dataframe = df
+        view = self.dataset.get_split('TEST', copy=False)
+        assert_frame_equal(view.X, self.dataset.get_split('TEST').X)
+        self.assertFalse(np.shares_memory(view.X['a'].values, self.dataset._external_file['a'].values))
+
+    def test_view_peak_memory(self):
+        rows = 500000
+        df = pd.DataFrame({
+            'a': np.random.rand(rows),
+            'b': np.random.rand(rows),
+            'label': np.random.rand(rows),
+            DATAFRAME_SPLIT_COLUMN: np.repeat(np.array(['TRAIN', 'TEST'], dtype=object), rows // 2),
+        })
+        dataset = SingleLabelPandasDataset(label_columns=['label'])
+        dataset.dataframe = df
+        section_bytes = df.drop(DATAFRAME_SPLIT_COLUMN, axis=1).memory_usage(index=False).sum()
+
+        tracemalloc.start()
+        try:
+            split = dataset.get_split('TRAIN', copy=False)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(split.X), rows // 2)
+        # Copies would allocate half the numeric data
+        self.assertLess(peak, section_bytes / 20)
+
+
 class NumpyMixinTests(unittest.TestCase):
     '''
     Some tests for the numpy mixin class
@@ -658,6 +842,70 @@ class DatasetTests(unittest.TestCase):
         Compare hash to hard-coded precomputed hash
         '''
 
+    def test_chunked_hash_without_materializing(self):
+        '''
+        Datasets that generate row chunks are hashed without building the
+        dataframe and match the hash of the materialized data
+        '''
+        df = pd.DataFrame(np.random.randint(0, 100, size=(100, 4)), columns=list('ABCD'))
+
+        class ChunkedDataset(Dataset):
+            __abstract__ = True
+
+            def build_dataframe(self):
+                raise AssertionError('Should not materialize the dataframe')
+
+            def build_dataframe_chunks(self):
+                for i in range(0, len(df), 30):
+                    yield df.iloc[i:i + 30]
+
+        streamed = ChunkedDataset(hash_version=HASH_VERSION_COLUMNAR)
+        materialized = Dataset(hash_version=HASH_VERSION_COLUMNAR)
+        materialized._external_file = df
+        self.assertEqual(streamed._hash(), materialized._hash())
+
+    def test_numpy_dataset_columnar_hash(self):
+        '''
+        Datasets without chunked generation hash the materialized data as is
+        '''
+        data = {'X': np.random.rand(20, 3), 'y': np.arange(20)}
+        dataset = NumpyDataset(hash_version=HASH_VERSION_COLUMNAR)
+        dataset._external_file = data
+        expected = CustomHasherMixin.custom_hasher((data, dataset.config, None), HASH_VERSION_COLUMNAR)
+        self.assertEqual(dataset._hash(), expected)
+
+        dataset._external_file = {'X': data['X'] + 1, 'y': data['y']}
+        self.assertNotEqual(dataset._hash(), expected)
+
+    def test_chunked_hash_matches_unchunked(self):
+        # Large enough for the row hash sum to wrap around
+        df = pd.DataFrame({'a': range(500), 'b': ['x', 'y'] * 250})
+        for hash_version in (1, HASH_VERSION_COLUMNAR):
+            with self.subTest(hash_version=hash_version):
+                chunked = CustomHasherMixin.custom_hasher(
+                    HashableChunks(df.iloc[i:i + 70] for i in range(0, 500, 70)), hash_version)
+                unchunked = CustomHasherMixin.custom_hasher(df, hash_version)
+                self.assertEqual(chunked, unchunked)
+                self.assertEqual(type(chunked), type(unchunked))
+
+    def test_chunked_array_hash_independent_of_boundaries(self):
+        array = np.random.rand(100, 3)
+        hash1 = CustomHasherMixin.custom_hasher(HashableChunks([array]))
+        hash2 = CustomHasherMixin.custom_hasher(HashableChunks([array[:13], array[13:70], array[70:]]))
+        self.assertEqual(hash1, hash2)
+
+        # dtype and shape are part of the digest
+        self.assertNotEqual(hash1, CustomHasherMixin.custom_hasher(HashableChunks([array.reshape(50, 6)])))
+        self.assertNotEqual(hash1, CustomHasherMixin.custom_hasher(HashableChunks([array.astype(np.float32)])))
+
+    def test_chunked_hash_invalid_chunks(self):
+        with self.assertRaises(TypeError):
+            CustomHasherMixin.custom_hasher(HashableChunks([np.ones(3), pd.Series([1.0])]))
+        with self.assertRaises(TypeError):
+            CustomHasherMixin.custom_hasher(HashableChunks([np.ones((3, 2)), np.ones((3, 3))]))
+        with self.assertRaises(TypeError):
+            CustomHasherMixin.custom_hasher(HashableChunks([[1, 2, 3]]))
+
 
 class ImplementationTests(unittest.TestCase):
     '''
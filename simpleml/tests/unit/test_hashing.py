@@ -6,10 +6,16 @@ __author__ = 'Elisha Yadgaran'
 
 
 import unittest
+import numpy as np
 import pandas as pd
 
-from simpleml.persistables.hashing import CustomHasherMixin
+from unittest.mock import patch
+
+from simpleml.persistables.hashing import CustomHasherMixin, HASH_VERSION_LEGACY, HASH_VERSION_COLUMNAR,\
+    get_hash_backend, backend_hash
+from simpleml.imports import xxhash, MissingImportWrapper
 from simpleml._external.joblib import hash as deterministic_hash
+from simpleml.utils.errors import SimpleMLError
 
 
 class _Test123(object):
@@ -626,6 +632,201 @@ class CustomHasherTests(unittest.TestCase):
                  f"DEBUG:simpleml.persistables.hashing:Hashing output: {expected_final_hash}"])
 
 
+class ColumnarHashingTests(unittest.TestCase):
+    '''
+    Tests for the opt-in columnar pandas hashing (hash version 2)
+    '''
+
+    def test_numeric_frame_matches_legacy(self):
+        data = pd.DataFrame({'a': [1, 2, 3], 'b': [0.1, 0.2, 0.3], 'c': ['x', 'y', 'z']})
+        self.assertEqual(
+            CustomHasherMixin.custom_hasher(data, HASH_VERSION_COLUMNAR),
+            CustomHasherMixin.custom_hasher(data, HASH_VERSION_LEGACY)
+        )
+
+    def test_array_columns_match_legacy(self):
+        data = pd.DataFrame({
+            'a': [1, 2, 3],
+            'b': [np.array([1, 2]), np.array([3, 4]), 'not an array'],
+            'c': ['x', 'y', 'z']
+        })
+        self.assertEqual(
+            CustomHasherMixin.custom_hasher(data, HASH_VERSION_COLUMNAR),
+            CustomHasherMixin.custom_hasher(data, HASH_VERSION_LEGACY)
+        )
+        self.assertEqual(
+            CustomHasherMixin.custom_hasher(data['b'], HASH_VERSION_COLUMNAR),
+            CustomHasherMixin.custom_hasher(data['b'], HASH_VERSION_LEGACY)
+        )
+
+    def test_array_contents_change_hash(self):
+        data = pd.DataFrame({'a': [np.array([1, 2]), np.array([3, 4])]})
+        other = pd.DataFrame({'a': [np.array([1, 2]), np.array([3, 5])]})
+        self.assertNotEqual(
+            CustomHasherMixin.custom_hasher(data, HASH_VERSION_COLUMNAR),
+            CustomHasherMixin.custom_hasher(other, HASH_VERSION_COLUMNAR)
+        )
+
+    def test_no_element_wise_hashing_without_arrays(self):
+        data = pd.DataFrame({'a': range(100), 'b': ['x'] * 100, 'c': pd.Categorical(['y'] * 100)})
+        with self.assertLogs(logger='simpleml.persistables.hashing', level='DEBUG') as logs:
+            CustomHasherMixin.custom_hasher(data, HASH_VERSION_COLUMNAR)
+        # Single input/type/output trace for the frame
+        self.assertEqual(len(logs.output), 3)
+
+    def test_only_array_columns_prehashed(self):
+        data = pd.DataFrame({'a': ['x', 'y'], 'b': [np.array([1]), np.array([2])]})
+        with self.assertLogs(logger='simpleml.persistables.hashing', level='DEBUG') as logs:
+            CustomHasherMixin.custom_hasher(data, HASH_VERSION_COLUMNAR)
+        array_inputs = [i for i in logs.output if "hash type: <class 'numpy.ndarray'>" in i]
+        string_inputs = [i for i in logs.output if "hash type: <class 'str'>" in i]
+        self.assertEqual(len(array_inputs), 2)
+        # only the string representation of the arrays, column `a` is hashed natively
+        self.assertEqual(len(string_inputs), 0)
+
+    def test_duplicate_column_names(self):
+        data = pd.DataFrame([[np.array([1]), 2], [np.array([3]), 4]], columns=['a', 'a'])
+        self.assertEqual(
+            CustomHasherMixin.custom_hasher(data, HASH_VERSION_COLUMNAR),
+            CustomHasherMixin.custom_hasher(data, HASH_VERSION_LEGACY)
+        )
+
+
+class ParallelHashingTests(unittest.TestCase):
+    '''
+    Tests for multi-threaded pandas hashing
+    '''
+
+    def setUp(self):
+        self.data = pd.DataFrame({
+            'a': np.arange(1000),
+            'b': np.random.rand(1000),
+            'c': ['x', 'y'] * 500,
+            'd': [np.array([i]) for i in range(1000)],
+        })
+
+    @patch('simpleml.persistables.hashing.PARALLEL_HASH_MIN_ROWS', 10)
+    def test_parallel_matches_serial(self):
+        for hash_version in (HASH_VERSION_LEGACY, HASH_VERSION_COLUMNAR):
+            for workers in (2, 3, 7):
+                with self.subTest(hash_version=hash_version, workers=workers):
+                    serial = CustomHasherMixin.custom_hasher(self.data, hash_version, workers=1)
+                    parallel = CustomHasherMixin.custom_hasher(self.data, hash_version, workers=workers)
+                    self.assertEqual(serial, parallel)
+                    self.assertEqual(type(serial), type(parallel))
+
+                    serial = CustomHasherMixin.custom_hasher(self.data['b'], hash_version, workers=1)
+                    parallel = CustomHasherMixin.custom_hasher(self.data['b'], hash_version, workers=workers)
+                    self.assertEqual(serial, parallel)
+
+    @patch('simpleml.persistables.hashing.PARALLEL_HASH_MIN_ROWS', 10)
+    def test_workers_passed_through_containers(self):
+        with patch.object(CustomHasherMixin, '_parallel_pandas_hash', return_value=0) as mock_parallel:
+            CustomHasherMixin.custom_hasher((self.data, {'key': self.data}), HASH_VERSION_COLUMNAR, workers=2)
+        self.assertEqual(mock_parallel.call_count, 2)
+
+    def test_small_objects_hashed_serially(self):
+        with patch.object(CustomHasherMixin, '_parallel_pandas_hash') as mock_parallel:
+            CustomHasherMixin.custom_hasher(self.data, HASH_VERSION_COLUMNAR, workers=4)
+        mock_parallel.assert_not_called()
+
+    @patch('simpleml.persistables.hashing.DEFAULT_HASH_WORKERS', 2)
+    @patch('simpleml.persistables.hashing.PARALLEL_HASH_MIN_ROWS', 10)
+    def test_configured_default_workers(self):
+        with patch.object(CustomHasherMixin, '_parallel_pandas_hash', return_value=0) as mock_parallel:
+            CustomHasherMixin.custom_hasher(self.data)
+        self.assertEqual(mock_parallel.call_args[0][2], 2)
+
+
+class HashBackendTests(unittest.TestCase):
+    '''
+    Tests for configurable digest algorithms
+    '''
+
+    def test_md5_backend_unchanged(self):
+        data = {'a': [1, 2, 'abc'], 'b': 0.045}
+        self.assertEqual(
+            CustomHasherMixin.custom_hasher(data),
+            CustomHasherMixin.custom_hasher(data, hash_backend='md5')
+        )
+        self.assertEqual(backend_hash('abc', 'md5'), deterministic_hash('abc'))
+
+    def test_blake2b_backend(self):
+        data = {'a': [1, 2, 'abc'], 'b': 0.045, 'c': pd.Series([1, 2])}
+        output = CustomHasherMixin.custom_hasher(data, hash_backend='blake2b')
+        self.assertEqual(output, CustomHasherMixin.custom_hasher(data, hash_backend='blake2b'))
+        self.assertNotEqual(output, CustomHasherMixin.custom_hasher(data, hash_backend='md5'))
+        self.assertEqual(len(output), 128)
+
+    def test_arrays_hashed_from_buffer(self):
+        array = np.arange(12, dtype=np.float64).reshape(3, 4)
+        with patch.object(CustomHasherMixin, '_array_hash', wraps=CustomHasherMixin._array_hash) as mock_array_hash:
+            output = CustomHasherMixin.custom_hasher(array, hash_backend='blake2b')
+        mock_array_hash.assert_called_once()
+
+        # Same contents with a different memory layout
+        self.assertEqual(output, CustomHasherMixin.custom_hasher(np.asfortranarray(array), hash_backend='blake2b'))
+        # dtype and shape are part of the digest
+        self.assertNotEqual(output, CustomHasherMixin.custom_hasher(array.reshape(4, 3), hash_backend='blake2b'))
+        self.assertNotEqual(output, CustomHasherMixin.custom_hasher(array.astype(np.float32), hash_backend='blake2b'))
+
+    def test_unsupported_backend(self):
+        with self.assertRaises(ValueError):
+            get_hash_backend('not_a_real_algorithm')
+
+    def test_variable_length_backend(self):
+        for hash_backend in ('shake_128', 'shake_256'):
+            with self.subTest(hash_backend=hash_backend):
+                with self.assertRaises(SimpleMLError):
+                    get_hash_backend(hash_backend)
+
+    @unittest.skipIf(not (isinstance(xxhash, type) and issubclass(xxhash, MissingImportWrapper)), 'xxhash installed')
+    def test_missing_xxhash(self):
+        with self.assertRaises(ImportError):
+            CustomHasherMixin.custom_hasher('abc', hash_backend='xxhash')
+
+    @unittest.skipIf(isinstance(xxhash, type) and issubclass(xxhash, MissingImportWrapper), 'xxhash not installed')
+    def test_xxhash_backend(self):
+        self.assertEqual(
+            CustomHasherMixin.custom_hasher('abc', hash_backend='xxhash'),
+            CustomHasherMixin.custom_hasher('abc', hash_backend='xxhash')
+        )
+
+
+class ArrayHashingTests(unittest.TestCase):
+    '''
+    Tests for hashing numpy arrays from their buffers
+    '''
+
+    def test_matches_bytes_hash(self):
+        '''
+        Buffer hashing is identical to hashing a bytes copy of the array
+        '''
+        arrays = [
+            np.arange(10),
+            np.array([]),
+            np.array(5),
+            np.arange(1000.).reshape(10, 100),
+            np.asfortranarray(np.arange(12.).reshape(3, 4)),
+            np.arange(100)[::3],
+            np.array(['a', 'bc']),
+            np.array(['2020-01-01'], dtype='datetime64[ns]'),
+        ]
+        for array in arrays:
+            with self.subTest(array=array):
+                self.assertEqual(
+                    CustomHasherMixin.custom_hasher(array),
+                    CustomHasherMixin.custom_hasher(array.tobytes())
+                )
+
+    def test_object_arrays(self):
+        array = np.array([1, 'a', None], dtype=object)
+        self.assertEqual(
+            CustomHasherMixin.custom_hasher(array),
+            CustomHasherMixin.custom_hasher(array.tobytes())
+        )
+
+
 class DeterministicHasherTests(unittest.TestCase):
     def test_tuple_hash(self):
         '''
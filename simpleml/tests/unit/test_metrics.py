@@ -0,0 +1,290 @@
+'''
+Metric related tests
+'''
+
+__author__ = 'Elisha Yadgaran'
+
+
+import unittest
+import numpy as np
+import pandas as pd
+
+from unittest.mock import patch, MagicMock
+from pandas.testing import assert_frame_equal
+from sklearn.metrics import confusion_matrix
+
+from simpleml.datasets.base_dataset import Dataset
+from simpleml.models import SklearnLogisticRegression
+from simpleml.metrics.classification import ClassificationMetric, BinaryClassificationMetric,\
+    ThresholdTprMetric, ThresholdFprMetric, RocAucMetric
+from simpleml.metrics.scoring_cache import ScoringCache, get_active_scoring_cache
+from simpleml.metrics.base_metric import AbstractMetric, Metric
+from simpleml.metrics.metric_suite import MetricSuite, score_all
+from simpleml.utils.errors import MetricError
+
+
+class BinaryClassificationConfusionMatrixTests(unittest.TestCase):
+    '''
+    Tests for the vectorized threshold sweep
+    '''
+
+    @staticmethod
+    def reference_confusion_matrix(thresholds, probabilities, labels):
+        '''
+        Naive implementation - one sklearn confusion matrix per threshold
+        '''
+        results = []
+        for threshold in thresholds:
+            predictions = np.where(probabilities >= threshold, 1, 0)
+            tn, fp, fn, tp = confusion_matrix(labels, predictions, labels=[0, 1]).ravel()
+            results.append((threshold, tn, fp, fn, tp))
+
+        return pd.DataFrame(results, columns=['threshold', 'tn', 'fp', 'fn', 'tp']).astype(
+            {'tn': np.int64, 'fp': np.int64, 'fn': np.int64, 'tp': np.int64})
+
+    def assert_matches_reference(self, thresholds, probabilities, labels):
+        expected = self.reference_confusion_matrix(thresholds, probabilities, labels)
+        output = BinaryClassificationMetric._create_confusion_matrix(thresholds, probabilities, labels)
+        assert_frame_equal(expected, output)
+
+    def test_random_inputs(self):
+        random_state = np.random.RandomState(10)
+        thresholds = np.linspace(0, 1, 201)
+        for size in (1, 10, 1000):
+            with self.subTest(size=size):
+                probabilities = random_state.rand(size)
+                labels = random_state.randint(0, 2, size)
+                self.assert_matches_reference(thresholds, probabilities, labels)
+
+    def test_ties_on_thresholds(self):
+        '''
+        Probabilities exactly equal to a threshold are predicted positive
+        '''
+        thresholds = np.linspace(0, 1, 11)
+        probabilities = np.array([0.0, 0.1, 0.1, 0.5, 0.5, 0.5, 1.0, 1.0])
+        labels = np.array([0, 1, 0, 1, 0, 1, 1, 0])
+        self.assert_matches_reference(thresholds, probabilities, labels)
+
+    def test_single_class_labels(self):
+        thresholds = np.linspace(0, 1, 21)
+        probabilities = np.linspace(0, 1, 50)
+        for label in (0, 1):
+            with self.subTest(label=label):
+                self.assert_matches_reference(thresholds, probabilities, np.full(50, label))
+
+    def test_pandas_inputs(self):
+        thresholds = np.linspace(0, 1, 21)
+        probabilities = pd.Series(np.linspace(0, 1, 30), index=range(100, 130))
+        labels = pd.Series([0, 1] * 15, index=range(200, 230))
+        output = BinaryClassificationMetric._create_confusion_matrix(thresholds, probabilities, labels)
+        assert_frame_equal(
+            self.reference_confusion_matrix(thresholds, probabilities.values, labels.values),
+            output
+        )
+
+    def test_null_probabilities(self):
+        '''
+        Null probabilities always fail the threshold comparison
+        '''
+        thresholds = np.linspace(0, 1, 11)
+        probabilities = np.array([np.nan, 0.2, np.nan, 0.7])
+        labels = np.array([1, 0, 0, 1])
+        self.assert_matches_reference(thresholds, probabilities, labels)
+
+
+class ScoringCacheTests(unittest.TestCase):
+    '''
+    Tests for the LRU scoring cache
+    '''
+
+    def test_memoization(self):
+        cache = ScoringCache()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return np.ones(10)
+
+        key = ('model', 'dataset', 'TEST')
+        first = cache.get(key, 'probabilities', compute)
+        second = cache.get(key, 'probabilities', compute)
+        self.assertIs(first, second)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # Different split is a different entry
+        cache.get(('model', 'dataset', 'TRAIN'), 'probabilities', compute)
+        self.assertEqual(len(calls), 2)
+
+    def test_memory_cap_evicts_least_recently_used(self):
+        array = np.ones(100)  # 800 bytes
+        cache = ScoringCache(max_bytes=array.nbytes * 2)
+        cache.set(('a',), 'x', array)
+        cache.set(('b',), 'x', array.copy())
+        # touch `a` so `b` is the least recently used
+        cache.get(('a',), 'x', lambda: None)
+        cache.set(('c',), 'x', array.copy())
+
+        self.assertIn(('a', 'x'), cache)
+        self.assertNotIn(('b', 'x'), cache)
+        self.assertIn(('c', 'x'), cache)
+        self.assertLessEqual(cache.size, cache.max_bytes)
+
+    def test_oversized_values_are_not_stored(self):
+        cache = ScoringCache(max_bytes=10)
+        value = cache.get(('a',), 'x', lambda: np.ones(100))
+        self.assertEqual(value.shape, (100,))
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidation(self):
+        cache = ScoringCache()
+        model, dataset = Dataset(), Dataset()
+        model.hash_ = 'model_hash'
+        key = cache.build_key(model, dataset, 'TEST')
+        self.assertEqual(key, ('model_hash', str(dataset.id), 'TEST'))
+
+        cache.set(key, 'labels', [1])
+        cache.set(cache.build_key(model, dataset, 'TRAIN'), 'labels', [1])
+        cache.set(('other', 'other', 'TEST'), 'labels', [1])
+
+        cache.invalidate(model=model, dataset_split='TEST')
+        self.assertNotIn(key + ('labels',), cache)
+        self.assertEqual(len(cache), 2)
+
+        cache.invalidate(dataset=dataset)
+        self.assertEqual(len(cache), 1)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_context_manager_activation(self):
+        self.assertIsNone(get_active_scoring_cache())
+        with ScoringCache() as outer:
+            self.assertIs(get_active_scoring_cache(), outer)
+            with ScoringCache() as inner:
+                self.assertIs(get_active_scoring_cache(), inner)
+            self.assertIs(get_active_scoring_cache(), outer)
+        self.assertIsNone(get_active_scoring_cache())
+
+
+class MetricScoringCacheTests(unittest.TestCase):
+    '''
+    Tests that sibling metrics share scoring intermediates
+    '''
+
+    def setUp(self):
+        random_state = np.random.RandomState(10)
+        self.labels = pd.Series(random_state.randint(0, 2, 100))
+        self.probabilities = random_state.rand(100, 2)
+        self.model = SklearnLogisticRegression()
+        self.dataset = Dataset()
+
+    def build_metric(self, cls):
+        metric = cls(dataset_split='TEST')
+        metric.add_model(self.model)
+        metric.add_dataset(self.dataset)
+        return metric
+
+    def score_metrics(self, metric_classes):
+        with patch.object(ClassificationMetric, '_get_split', return_value=self.labels) as mock_split,\
+                patch.object(ClassificationMetric, '_predict_proba', return_value=self.probabilities) as mock_proba:
+            metrics = [self.build_metric(cls) for cls in metric_classes]
+            for metric in metrics:
+                metric.score()
+        return metrics, mock_split, mock_proba
+
+    def test_uncached_scoring(self):
+        metrics, mock_split, mock_proba = self.score_metrics([ThresholdTprMetric, ThresholdFprMetric, RocAucMetric])
+        self.assertEqual(mock_proba.call_count, 3)
+
+    def test_cached_scoring(self):
+        with ScoringCache() as cache:
+            cached_metrics, mock_split, mock_proba = self.score_metrics([ThresholdTprMetric, ThresholdFprMetric, RocAucMetric])
+        self.assertEqual(mock_proba.call_count, 1)
+        self.assertEqual(mock_split.call_count, 1)
+        self.assertGreater(cache.hits, 0)
+
+        uncached_metrics, _, _ = self.score_metrics([ThresholdTprMetric, ThresholdFprMetric, RocAucMetric])
+        for cached, uncached in zip(cached_metrics, uncached_metrics):
+            self.assertEqual(cached.values, uncached.values)
+
+    def test_explicit_cache(self):
+        cache = ScoringCache()
+        with patch.object(ClassificationMetric, '_get_split', return_value=self.labels),\
+                patch.object(ClassificationMetric, '_predict_proba', return_value=self.probabilities) as mock_proba:
+            for cls in (ThresholdTprMetric, RocAucMetric):
+                metric = self.build_metric(cls)
+                metric.add_scoring_cache(cache)
+                metric.score()
+        self.assertEqual(mock_proba.call_count, 1)
+
+
+class MetricSuiteTests(unittest.TestCase):
+    '''
+    Tests for batch metric evaluation
+    '''
+
+    def setUp(self):
+        random_state = np.random.RandomState(10)
+        self.labels = pd.Series(random_state.randint(0, 2, 100))
+        self.probabilities = random_state.rand(100, 2)
+        self.model = SklearnLogisticRegression()
+        self.dataset = Dataset()
+
+    def test_registered_names_resolved(self):
+        suite = MetricSuite(['RocAucMetric', ThresholdTprMetric])
+        self.assertEqual(suite.metric_classes, [RocAucMetric, ThresholdTprMetric])
+
+    def test_unregistered_name_raises(self):
+        with self.assertRaises(MetricError):
+            MetricSuite(['NotARealMetric'])
+
+    def test_score_shares_intermediates_per_split(self):
+        suite = MetricSuite([ThresholdTprMetric, ThresholdFprMetric, RocAucMetric],
+                            dataset_splits=['TRAIN', 'TEST'])
+        with patch.object(ClassificationMetric, '_get_split', return_value=self.labels),\
+                patch.object(ClassificationMetric, '_predict_proba', return_value=self.probabilities) as mock_proba:
+            metrics = suite.score(self.model, self.dataset)
+
+        # One inference per split
+        self.assertEqual(mock_proba.call_count, 2)
+        self.assertEqual(len(metrics), 6)
+        self.assertEqual([i.config['dataset_split'] for i in metrics], ['TRAIN'] * 3 + ['TEST'] * 3)
+        self.assertTrue(all(i.values is not None for i in metrics))
+        self.assertTrue(all(i.scoring_cache is None for i in metrics))
+
+    def test_save_in_single_transaction(self):
+        session = MagicMock()
+        session.autocommit = True
+        with patch.object(Metric, '_session', session),\
+                patch.object(AbstractMetric, 'save') as mock_save,\
+                patch.object(SklearnLogisticRegression, 'load') as mock_load,\
+                patch.object(ClassificationMetric, '_get_split', return_value=self.labels),\
+                patch.object(ClassificationMetric, '_predict_proba', return_value=self.probabilities):
+            metrics = score_all(self.model, self.dataset, [RocAucMetric, ThresholdTprMetric],
+                                dataset_splits=['TRAIN', 'TEST'])
+
+        self.assertEqual(len(metrics), 4)
+        session.begin.assert_called_once()
+        self.assertEqual(mock_save.call_count, 4)
+        mock_save.assert_called_with(reload_model=False)
+        # Model relationship is reloaded once for the batch
+        mock_load.assert_called_once_with(load_externals=False)
+
+    def test_failed_save_rolls_back(self):
+        session = MagicMock()
+        session.autocommit = False
+        with patch.object(Metric, '_session', session),\
+                patch.object(AbstractMetric, 'save', side_effect=ValueError),\
+                patch.object(ClassificationMetric, '_get_split', return_value=self.labels),\
+                patch.object(ClassificationMetric, '_predict_proba', return_value=self.probabilities):
+            with self.assertRaises(ValueError):
+                score_all(self.model, self.dataset, [RocAucMetric])
+
+        session.rollback.assert_called_once()
+        session.commit.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -5,8 +5,23 @@ Persistable related tests
 __author__ = 'Elisha Yadgaran'
 
 from simpleml.persistables.base_persistable import Persistable
+from simpleml.persistables.persistable_cache import PersistableCache, estimate_persistable_size
+from simpleml.save_patterns.decorators import register_save_pattern, deregister_save_pattern
+from simpleml.save_patterns.serialization import get_active_serialization_cache
+from simpleml.persistables.hashing import HASH_VERSION_LEGACY, HASH_VERSION_COLUMNAR
+from simpleml.datasets.base_dataset import Dataset
+from simpleml.pipelines.base_pipeline import Pipeline
+from simpleml.models.base_model import Model
+from simpleml.transformers.base_transformer import Transformer
+from simpleml.utils.errors import SimpleMLError
+from simpleml.utils.scoring.load_persistable import PersistableLoader
+import numpy as np
+import pandas as pd
+import threading
 import unittest
 
+from unittest.mock import patch, MagicMock
+
 
 class PersistableTests(unittest.TestCase):
     def test_same_class_loads(self):
@@ -53,6 +68,438 @@ class PersistableTests(unittest.TestCase):
     def test_class_loading(self):
         pass
 
+    def test_hash_version_recorded(self):
+        self.assertEqual(Dataset().hash_version, HASH_VERSION_LEGACY)
+        dataset = Dataset(hash_version=HASH_VERSION_COLUMNAR)
+        self.assertEqual(dataset.hash_version, HASH_VERSION_COLUMNAR)
+        self.assertEqual(dataset.state['hash_version'], HASH_VERSION_COLUMNAR)
+
+    def test_missing_hash_version_is_legacy(self):
+        # Persistables saved before hash versioning
+        dataset = Dataset()
+        dataset.state.pop('hash_version')
+        self.assertEqual(dataset.hash_version, HASH_VERSION_LEGACY)
+
+    def test_unsupported_hash_version(self):
+        with self.assertRaises(SimpleMLError):
+            Dataset(hash_version=-1)
+
+    def test_hash_backend_recorded(self):
+        self.assertEqual(Dataset().hash_backend, 'md5')
+        dataset = Dataset(hash_backend='blake2b')
+        self.assertEqual(dataset.state['hash_backend'], 'blake2b')
+        dataset._external_file = pd.DataFrame({'a': [1, 2]})
+        self.assertEqual(len(dataset._hash()), 128)
+
+        # Persistables saved before configurable backends
+        dataset.state.pop('hash_backend')
+        self.assertEqual(dataset.hash_backend, 'md5')
+
+    def test_unsupported_hash_backend(self):
+        with self.assertRaises(SimpleMLError):
+            Dataset(hash_backend='not_a_real_algorithm')
+
+    def test_hash_version_used_for_hash(self):
+        dataset = Dataset(hash_version=HASH_VERSION_COLUMNAR)
+        dataset._external_file = pd.DataFrame({'a': [1, 2]})
+        with patch.object(Dataset, 'custom_hasher') as mock_hasher:
+            dataset._hash()
+        self.assertEqual(mock_hasher.call_args[0][1], HASH_VERSION_COLUMNAR)
+
+
+class HashMemoizationTests(unittest.TestCase):
+    '''
+    Tests for per object hash memoization
+    '''
+
+    def setUp(self):
+        self.dataset = Dataset()
+        self.dataset._external_file = pd.DataFrame({'a': [1, 2, 3]})
+
+    def test_hash_computed_once(self):
+        with patch.object(Dataset, '_hash', wraps=self.dataset._hash) as mock_hash:
+            first = self.dataset._cached_hash()
+            second = self.dataset._cached_hash()
+        self.assertEqual(first, second)
+        self.assertEqual(mock_hash.call_count, 1)
+
+    def test_invalidated_by_new_dataframe(self):
+        first = self.dataset._cached_hash()
+        self.dataset.dataframe = pd.DataFrame({'a': [1, 2, 4]})
+        second = self.dataset._cached_hash()
+        self.assertNotEqual(first, second)
+        self.assertEqual(second, self.dataset._hash())
+
+    def test_invalidated_by_config(self):
+        first = self.dataset._cached_hash()
+        self.dataset.config['split_section_map']['y'] = ['a']
+        second = self.dataset._cached_hash()
+        self.assertNotEqual(first, second)
+        self.assertEqual(second, self.dataset._hash())
+
+    def test_upstream_hash_reused(self):
+        pipeline = Pipeline()
+        pipeline.add_dataset(self.dataset)
+        with patch.object(Dataset, '_hash', wraps=self.dataset._hash) as mock_hash:
+            first = pipeline._cached_hash()
+            # Bypass the pipeline memoization, dataset is still memoized
+            second = pipeline._hash()
+        self.assertEqual(first, second)
+        self.assertEqual(mock_hash.call_count, 1)
+
+    def test_invalidated_by_upstream_change(self):
+        pipeline = Pipeline()
+        pipeline.add_dataset(self.dataset)
+        first = pipeline._cached_hash()
+        self.dataset.dataframe = pd.DataFrame({'a': [5]})
+        self.assertNotEqual(first, pipeline._cached_hash())
+
+    def test_invalidated_by_elided_params(self):
+        '''
+        Changes hidden by truncated reprs (ex: large arrays) still invalidate
+        '''
+        class ArrayTransformer(Transformer):
+            def __init__(self, weights):
+                super(ArrayTransformer, self).__init__()
+                self.weights = weights
+
+            def get_params(self, **kwargs):
+                return {'weights': self.weights}
+
+        weights = np.zeros(5000)
+        pipeline = Pipeline()
+        pipeline.add_dataset(self.dataset)
+        pipeline.add_transformer('array', ArrayTransformer(weights))
+        external_model = MagicMock()
+        external_model.get_params.return_value = {'weights': weights}
+        with patch.object(Model, '_create_external_model', return_value=external_model):
+            model = Model()
+        model.add_pipeline(pipeline)
+
+        pipeline_hash = pipeline._cached_hash()
+        model_hash = model._cached_hash()
+        weights[2500] = 1
+        self.assertNotEqual(pipeline_hash, pipeline._cached_hash())
+        self.assertEqual(pipeline._cached_hash(), pipeline._hash())
+        self.assertNotEqual(model_hash, model._cached_hash())
+
+    def test_memoization_disabled_without_fingerprint(self):
+        with patch.object(Dataset, '_hash_fingerprint', return_value=None),\
+                patch.object(Dataset, '_hash', return_value='abc') as mock_hash:
+            self.dataset._cached_hash()
+            self.dataset._cached_hash()
+        self.assertEqual(mock_hash.call_count, 2)
+
+
+class ParallelArtifactSaveTests(unittest.TestCase):
+    '''
+    Tests for concurrent saving across save patterns
+    '''
+
+    def setUp(self):
+        # Both saves have to be in flight at the same time to pass the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        class FakeSavePattern(object):
+            @classmethod
+            def save(cls, obj, persistable_id, **kwargs):
+                barrier.wait()
+                return f'{cls.SAVE_PATTERN}/{persistable_id}'
+
+        class FakeSavePatternA(FakeSavePattern):
+            SAVE_PATTERN = 'fake_parallel_save_a'
+
+        class FakeSavePatternB(FakeSavePattern):
+            SAVE_PATTERN = 'fake_parallel_save_b'
+
+        class FailingSavePattern(object):
+            SAVE_PATTERN = 'fake_parallel_save_failing'
+
+            @classmethod
+            def save(cls, **kwargs):
+                raise ValueError('Unavailable backend')
+
+        self.save_patterns = [FakeSavePatternA, FakeSavePatternB, FailingSavePattern]
+        for pattern in self.save_patterns:
+            register_save_pattern(pattern, overwrite=True)
+
+        self.dataset = Dataset(
+            has_external_files=True,
+            save_patterns={'dataset': ['fake_parallel_save_b', 'fake_parallel_save_a']})
+        self.dataset.dataframe = pd.DataFrame({'a': [1, 2]})
+
+    def tearDown(self):
+        for pattern in self.save_patterns:
+            deregister_save_pattern(pattern)
+
+    def test_concurrent_save(self):
+        self.dataset.save_external_files(workers=2)
+        # Configured order is retained (restore priority)
+        self.assertEqual(
+            list(self.dataset.filepaths['dataset'].items()),
+            [('fake_parallel_save_b', f'fake_parallel_save_b/{self.dataset.id}'),
+             ('fake_parallel_save_a', f'fake_parallel_save_a/{self.dataset.id}')]
+        )
+
+    def test_errors_reported_per_pattern(self):
+        self.dataset.state['save_patterns']['dataset'].append('fake_parallel_save_failing')
+        with self.assertRaisesRegex(SimpleMLError, 'dataset via fake_parallel_save_failing'):
+            self.dataset.save_external_files(workers=3)
+        # Successful patterns are still recorded
+        self.assertEqual(
+            list(self.dataset.filepaths['dataset']),
+            ['fake_parallel_save_b', 'fake_parallel_save_a']
+        )
+
+
+class SharedSerializationTests(unittest.TestCase):
+    '''
+    Serializations are only buffered for artifacts with several destinations
+    '''
+
+    def setUp(self):
+        self.active_caches = []
+        active_caches = self.active_caches
+
+        class RecordingSavePattern(object):
+            @classmethod
+            def save(cls, obj, persistable_id, **kwargs):
+                active_caches.append(get_active_serialization_cache())
+                return f'{cls.SAVE_PATTERN}/{persistable_id}'
+
+        class RecordingSavePatternA(RecordingSavePattern):
+            SAVE_PATTERN = 'fake_recording_save_a'
+
+        class RecordingSavePatternB(RecordingSavePattern):
+            SAVE_PATTERN = 'fake_recording_save_b'
+
+        self.save_patterns = [RecordingSavePatternA, RecordingSavePatternB]
+        for pattern in self.save_patterns:
+            register_save_pattern(pattern, overwrite=True)
+
+    def tearDown(self):
+        for pattern in self.save_patterns:
+            deregister_save_pattern(pattern)
+
+    def save(self, save_patterns):
+        dataset = Dataset(has_external_files=True, save_patterns={'dataset': save_patterns})
+        dataset.dataframe = pd.DataFrame({'a': [1, 2]})
+        dataset.save_external_files()
+
+    def test_single_destination_written_directly(self):
+        self.save(['fake_recording_save_a'])
+        self.assertEqual(self.active_caches, [None])
+
+    def test_multiple_destinations_share_serialization(self):
+        self.save(['fake_recording_save_a', 'fake_recording_save_b'])
+        self.assertEqual(len(self.active_caches), 2)
+        self.assertIsNotNone(self.active_caches[0])
+        self.assertIs(self.active_caches[0], self.active_caches[1])
+
+    def test_concurrent_destinations_share_serialization(self):
+        dataset = Dataset(has_external_files=True, save_patterns={'dataset': ['fake_recording_save_a', 'fake_recording_save_b']})
+        dataset.dataframe = pd.DataFrame({'a': [1, 2]})
+        dataset.save_external_files(workers=2)
+        self.assertEqual(len(self.active_caches), 2)
+        self.assertIsNotNone(self.active_caches[0])
+        self.assertIs(self.active_caches[0], self.active_caches[1])
+        # Not left active on the calling thread
+        self.assertIsNone(get_active_serialization_cache())
+
+
+class ParallelArtifactLoadTests(unittest.TestCase):
+    '''
+    Tests for concurrent and hedged artifact restores
+    '''
+
+    def setUp(self):
+        release = self.release = threading.Event()
+        barrier = self.barrier = threading.Barrier(2, timeout=5)
+
+        class SlowLoadPattern(object):
+            SAVE_PATTERN = 'fake_load_slow'
+
+            @classmethod
+            def load(cls, filepath_data):
+                release.wait(5)
+                return f'slow {filepath_data}'
+
+        class FastLoadPattern(object):
+            SAVE_PATTERN = 'fake_load_fast'
+
+            @classmethod
+            def load(cls, filepath_data):
+                return f'fast {filepath_data}'
+
+        class ConcurrentLoadPattern(object):
+            SAVE_PATTERN = 'fake_load_concurrent'
+
+            @classmethod
+            def load(cls, filepath_data):
+                barrier.wait()
+                return filepath_data
+
+        class FailingLoadPattern(object):
+            SAVE_PATTERN = 'fake_load_failing'
+
+            @classmethod
+            def load(cls, filepath_data):
+                raise ValueError('Unavailable backend')
+
+        self.load_patterns = [SlowLoadPattern, FastLoadPattern, ConcurrentLoadPattern, FailingLoadPattern]
+        for pattern in self.load_patterns:
+            register_save_pattern(pattern, save=False, overwrite=True)
+
+        self.dataset = Dataset()
+
+    def tearDown(self):
+        # Let abandoned loads finish
+        self.release.set()
+        for pattern in self.load_patterns:
+            deregister_save_pattern(pattern, save=False)
+
+    def test_fallback_on_failure(self):
+        self.dataset.filepaths = {'dataset': {'fake_load_failing': 'a', 'fake_load_fast': 'b'}}
+        self.dataset.load_external_files()
+        self.assertEqual(self.dataset._external_file, 'fast b')
+
+    def test_all_patterns_fail(self):
+        self.dataset.filepaths = {'dataset': {'fake_load_failing': 'a'}}
+        with self.assertRaises(SimpleMLError):
+            self.dataset.load_external_files(hedge_delay=0)
+
+    def test_hedged_load(self):
+        self.dataset.filepaths = {'dataset': {'fake_load_slow': 'a', 'fake_load_fast': 'b'}}
+        self.dataset.load_external_files(hedge_delay=0.05)
+        self.assertEqual(self.dataset._external_file, 'fast b')
+
+    def test_hedged_load_prefers_priority(self):
+        self.dataset.filepaths = {'dataset': {'fake_load_slow': 'a', 'fake_load_fast': 'b'}}
+        self.release.set()
+        self.dataset.load_external_files(hedge_delay=5)
+        self.assertEqual(self.dataset._external_file, 'slow a')
+
+    def test_concurrent_artifacts(self):
+        self.dataset.filepaths = {
+            'dataset': {'fake_load_concurrent': 'a'},
+            'other': {'fake_load_concurrent': 'b'}
+        }
+        self.dataset.unloaded_artifacts = ['dataset', 'other']
+        with patch.object(Dataset, '_ARTIFACT_other', {'save': 'other', 'restore': '_other'}, create=True):
+            self.dataset.load_external_files(workers=2)
+        self.assertEqual((self.dataset._external_file, self.dataset._other), ('a', 'b'))
+        self.assertEqual(self.dataset.unloaded_artifacts, [])
+
+
+class PersistableCacheTests(unittest.TestCase):
+    '''
+    Tests for the process wide cache of loaded persistables
+    '''
+
+    def build_dataset(self, rows=0):
+        dataset = Dataset()
+        dataset.hash_ = f'hash_{rows}'
+        if rows:
+            dataset._external_file = pd.DataFrame({'a': range(rows)})
+        return dataset
+
+    def test_get_and_put(self):
+        cache = PersistableCache(max_entries=64)
+        dataset = self.build_dataset()
+        self.assertIsNone(cache.get(dataset.id, dataset.hash_))
+        cache.put(dataset)
+        self.assertIs(cache.get(dataset.id, dataset.hash_), dataset)
+        # Hash has to match
+        self.assertIsNone(cache.get(dataset.id, 'other_hash'))
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 2)
+
+    def test_entry_limit_evicts_least_recently_used(self):
+        cache = PersistableCache(max_entries=2)
+        first, second, third = self.build_dataset(), self.build_dataset(), self.build_dataset()
+        cache.put(first)
+        cache.put(second)
+        cache.get(first.id, first.hash_)
+        cache.put(third)
+        self.assertIn(first, cache)
+        self.assertNotIn(second, cache)
+        self.assertIn(third, cache)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_memory_limit(self):
+        dataset = self.build_dataset(rows=100)
+        size = estimate_persistable_size(dataset)
+        self.assertGreaterEqual(size, 800)
+        # Unloaded artifacts do not count
+        dataset.unloaded_artifacts = ['dataset']
+        self.assertEqual(estimate_persistable_size(dataset), 0)
+        dataset.unloaded_artifacts = []
+
+        cache = PersistableCache(max_entries=64, max_bytes=size * 2)
+        datasets = [self.build_dataset(rows=100) for _ in range(3)]
+        for i in datasets:
+            cache.put(i)
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.size, size * 2)
+
+        cache = PersistableCache(max_entries=64, max_bytes=size - 1)
+        cache.put(dataset)
+        self.assertEqual(len(cache), 0)
+
+    def test_new_hash_replaces_stale_entry(self):
+        cache = PersistableCache(max_entries=64)
+        dataset = self.build_dataset()
+        cache.put(dataset)
+        dataset.hash_ = 'recalculated'
+        cache.put(dataset)
+        self.assertEqual(len(cache), 1)
+
+    def test_remeasured_after_lazy_restore(self):
+        '''
+        Persistables are cached before their artifacts are restored. Restores
+        update the size and evict to stay within the bounds
+        '''
+        size = estimate_persistable_size(self.build_dataset(rows=100))
+        cache = PersistableCache(max_entries=64, max_bytes=size + size // 2)
+        lazy, other = self.build_dataset(rows=100), self.build_dataset(rows=100)
+        lazy.hash_ = 'lazy'
+        lazy.filepaths = {'dataset': {'fake_restore': 'a'}}
+        lazy.unloaded_artifacts = ['dataset']
+        cache.put(other)
+        cache.put(lazy)
+        self.assertEqual(cache.size, size)
+
+        with patch('simpleml.persistables.base_persistable.PERSISTABLE_CACHE', cache),\
+                patch.object(Dataset, 'load_external_file', return_value=pd.DataFrame({'a': range(100)})):
+            lazy.load_if_unloaded('dataset')
+        # Both no longer fit so the least recently used is evicted
+        self.assertNotIn(other, cache)
+        self.assertIn(lazy, cache)
+        self.assertEqual(cache.size, size)
+
+    def test_disabled_by_default(self):
+        cache = PersistableCache()
+        self.assertFalse(cache.enabled)
+
+    def test_disabled(self):
+        cache = PersistableCache(max_entries=0)
+        dataset = self.build_dataset()
+        cache.put(dataset)
+        self.assertIsNone(cache.get(dataset.id, dataset.hash_))
+
+    def test_loader_reuses_loaded_persistable(self):
+        dataset = self.build_dataset()
+        query = MagicMock()
+        query.order_by.return_value.first.return_value = dataset
+        with patch('simpleml.utils.scoring.load_persistable.PERSISTABLE_CACHE', PersistableCache(max_entries=64)),\
+                patch.object(Dataset, 'where', return_value=query),\
+                patch.object(Dataset, 'load') as mock_load,\
+                patch.object(PersistableLoader, 'validate_environment'):
+            first = PersistableLoader.load_dataset(name='abc')
+            second = PersistableLoader.load_dataset(name='abc')
+        self.assertIs(first, second)
+        mock_load.assert_called_once_with(load_externals=False)
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -7,6 +7,14 @@ __author__ = 'Elisha Yadgaran'
 
 import unittest
 import numpy as np
+import pandas as pd
+
+from unittest.mock import patch
+from sklearn.model_selection import train_test_split
+
+from simpleml.constants import TRAIN_SPLIT, VALIDATION_SPLIT, TEST_SPLIT
+from simpleml.datasets.dataset_splits import Split
+from simpleml.pipelines import Pipeline, RandomSplitPipeline
 from simpleml.pipelines.validation_split_mixins import SplitMixin, NoSplitMixin,\
     RandomSplitMixin, ExplicitSplitMixin, ChronologicalSplitMixin, KFoldSplitMixin
 
@@ -33,7 +41,52 @@ class NoSplitMixinTests(unittest.TestCase):
 
 
 class RandomSplitMixinTests(unittest.TestCase):
-    pass
+    def build_pipeline(self, **kwargs):
+        pipeline = RandomSplitPipeline(train_size=0.6, validation_size=0.2, test_size=0.2, **kwargs)
+        pipeline.dataset = MockDataset()
+        return pipeline
+
+    def test_splits_are_int64_positions(self):
+        pipeline = self.build_pipeline()
+        pipeline.split_dataset()
+        positions = [pipeline._dataset_splits[split].positions for split in (TRAIN_SPLIT, VALIDATION_SPLIT, TEST_SPLIT)]
+        for split_positions in positions:
+            self.assertEqual(split_positions.dtype, np.int64)
+        self.assertEqual([len(i) for i in positions], [6, 2, 2])
+        np.testing.assert_array_equal(np.sort(np.concatenate(positions)), np.arange(10))
+        train_split = pipeline._dataset_splits[TRAIN_SPLIT].apply_projection(Split(X=MockDataset.X))
+        np.testing.assert_array_equal(train_split.X, MockDataset.X[positions[0]])
+
+    def test_positions_select_same_rows_as_labels(self):
+        '''
+        Positions are drawn the same way labels used to be
+        '''
+        index = pd.Index(list('jihgfedcba'))
+        positions = RandomSplitMixin.get_positions(index)
+        _, label_test = train_test_split(index, test_size=0.3, random_state=10)
+        _, position_test = train_test_split(positions, test_size=0.3, random_state=10)
+        self.assertEqual(list(index.take(position_test)), list(label_test))
+
+    def test_persisted_positions_reused(self):
+        pipeline = self.build_pipeline(persist_split_indices=True)
+        self.assertTrue(pipeline.state['persist_split_indices'])
+        with patch.object(Pipeline, 'save'):
+            pipeline.save()
+        persisted = pipeline.metadata_['split_indices']
+        self.assertEqual(set(persisted), {TRAIN_SPLIT, VALIDATION_SPLIT, TEST_SPLIT})
+
+        pipeline._dataset_splits = None
+        with patch('simpleml.pipelines.validation_split_mixins.train_test_split') as mock_split:
+            pipeline.split_dataset()
+        mock_split.assert_not_called()
+        for split, split_positions in persisted.items():
+            np.testing.assert_array_equal(pipeline._dataset_splits[split].positions, split_positions)
+
+    def test_positions_not_persisted_by_default(self):
+        pipeline = self.build_pipeline()
+        with patch.object(Pipeline, 'save'):
+            pipeline.save()
+        self.assertNotIn('split_indices', pipeline.metadata_)
 
 
 class ExplicitSplitMixinTests(unittest.TestCase):
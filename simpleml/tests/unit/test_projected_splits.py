@@ -5,6 +5,7 @@ Projected Split related tests
 __author__ = 'Elisha Yadgaran'
 
 
+import gc
 import unittest
 import pandas as pd
 import numpy as np
@@ -14,7 +15,9 @@ from abc import ABCMeta, abstractmethod
 
 from simpleml.datasets.base_dataset import Dataset
 from simpleml.datasets.dataset_splits import Split
-from simpleml.pipelines.projected_splits import ProjectedDatasetSplit, IdentityProjectedDatasetSplit, IndexBasedProjectedDatasetSplit
+from simpleml.utils.errors import PipelineError
+from simpleml.pipelines.projected_splits import ProjectedDatasetSplit, IdentityProjectedDatasetSplit, IndexBasedProjectedDatasetSplit, \
+    ProjectedSplitCache, PROJECTED_SPLIT_CACHE
 
 
 class AbstractProjectedDatasetSplitTests(unittest.TestCase):
@@ -175,6 +178,114 @@ class IndexProjectedDatasetSplitTests(unittest.TestCase, ProjectedDatasetSplitTe
         numpy_split_comparison(expected_split, implicit_output)
         numpy_split_comparison(implicit_output, explicit_output)
 
+    def test_positional_indexing(self):
+        '''
+        Positions select rows regardless of the index labels
+        '''
+        mock_dataset = MagicMock()
+        mock_dataset.get_split.return_value = Split(X=pd.DataFrame({'a': range(5)}, index=list('edcba')))
+        projected_split = self.mock_cls(dataset=mock_dataset, positions=[3, 0])
+        self.assertEqual(projected_split.positions.dtype, np.int64)
+        pd.testing.assert_frame_equal(projected_split.X, pd.DataFrame({'a': [3, 0]}, index=['b', 'e']))
+
+        mask = np.array([True, False, False, True, False])
+        np.testing.assert_array_equal(self.mock_cls(positions=mask).positions, [0, 3])
+        self.assertEqual(self.mock_cls(positions=[]).positions.dtype, np.int64)
+        with self.assertRaises(PipelineError):
+            self.mock_cls(positions=['a', 'b'])
+        with self.assertRaises(PipelineError):
+            self.mock_cls(indices=[0], positions=[0])
+
+    def test_integer_labels(self):
+        '''
+        Integer indices are labels of a non default index, not positions
+        '''
+        mock_dataset = MagicMock()
+        mock_dataset.get_split.return_value = Split(X=pd.DataFrame({'a': range(4)}, index=[10, 20, 30, 40]))
+        projected_split = self.mock_cls(dataset=mock_dataset, indices=[30, 10])
+        pd.testing.assert_frame_equal(projected_split.X, pd.DataFrame({'a': [2, 0]}, index=[30, 10]))
+        pd.testing.assert_frame_equal(
+            self.mock_cls(dataset=mock_dataset, positions=[3, 1]).X, pd.DataFrame({'a': [3, 1]}, index=[40, 20]))
+
+        with self.assertRaises(PipelineError):
+            self.mock_cls(dataset=mock_dataset, indices=[1, 3]).X
+
+        # Numpy sections are labeled by position
+        numpy_dataset = MagicMock()
+        numpy_dataset.get_split.return_value = Split(X=np.arange(4))
+        np.testing.assert_array_equal(self.mock_cls(dataset=numpy_dataset, indices=[1, 3]).X, [1, 3])
+
+
+class ProjectedSplitMemoizationTests(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(PROJECTED_SPLIT_CACHE, 'max_entries', 16)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dataset = MagicMock()
+        self.dataset.get_split.side_effect = lambda split: Split(X=pd.DataFrame(range(10)), y=pd.Series(range(10)))
+
+    def test_split_retrieved_once(self):
+        projected_split = IndexBasedProjectedDatasetSplit(dataset=self.dataset, split=None, indices=range(2, 5))
+        pd.testing.assert_frame_equal(projected_split.X, pd.DataFrame(range(2, 5), index=range(2, 5)))
+        pd.testing.assert_series_equal(projected_split.y, pd.Series(range(2, 5), index=range(2, 5)))
+        self.assertEqual(self.dataset.get_split.call_count, 1)
+
+    def test_disabled_by_default(self):
+        self.assertFalse(ProjectedSplitCache().enabled)
+
+    def test_memoization_disabled(self):
+        projected_split = IdentityProjectedDatasetSplit(dataset=self.dataset, split=None, memoize=False)
+        projected_split.X
+        projected_split.y
+        self.assertEqual(self.dataset.get_split.call_count, 2)
+
+    def test_setting_sections_does_not_affect_memoized_split(self):
+        projected_split = IdentityProjectedDatasetSplit(dataset=self.dataset, split=None)
+        split = projected_split.projected_split
+        split['X'] = None
+        self.assertIsNotNone(projected_split.X)
+        self.assertEqual(self.dataset.get_split.call_count, 1)
+
+    def test_invalidated_by_dataset_changes(self):
+        projected_split = IdentityProjectedDatasetSplit(dataset=self.dataset, split=None)
+        projected_split.X
+        self.dataset._external_file = pd.DataFrame()
+        projected_split.X
+        self.assertEqual(self.dataset.get_split.call_count, 2)
+        self.dataset.version = 2
+        projected_split.X
+        self.assertEqual(self.dataset.get_split.call_count, 3)
+        projected_split.clear_memoized_split()
+        projected_split.X
+        self.assertEqual(self.dataset.get_split.call_count, 4)
+
+    def test_entry_dropped_with_projected_split(self):
+        projected_split = IdentityProjectedDatasetSplit(dataset=self.dataset, split=None)
+        projected_split.X
+        key = projected_split._cache_key
+        self.assertIn(key, PROJECTED_SPLIT_CACHE._entries)
+        del projected_split
+        gc.collect()
+        self.assertNotIn(key, PROJECTED_SPLIT_CACHE._entries)
+
+    def test_cache_bounds(self):
+        fingerprint = ('a',)
+        cache = ProjectedSplitCache(max_entries=2, max_bytes=None)
+        for key in range(3):
+            cache.put(key, fingerprint, Split(X=np.ones(10)))
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(0, fingerprint))
+        self.assertIsNotNone(cache.get(2, fingerprint))
+        self.assertIsNone(cache.get(2, ('b',)))
+
+        cache = ProjectedSplitCache(max_entries=10, max_bytes=2000)
+        cache.put(0, fingerprint, Split(X=np.ones(100)))
+        cache.put(1, fingerprint, Split(X=np.ones(100)))
+        self.assertEqual(len(cache), 1)
+        self.assertLessEqual(cache.size, 2000)
+        cache.put(2, fingerprint, Split(X=np.ones(1000)))
+        self.assertIsNone(cache.get(2, fingerprint))
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
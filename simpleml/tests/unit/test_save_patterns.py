@@ -5,19 +5,43 @@ Tests for save patterns
 __author__ = 'Elisha Yadgaran'
 
 
+import io
 import unittest
 import tempfile
 import random
+import hashlib
+import shutil
+import struct
+import uuid
+import threading
+import cloudpickle
+import numpy as np
+import pandas as pd
 
 from os.path import isfile, join
+from unittest.mock import patch, MagicMock
 
 from simpleml.registries import SAVE_METHOD_REGISTRY, LOAD_METHOD_REGISTRY
 from simpleml.save_patterns.decorators import SavePatternDecorators, register_save_pattern, deregister_save_pattern
 from simpleml.save_patterns.base import SavePatternMixin, BaseSavePattern
-from simpleml.save_patterns.database import DatabaseTableSavePattern, DatabasePickleSavePattern
-from simpleml.save_patterns.libcloud import CloudBase, CloudPickleSavePattern, CloudHDF5SavePattern, CloudKerasHDF5SavePattern
-from simpleml.save_patterns.local import DiskPickleSavePattern, DiskHDF5SavePattern
+from simpleml.save_patterns.database import DatabaseTableSavePattern, DatabasePickleSavePattern, ROW_NUMBER_COLUMN
+from simpleml.persistables.base_sqlalchemy import DatasetStorageSqlalchemy, BinaryStorageSqlalchemy
+from simpleml.utils.binary_blob import BinaryBlob, BinaryBlobChunk
+from sqlalchemy import create_engine, event, text
+from simpleml.utils.errors import SimpleMLError
+from simpleml.constants import DATAFRAME_SPLIT_COLUMN
+from simpleml.imports import pa, MissingImportWrapper
+from simpleml.save_patterns.libcloud import CloudBase, CloudPickleSavePattern, CloudHDF5SavePattern, CloudKerasHDF5SavePattern, CloudParquetSavePattern
+from simpleml.save_patterns.local import DiskPickleSavePattern, DiskHDF5SavePattern, DiskMemoryMappedSavePattern, DiskParquetSavePattern
+from simpleml.save_patterns.memory_mapped import dump_memory_mapped, load_memory_mapped
 from simpleml.save_patterns.onedrive import OnedriveBase, OnedrivePickleSavePattern, OnedriveHDF5SavePattern, OnedriveKerasHDF5SavePattern
+from simpleml.save_patterns.artifact_cache import ArtifactCache
+from simpleml.save_patterns.out_of_band import dump_out_of_band, load_out_of_band, loads_out_of_band, OUT_OF_BAND_MAGIC
+from simpleml.save_patterns.compression import compress, decompress, resolve_codec, benchmark_compression,\
+    hdf5_compression_options, COMPRESSION_EXTENSIONS
+from simpleml.save_patterns.bulk_copy import IteratorStream, csv_copy_chunks, binary_copy_chunks, BINARY_COPY_HEADER
+from simpleml.save_patterns.serialization import SerializationCache, SerializedBuffer, get_active_serialization_cache,\
+    activate_serialization_cache
 
 
 TEMP_DIRECTORY = tempfile.gettempdir()
@@ -645,5 +669,670 @@ class SavePatternTests(unittest.TestCase, SavePatternMixin):
         '''
 
 
+class SerializationCacheTests(unittest.TestCase, SavePatternMixin):
+    '''
+    Tests for serializing once and writing to many destinations
+    '''
+
+    def test_context_manager_activation(self):
+        self.assertIsNone(get_active_serialization_cache())
+        with SerializationCache() as cache:
+            self.assertIs(get_active_serialization_cache(), cache)
+        self.assertIsNone(get_active_serialization_cache())
+
+    def test_caches_are_thread_local(self):
+        seen = []
+        with SerializationCache() as cache:
+            thread = threading.Thread(target=lambda: seen.append(get_active_serialization_cache()))
+            thread.start()
+            thread.join()
+            self.assertEqual(seen, [None])
+
+            # Explicit hand off to another thread
+            def worker():
+                with activate_serialization_cache(cache):
+                    seen.append(get_active_serialization_cache())
+                seen.append(get_active_serialization_cache())
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+        self.assertEqual(seen, [None, cache, None])
+
+    def test_pickled_once(self):
+        obj = TestSerializationClass('serialize_once', 1, b=2)
+        filepath = f'pickle_serialize_once_unit_test-{RANDOM_RUN}'
+        with patch('simpleml.save_patterns.base.dump_out_of_band', wraps=dump_out_of_band) as mock_dump:
+            with SerializationCache() as cache:
+                stream = self.pickle_object(obj)
+                self.pickle_object(obj, filepath=filepath, root_directory=TEMP_DIRECTORY)
+                # Same file again (ex: disk and cloud patterns) is not rewritten
+                self.pickle_object(obj, filepath=filepath, root_directory=TEMP_DIRECTORY)
+
+        self.assertEqual(mock_dump.call_count, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(self.load_pickled_object(stream, stream=True), obj)
+        self.assertEqual(self.load_pickled_object(filepath, root_directory=TEMP_DIRECTORY), obj)
+
+    def test_different_objects_not_shared(self):
+        obj, obj2 = TestSerializationClass('a'), TestSerializationClass('b')
+        with SerializationCache():
+            stream = self.pickle_object(obj)
+            stream2 = self.pickle_object(obj2)
+        self.assertEqual(self.load_pickled_object(stream, stream=True), obj)
+        self.assertEqual(self.load_pickled_object(stream2, stream=True), obj2)
+
+    def test_large_buffers_spool_to_disk(self):
+        buffer = SerializedBuffer(max_memory_bytes=10)
+        cloudpickle.dump(list(range(100)), buffer.fileobj)
+        self.assertTrue(buffer.spooled)
+        self.assertEqual(cloudpickle.loads(buffer.getvalue()), list(range(100)))
+        buffer.close()
+
+
+class ArtifactCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.downloads = []
+
+    def download(self, contents):
+        def _download(path):
+            self.downloads.append(path)
+            with open(path, 'wb') as f:
+                f.write(contents)
+        return _download
+
+    def test_downloaded_once(self):
+        cache = ArtifactCache(self.directory, max_bytes=1024)
+        path = cache.fetch('bucket/a.pkl@1', self.download(b'abc'))
+        path2 = ArtifactCache(self.directory, max_bytes=1024).fetch('bucket/a.pkl@1', self.download(b'abc'))
+
+        self.assertEqual(len(self.downloads), 1)
+        self.assertEqual(path, path2)
+        self.assertEqual(path, cache.blob_path(hashlib.sha256(b'abc').hexdigest()))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'abc')
+
+    def test_corrupted_blob_redownloaded(self):
+        cache = ArtifactCache(self.directory, max_bytes=1024)
+        path = cache.fetch('a', self.download(b'abc'))
+        with open(path, 'wb') as f:
+            f.write(b'abcd')
+        cache.fetch('a', self.download(b'abc'))
+        self.assertEqual(len(self.downloads), 2)
+
+        # Same size corruption is only caught when verifying
+        with open(path, 'wb') as f:
+            f.write(b'xyz')
+        cache.fetch('a', self.download(b'abc'))
+        self.assertEqual(len(self.downloads), 2)
+        cache.verify = True
+        cache.fetch('a', self.download(b'abc'))
+        self.assertEqual(len(self.downloads), 3)
+
+    def test_checksum_mismatch(self):
+        cache = ArtifactCache(self.directory, max_bytes=1024)
+        with self.assertRaises(SimpleMLError):
+            cache.fetch('a', self.download(b'abc'), expected_md5=hashlib.md5(b'xyz').hexdigest())
+        self.assertIsNone(cache.get('a'))
+        cache.fetch('a', self.download(b'abc'), expected_md5=hashlib.md5(b'abc').hexdigest().upper())
+        self.assertIsNotNone(cache.get('a'))
+
+    def test_least_recently_used_evicted(self):
+        cache = ArtifactCache(self.directory, max_bytes=5)
+        with patch('simpleml.save_patterns.artifact_cache.EVICTION_GRACE_SECONDS', -1):
+            first = cache.fetch('a', self.download(b'aaa'))
+            second = cache.fetch('b', self.download(b'bbb'))
+
+        self.assertFalse(isfile(first))
+        self.assertTrue(isfile(second))
+        self.assertIsNone(cache.get('a'))
+
+    def test_recently_used_not_evicted(self):
+        cache = ArtifactCache(self.directory, max_bytes=5)
+        first = cache.fetch('a', self.download(b'aaa'))
+        cache.fetch('b', self.download(b'bbb'))
+        self.assertTrue(isfile(first))
+
+    def test_cloud_downloads_shared(self):
+        contents = cloudpickle.dumps(TestSerializationClass('a'))
+
+        class FakeObject(object):
+            hash = f'"{hashlib.md5(contents).hexdigest()}"'
+
+        class FakeDriver(object):
+            downloads = 0
+
+            def get_object(self, container_name, object_name):
+                return FakeObject()
+
+            def download_object(self, obj, destination_path, **kwargs):
+                FakeDriver.downloads += 1
+                with open(destination_path, 'wb') as f:
+                    f.write(contents)
+
+        cache = ArtifactCache(self.directory, max_bytes=1024)
+        config = {'section': 's3', 'path': '', 'container': 'bucket'}
+        with patch.object(CloudBase, 'CLOUD_DRIVER', FakeDriver()),\
+                patch('simpleml.save_patterns.libcloud.ARTIFACT_CACHE', cache),\
+                patch('simpleml.save_patterns.libcloud.CONFIG.get', side_effect=lambda section, key, fallback=None: config[key]):
+            for _ in range(2):
+                obj = CloudPickleSavePattern.load(f'missing-{RANDOM_RUN}.pkl')
+
+        self.assertEqual(obj, TestSerializationClass('a'))
+        self.assertEqual(FakeDriver.downloads, 1)
+
+    def test_disabled(self):
+        self.assertFalse(ArtifactCache(self.directory, max_bytes=0).enabled)
+
+
+class MemoryMappedSavePatternTests(unittest.TestCase, SavePatternMixin):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def test_arrays_memory_mapped(self):
+        array = np.random.rand(100, 100)
+        obj = {'array': array, 'shared': array, 'small': np.arange(3), 'model': TestSerializationClass('a')}
+        filepath = join(self.directory, 'artifact')
+        self.assertEqual(dump_memory_mapped(obj, filepath, min_bytes=1024), 1)
+
+        loaded = load_memory_mapped(filepath)
+        self.assertIsInstance(loaded['array'], np.memmap)
+        self.assertFalse(loaded['array'].flags.writeable)
+        self.assertIs(loaded['array'], loaded['shared'])
+        self.assertNotIsInstance(loaded['small'], np.memmap)
+        np.testing.assert_array_equal(loaded['array'], array)
+        self.assertEqual(loaded['model'], obj['model'])
+
+    def test_dataframe_blocks_memory_mapped(self):
+        df = pd.DataFrame({'a': np.arange(1000.), 'b': np.arange(1000), 'c': ['x'] * 1000})
+        filepath = join(self.directory, 'dataframe')
+        # Object columns stay in the pickle
+        self.assertEqual(dump_memory_mapped(df, filepath, min_bytes=1024), 2)
+        pd.testing.assert_frame_equal(load_memory_mapped(filepath), df)
+
+    def test_overwrite(self):
+        filepath = join(self.directory, 'artifact')
+        dump_memory_mapped(np.zeros(10000), filepath)
+        first = load_memory_mapped(filepath)
+        dump_memory_mapped(np.ones(10000), filepath)
+
+        np.testing.assert_array_equal(load_memory_mapped(filepath), np.ones(10000))
+        # Existing maps are unaffected
+        np.testing.assert_array_equal(first, np.zeros(10000))
+
+    def test_save_pattern(self):
+        obj = np.random.rand(10000)
+        self.mmap_object(obj, 'artifact.mmap', root_directory=self.directory)
+        np.testing.assert_array_equal(self.load_mmapped_object('artifact.mmap', root_directory=self.directory), obj)
+
+        self.assertEqual(DiskMemoryMappedSavePattern.SAVE_PATTERN, 'disk_npy_mmap')
+        self.assertIs(SAVE_METHOD_REGISTRY.get('disk_npy_mmap'), DiskMemoryMappedSavePattern)
+
+
+PYARROW_MISSING = isinstance(pa, type) and issubclass(pa, MissingImportWrapper)
+
+
+class ParquetSavePatternTests(unittest.TestCase, SavePatternMixin):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.df = pd.DataFrame({
+            'a': np.arange(10.),
+            'b': np.arange(10),
+            DATAFRAME_SPLIT_COLUMN: ['TRAIN'] * 6 + ['TEST'] * 3 + ['TRAIN'],
+        }, index=np.arange(10) * 10)
+
+    def test_row_groups_follow_splits(self):
+        self.assertEqual(self.parquet_row_groups(self.df), [(0, 6), (6, 9), (9, 10)])
+        self.assertEqual(self.parquet_row_groups(self.df, row_group_size=4), [(0, 4), (4, 6), (6, 8), (8, 9), (9, 10)])
+        self.assertEqual(self.parquet_row_groups(self.df, row_group_column=None), [(0, 10)])
+        self.assertEqual(self.parquet_row_groups(self.df.iloc[:0]), [(0, 0)])
+
+    def test_interleaved_splits_use_sized_row_groups(self):
+        df = pd.DataFrame({DATAFRAME_SPLIT_COLUMN: ['TRAIN', 'TEST'] * 50})
+        self.assertEqual(self.parquet_row_groups(df, row_group_size=40), [(0, 40), (40, 80), (80, 100)])
+        self.assertEqual(len(self.parquet_row_groups(df, max_aligned_row_groups=100)), 100)
+
+    @unittest.skipIf(PYARROW_MISSING, 'pyarrow not installed')
+    def test_round_trip(self):
+        self.parquet_object(self.df, 'df.parquet', root_directory=self.directory)
+        pd.testing.assert_frame_equal(self.load_parquet_object('df.parquet', root_directory=self.directory), self.df)
+        self.assertEqual(self.load_parquet_columns('df.parquet', root_directory=self.directory), ['a', 'b', DATAFRAME_SPLIT_COLUMN])
+
+    @unittest.skipIf(PYARROW_MISSING, 'pyarrow not installed')
+    def test_partial_load(self):
+        self.parquet_object(self.df, 'df.parquet', root_directory=self.directory)
+        subset = self.load_parquet_object(
+            'df.parquet', columns=['b'], filters=[(DATAFRAME_SPLIT_COLUMN, '=', 'TEST')],
+            root_directory=self.directory)
+        pd.testing.assert_frame_equal(subset, self.df.loc[self.df[DATAFRAME_SPLIT_COLUMN] == 'TEST', ['b']])
+
+    def test_registered(self):
+        self.assertIs(LOAD_METHOD_REGISTRY.get('disk_parquet'), DiskParquetSavePattern)
+        self.assertIs(LOAD_METHOD_REGISTRY.get('cloud_parquet'), CloudParquetSavePattern)
+
+
+class BulkCopyTests(unittest.TestCase, SavePatternMixin):
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'int': np.arange(5),
+            'float': [0.5, np.nan, 2.5, 3.5, 4.5],
+            'text': ['a', 'b|c', None, 'd"e', 'f'],
+            'bool': [True, False, True, False, True],
+            'timestamp': pd.to_datetime(['2000-01-01', '2000-01-01 00:00:01', None, '1999-12-31', '2021-10-10']),
+        })
+
+    @staticmethod
+    def decode_binary(data):
+        '''
+        Minimal parser for the Postgres binary copy format (returns raw fields)
+        '''
+        assert data.startswith(BINARY_COPY_HEADER)
+        offset, rows = len(BINARY_COPY_HEADER), []
+        while True:
+            count, = struct.unpack_from('!h', data, offset)
+            offset += 2
+            if count == -1:
+                break
+            row = []
+            for _ in range(count):
+                length, = struct.unpack_from('!i', data, offset)
+                offset += 4
+                if length == -1:
+                    row.append(None)
+                else:
+                    row.append(data[offset:offset + length])
+                    offset += length
+            rows.append(row)
+        assert offset == len(data)
+        return rows
+
+    def test_iterator_stream(self):
+        stream = IteratorStream([b'abc', b'', b'defg'])
+        self.assertEqual(stream.read(2), b'ab')
+        # Short reads at chunk boundaries, like a pipe
+        self.assertEqual(b''.join(iter(lambda: stream.read(3), b'')), b'cdefg')
+        self.assertEqual(stream.read(), b'')
+
+    @staticmethod
+    def parse_csv(data):
+        return pd.read_csv(io.BytesIO(data), sep='|', header=None, na_values=['NULL'], parse_dates=[4])
+
+    def test_csv_chunks_match_single_render(self):
+        expected = self.df.to_csv(sep='|', header=False, index=False, na_rep='NULL').encode()
+        for chunksize in (1, 2, 5, 100):
+            with self.subTest(chunksize=chunksize):
+                chunks = list(csv_copy_chunks(self.df, chunksize=chunksize, null='NULL'))
+                self.assertEqual(len(chunks), -(-len(self.df) // chunksize))
+                # Chunks can render midnight timestamps as dates, same values
+                pd.testing.assert_frame_equal(self.parse_csv(b''.join(chunks)), self.parse_csv(expected))
+
+    def test_binary_encoding(self):
+        for chunksize in (1, 2, 100):
+            with self.subTest(chunksize=chunksize):
+                rows = self.decode_binary(b''.join(binary_copy_chunks(self.df, chunksize=chunksize)))
+                self.assertEqual(len(rows), 5)
+                self.assertEqual([struct.unpack('!q', row[0])[0] for row in rows], list(range(5)))
+                self.assertEqual([row[1] and struct.unpack('!d', row[1])[0] for row in rows], [0.5, None, 2.5, 3.5, 4.5])
+                self.assertEqual([row[2] for row in rows], [b'a', b'b|c', None, b'd"e', b'f'])
+                self.assertEqual([row[3] for row in rows], [b'\x01', b'\x00', b'\x01', b'\x00', b'\x01'])
+                # Microseconds from 2000-01-01
+                self.assertEqual(
+                    [row[4] and struct.unpack('!q', row[4])[0] for row in rows],
+                    [0, 10 ** 6, None, -86400 * 10 ** 6, 1633824000 * 10 ** 6 - 946684800 * 10 ** 6])
+
+    def test_binary_fast_path_matches_row_path(self):
+        df = pd.DataFrame({'a': np.arange(4, dtype=np.int32), 'b': np.arange(4, dtype=np.float32)})
+        fast = b''.join(binary_copy_chunks(df))
+        with patch('simpleml.save_patterns.bulk_copy._encode_fast', side_effect=AssertionError):
+            # Text column forces the row by row path
+            rows = self.decode_binary(b''.join(binary_copy_chunks(df.assign(c='x'))))
+        self.assertEqual([row[:2] for row in self.decode_binary(fast)], [row[:2] for row in rows])
+        self.assertEqual(struct.unpack('!i', rows[3][0])[0], 3)
+        self.assertEqual(struct.unpack('!f', rows[3][1])[0], 3.0)
+
+    def test_df_to_sql_streams(self):
+        engine = MagicMock()
+        cursor = engine.raw_connection.return_value.cursor.return_value
+        copied = []
+        cursor.copy_expert.side_effect = lambda sql, stream: copied.append((sql, stream.read()))
+
+        with patch.object(pd.DataFrame, 'to_sql') as mock_to_sql:
+            self.df_to_sql(engine, self.df, 'table', chunksize=2)
+            self.df_to_sql(engine, self.df, 'table', copy_format='binary', index=True)
+
+        self.assertEqual(mock_to_sql.call_count, 2)
+        csv_sql, csv_data = copied[0]
+        self.assertIn('FORMAT CSV', csv_sql)
+        self.assertEqual(csv_data, b''.join(csv_copy_chunks(self.df, chunksize=2, null='SIMPLEML_NULL')))
+        binary_sql, binary_data = copied[1]
+        self.assertIn('FORMAT BINARY', binary_sql)
+        self.assertIn('"index", "int"', binary_sql)
+        self.assertEqual(len(self.decode_binary(binary_data)[0]), 6)
+        engine.raw_connection.return_value.commit.assert_called()
+
+        with self.assertRaises(ValueError):
+            self.df_to_sql(engine, self.df, 'table', copy_format='parquet')
+
+
+class DatabaseTableLoadTests(unittest.TestCase, SavePatternMixin):
+    '''
+    Chunked table loads (against sqlite, which also supports `main`.`table`)
+    '''
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.engine = create_engine(f'sqlite:///{join(directory, "datasets.db")}')
+        self.addCleanup(self.engine.dispose)
+        self.df = pd.DataFrame({
+            'a': np.arange(10),
+            'b': np.arange(10.),
+            'text': list('abcdefghij'),
+            DATAFRAME_SPLIT_COLUMN: ['TRAIN'] * 6 + ['TEST'] * 4,
+        })
+        patcher = patch.object(DatasetStorageSqlalchemy, 'metadata')
+        patcher.start().bind = self.engine
+        self.addCleanup(patcher.stop)
+        # sqlite has no `copy from`
+        with patch.object(DatabaseTableSavePattern, 'df_to_sql',
+                          side_effect=lambda engine, df, table, schema: df.to_sql(table, engine, schema=schema, index=False)):
+            self.filepath_data = DatabaseTableSavePattern.save(self.df, 'dataset', schema='main')
+
+    def test_chunked_load_matches_table(self):
+        for chunksize in (1, 3, 100):
+            with self.subTest(chunksize=chunksize):
+                pd.testing.assert_frame_equal(DatabaseTableSavePattern.load(self.filepath_data, chunksize=chunksize), self.df)
+
+    def test_iterator(self):
+        chunks = list(DatabaseTableSavePattern.load(self.filepath_data, chunksize=4, iterator=True))
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 4, 2])
+
+    def test_pushdown(self):
+        split = DatabaseTableSavePattern.load(
+            self.filepath_data, columns=['b', 'a'], filters=[(DATAFRAME_SPLIT_COLUMN, '=', 'TEST')], chunksize=3)
+        # Rows keep their positions, like a filtered full load
+        pd.testing.assert_frame_equal(split, self.df.loc[self.df[DATAFRAME_SPLIT_COLUMN] == 'TEST', ['b', 'a']])
+
+        rows = DatabaseTableSavePattern.load(self.filepath_data, filters=[('a', 'in', [1, 7]), ('b', '<', 5)])
+        pd.testing.assert_frame_equal(rows, self.df.loc[[1]])
+        self.assertEqual(len(DatabaseTableSavePattern.load(self.filepath_data, filters=[('a', 'in', [])])), 0)
+        self.assertEqual(len(DatabaseTableSavePattern.load(self.filepath_data, filters=[('a', 'not in', [])])), 10)
+        with self.assertRaises(ValueError):
+            DatabaseTableSavePattern.load(self.filepath_data, filters=[('a', 'like', 'x')])
+
+    def test_save_row_numbers(self):
+        self.assertEqual(self.filepath_data, {'schema': 'main', 'table': 'dataset', 'row_number_column': ROW_NUMBER_COLUMN})
+        # The saved dataframe is not modified
+        self.assertNotIn(ROW_NUMBER_COLUMN, self.df.columns)
+        with self.engine.connect() as connection:
+            rows = connection.execute(text(f'SELECT {ROW_NUMBER_COLUMN} FROM dataset')).scalars().all()
+        self.assertEqual(sorted(rows), list(range(10)))
+
+    def test_filtered_load_uses_row_number_index(self):
+        '''
+        Split loads are answered from the (split, row number) index, without
+        numbering or sorting the table
+        '''
+        query, params = DatabaseTableSavePattern.select_query(
+            'main', 'dataset', columns=['a'], filters=[(DATAFRAME_SPLIT_COLUMN, '=', 'TEST')],
+            row_number_column=ROW_NUMBER_COLUMN)
+        self.assertNotIn('OVER', str(query))
+        with self.engine.connect() as connection:
+            plan = ' '.join(row[-1] for row in connection.execute(text(f'EXPLAIN QUERY PLAN {query}'), params))
+        self.assertIn('USING INDEX', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+        # Unfiltered loads are not ordered
+        query, _ = DatabaseTableSavePattern.select_query('main', 'dataset', row_number_column=ROW_NUMBER_COLUMN)
+        self.assertNotIn('ORDER BY', str(query))
+
+    def test_filtered_positions_ignore_other_indices(self):
+        with self.engine.begin() as connection:
+            connection.execute(text('CREATE INDEX text_desc ON dataset ("text" DESC)'))
+        split = DatabaseTableSavePattern.load(self.filepath_data, columns=['text'], filters=[('text', '>', 'c')])
+        pd.testing.assert_frame_equal(split, self.df.loc[self.df['text'] > 'c', ['text']])
+
+    def test_legacy_table(self):
+        '''
+        Tables saved without row numbers are numbered on load
+        '''
+        self.df.to_sql('legacy', self.engine, schema='main', index=False)
+        filepath_data = {'schema': 'main', 'table': 'legacy'}
+        pd.testing.assert_frame_equal(DatabaseTableSavePattern.load(filepath_data), self.df)
+        split = DatabaseTableSavePattern.load(filepath_data, columns=['a'], filters=[(DATAFRAME_SPLIT_COLUMN, '=', 'TEST')])
+        pd.testing.assert_frame_equal(split, self.df.loc[self.df[DATAFRAME_SPLIT_COLUMN] == 'TEST', ['a']])
+
+    def test_column_names(self):
+        self.assertEqual(DatabaseTableSavePattern.column_names(self.filepath_data), ['a', 'b', 'text', DATAFRAME_SPLIT_COLUMN])
+
+    def test_concatenate_falls_back_on_dtype_change(self):
+        chunks = [pd.DataFrame({'a': [1, 2]}), pd.DataFrame({'a': [None, 4.0]})]
+        pd.testing.assert_frame_equal(self.concatenate_chunks(chunks, 4), pd.DataFrame({'a': [1, 2, None, 4.0]}))
+        # More rows than counted
+        pd.testing.assert_frame_equal(self.concatenate_chunks(chunks[:1] * 2, 3), pd.DataFrame({'a': [1, 2, 1, 2]}))
+        # Fewer rows than counted
+        pd.testing.assert_frame_equal(self.concatenate_chunks(chunks[:1], 3), pd.DataFrame({'a': [1, 2]}))
+
+
+
+class CompressionTests(unittest.TestCase, SavePatternMixin):
+    STDLIB_CODECS = ('gzip', 'bz2', 'lzma')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.obj = {'values': [0.0] * 10000, 'model': TestSerializationClass('a')}
+
+    def test_codec_round_trip(self):
+        data = b'simpleml' * 1000
+        for codec in self.STDLIB_CODECS:
+            with self.subTest(codec=codec):
+                compressed = compress(data, codec, 1)
+                self.assertLess(len(compressed), len(data))
+                self.assertEqual(decompress(compressed, codec), data)
+        self.assertEqual(compress(data, None), data)
+
+    def test_resolve_codec(self):
+        self.assertIsNone(resolve_codec(None))
+        self.assertIsNone(resolve_codec('none'))
+        self.assertEqual(resolve_codec('GZIP'), 'gzip')
+        self.assertIn(resolve_codec('auto'), ('zstd', 'lz4', 'gzip'))
+        with self.assertRaises(SimpleMLError):
+            resolve_codec('snappy')
+
+    def test_compressed_pickle(self):
+        for codec in self.STDLIB_CODECS:
+            with self.subTest(codec=codec):
+                stream = self.pickle_object(self.obj, compression=codec)
+                self.assertEqual(self.load_pickled_object(stream, stream=True, compression=codec), self.obj)
+
+                self.pickle_object(self.obj, 'artifact', root_directory=self.directory, compression=codec)
+                with open(join(self.directory, 'artifact'), 'rb') as f:
+                    self.assertEqual(f.read(), stream)
+                self.assertEqual(
+                    self.load_pickled_object('artifact', root_directory=self.directory, compression=codec), self.obj)
+
+    def test_serialization_cache_per_codec(self):
+        with SerializationCache():
+            self.pickle_object(self.obj, 'plain', root_directory=self.directory)
+            self.pickle_object(self.obj, 'compressed', root_directory=self.directory, compression='gzip')
+        self.assertEqual(self.load_pickled_object('plain', root_directory=self.directory), self.obj)
+        self.assertEqual(
+            self.load_pickled_object('compressed', root_directory=self.directory, compression='gzip'), self.obj)
+
+    def test_filepath_data(self):
+        self.assertEqual(self.compressed_filepath_data('a.pkl', None, None), 'a.pkl')
+        filepath_data = self.compressed_filepath_data('a.pkl.gz', 'gzip', 1)
+        self.assertEqual(filepath_data, {'filename': 'a.pkl.gz', 'compression': 'gzip', 'compression_level': 1})
+        self.assertEqual(self.parse_filepath_data(filepath_data), ('a.pkl.gz', 'gzip'))
+        self.assertEqual(self.parse_filepath_data('a.pkl'), ('a.pkl', None))
+
+    def test_disk_pickle_save_pattern(self):
+        persistable_id = str(random.randint(10000, 99999))
+        filepath_data = DiskPickleSavePattern.save(self.obj, persistable_id, compression='bz2')
+        self.assertEqual(filepath_data['filename'], f'{persistable_id}.pkl{COMPRESSION_EXTENSIONS["bz2"]}')
+        self.assertEqual(DiskPickleSavePattern.load(filepath_data), self.obj)
+
+        # Uncompressed artifacts keep plain filenames
+        self.assertEqual(DiskPickleSavePattern.save(self.obj, persistable_id, compression=None), f'{persistable_id}.pkl')
+
+    def test_hdf5_options(self):
+        self.assertEqual(hdf5_compression_options(None), {'compression': 'gzip', 'compression_opts': 9})
+        self.assertEqual(hdf5_compression_options('gzip', 4), {'compression': 'gzip', 'compression_opts': 4})
+        self.assertEqual(hdf5_compression_options('lzf'), {'compression': 'lzf'})
+        # Levels of other codecs do not carry over to the gzip fallback
+        self.assertEqual(hdf5_compression_options('zstd', 19), {'compression': 'gzip', 'compression_opts': 9})
+        self.assertEqual(hdf5_compression_options('gzip', 12), {'compression': 'gzip', 'compression_opts': 9})
+
+    def test_hdf5_save_with_non_gzip_level(self):
+        '''
+        A valid zstd level is not passed on as a gzip filter level
+        '''
+        with patch('simpleml.save_patterns.base.hickle') as mock_hickle:
+            DiskHDF5SavePattern.save(self.obj, f'hdf5_zstd_level_{RANDOM_RUN}', compression='zstd', compression_level=19)
+        _, kwargs = mock_hickle.dump.call_args
+        self.assertEqual(kwargs, {'compression': 'gzip', 'compression_opts': 9})
+
+    def test_benchmark(self):
+        results = benchmark_compression(self.obj, codecs=['gzip', 'bz2'], levels={'gzip': [1, 9]})
+        self.assertEqual(list(results['codec']), ['none', 'gzip', 'gzip', 'bz2'])
+        self.assertTrue((results['ratio'] >= 1).all())
+
+
+
+class OutOfBandPickleTests(unittest.TestCase, SavePatternMixin):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.array = np.random.rand(100, 100)
+        self.obj = {'array': self.array, 'shared': self.array, 'small': np.arange(3),
+                    'df': pd.DataFrame({'a': np.arange(10000.)}), 'model': TestSerializationClass('a')}
+
+    def assertLoaded(self, loaded):
+        np.testing.assert_array_equal(loaded['array'], self.array)
+        self.assertIs(loaded['array'], loaded['shared'])
+        np.testing.assert_array_equal(loaded['small'], np.arange(3))
+        pd.testing.assert_frame_equal(loaded['df'], self.obj['df'])
+        self.assertEqual(loaded['model'], self.obj['model'])
+
+    def test_buffers_out_of_band(self):
+        buffer = io.BytesIO()
+        self.assertEqual(dump_out_of_band(self.obj, buffer, min_bytes=1024), 2)
+        data = buffer.getvalue()
+        self.assertTrue(data.startswith(OUT_OF_BAND_MAGIC))
+        # Aligned segments hold the raw array bytes
+        offset = data.index(self.array.tobytes())
+        self.assertEqual(offset % 64, 0)
+
+        loaded = load_out_of_band(io.BytesIO(data))
+        self.assertLoaded(loaded)
+        self.assertTrue(loaded['array'].flags.writeable)
+
+    def test_loads_without_copy(self):
+        buffer = io.BytesIO()
+        dump_out_of_band(self.obj, buffer, min_bytes=1024)
+        data = bytearray(buffer.getvalue())
+        loaded = loads_out_of_band(data)
+        self.assertLoaded(loaded)
+        # Arrays are views of the passed bytes
+        self.assertTrue(np.shares_memory(loaded['array'], np.frombuffer(data, dtype=np.uint8)))
+        self.assertFalse(loads_out_of_band(bytes(data))['array'].flags.writeable)
+        with self.assertRaises(SimpleMLError):
+            loads_out_of_band(bytes(data[:100]))
+        with self.assertRaises(SimpleMLError):
+            loads_out_of_band(b'not a pickle')
+
+    def test_regular_pickle_below_protocol_5(self):
+        buffer = io.BytesIO()
+        self.assertEqual(dump_out_of_band(self.obj, buffer, protocol=4), 0)
+        self.assertLoaded(cloudpickle.loads(buffer.getvalue()))
+
+    def test_pickle_object(self):
+        self.pickle_object(self.obj, 'artifact', root_directory=self.directory)
+        with open(join(self.directory, 'artifact'), 'rb') as f:
+            self.assertTrue(f.read().startswith(OUT_OF_BAND_MAGIC))
+        self.assertLoaded(self.load_pickled_object('artifact', root_directory=self.directory))
+
+        mapped = self.load_pickled_object('artifact', root_directory=self.directory, mmap_mode=True)
+        self.assertLoaded(mapped)
+        self.assertFalse(mapped['array'].flags.writeable)
+
+        self.assertLoaded(self.load_pickled_object(self.pickle_object(self.obj), stream=True))
+
+    def test_compressed(self):
+        self.pickle_object(self.obj, 'artifact', root_directory=self.directory, compression='gzip')
+        # Memory mapping is skipped for compressed files
+        loaded = self.load_pickled_object('artifact', root_directory=self.directory, compression='gzip', mmap_mode=True)
+        self.assertLoaded(loaded)
+        self.assertLoaded(self.load_pickled_object(self.pickle_object(self.obj, compression='lzma'), stream=True, compression='lzma'))
+
+    def test_legacy_pickles_load(self):
+        with open(join(self.directory, 'artifact'), 'wb') as f:
+            cloudpickle.dump(self.obj, f)
+        self.assertLoaded(self.load_pickled_object('artifact', root_directory=self.directory))
+        self.assertLoaded(self.load_pickled_object(cloudpickle.dumps(self.obj), stream=True))
+
+
+
+class DatabasePickleChunkTests(unittest.TestCase, SavePatternMixin):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.engine = create_engine(f'sqlite:///{join(directory, "main.db")}')
+        self.addCleanup(self.engine.dispose)
+        # Binary schema as an attached database on every connection
+        event.listen(self.engine, 'connect', lambda connection, record: connection.execute(
+            f'ATTACH DATABASE "{join(directory, "binary.db")}" AS "{BinaryStorageSqlalchemy.SCHEMA}"'))
+        BinaryBlob.__table__.create(self.engine)
+        BinaryBlobChunk.__table__.create(self.engine)
+        patcher = patch.object(BinaryStorageSqlalchemy, 'metadata')
+        patcher.start().bind = self.engine
+        self.addCleanup(patcher.stop)
+        self.obj = {'values': list(range(1000)), 'array': np.random.rand(10000)}
+
+    def save(self, **kwargs):
+        return DatabasePickleSavePattern.save(
+            self.obj, persistable_type='MODEL', persistable_id=str(uuid.uuid4()), **kwargs)
+
+    def assertLoaded(self, loaded):
+        self.assertEqual(loaded['values'], self.obj['values'])
+        np.testing.assert_array_equal(loaded['array'], self.obj['array'])
+
+    def test_round_trip(self):
+        filepath_data = self.save(chunk_size=4096, compression=None)
+        self.assertGreater(filepath_data['chunks'], 20)
+        self.assertLoaded(DatabasePickleSavePattern.load(filepath_data))
+        self.assertEqual(BinaryBlob.verify_chunks(filepath_data['primary_key'], filepath_data['chunks']), [])
+
+        sizes = [len(row[0]) for row in self.engine.execute(
+            BinaryBlobChunk.__table__.select().with_only_columns([BinaryBlobChunk.data]))]
+        self.assertEqual(set(sizes[:-1]), {4096})
+
+    def test_compressed(self):
+        filepath_data = self.save(chunk_size=1024, compression='gzip')
+        self.assertEqual(filepath_data['compression'], 'gzip')
+        self.assertLoaded(DatabasePickleSavePattern.load(filepath_data))
+
+    def test_corrupted_chunk(self):
+        filepath_data = self.save(chunk_size=4096, compression=None)
+        table = BinaryBlobChunk.__table__
+        self.engine.execute(table.update().where(table.c.chunk_index == 3).values(data=b'corrupted'))
+        self.assertEqual(BinaryBlob.verify_chunks(filepath_data['primary_key'], filepath_data['chunks']), [3])
+        with self.assertRaisesRegex(SimpleMLError, 'Checksum mismatch in chunk 3'):
+            DatabasePickleSavePattern.load(filepath_data)
+
+    def test_missing_chunk(self):
+        filepath_data = self.save(chunk_size=4096, compression=None)
+        table = BinaryBlobChunk.__table__
+        last = filepath_data['chunks'] - 1
+        self.engine.execute(table.delete().where(table.c.chunk_index == last))
+        self.assertEqual(BinaryBlob.verify_chunks(filepath_data['primary_key'], filepath_data['chunks']), [last])
+        with self.assertRaises(SimpleMLError):
+            DatabasePickleSavePattern.load(filepath_data)
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -1,10 +1,28 @@
 '''
 Optional module to persist pickled objects in database instead of filesystem
+
+Artifacts are stored as fixed size chunk rows (`binary_blob_chunks`) that are
+inserted while the object is serialized and streamed back on load, so
+neither the client nor the server ever holds the whole artifact in a single
+value. Every chunk carries a sha256 checksum that is verified as it is read.
+Legacy artifacts keep the full payload in `binary_blobs.binary_blob`.
+Configured via:
+```
+[persistence]
+blob_chunk_bytes = 16777216
+```
 '''
 
 from simpleml.persistables.sqlalchemy_types import GUID
 from simpleml.persistables.base_sqlalchemy import BinaryStorageSqlalchemy
-from sqlalchemy import Column, String, LargeBinary
+from simpleml.save_patterns.bulk_copy import IteratorStream
+from simpleml.utils.configuration import CONFIG, PERSISTENCE_SECTION
+from simpleml.utils.errors import SimpleMLError
+from sqlalchemy import Column, String, LargeBinary, Integer, select
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Callable, Iterator, List, Tuple
+import hashlib
+import io
 import uuid
 import logging
 
@@ -13,6 +31,9 @@ __author__ = 'Elisha Yadgaran'
 LOGGER = logging.getLogger(__name__)
 
 
+DEFAULT_BLOB_CHUNK_BYTES: int = CONFIG.getint(PERSISTENCE_SECTION, 'blob_chunk_bytes', fallback=16 * 1024 ** 2)
+
+
 class BinaryBlob(BinaryStorageSqlalchemy):
     __tablename__ = 'binary_blobs'
 
@@ -22,3 +43,128 @@ class BinaryBlob(BinaryStorageSqlalchemy):
     object_id = Column(GUID, nullable=False)
     # TODO: Figure this out and think it through...
     binary_blob = Column(LargeBinary)
+
+    @classmethod
+    def write_chunked(cls,
+                      object_type: str,
+                      object_id: str,
+                      write: Callable[[BinaryIO], None],
+                      chunk_size: int = DEFAULT_BLOB_CHUNK_BYTES) -> Tuple[str, int]:
+        '''
+        Create a blob from the data `write` streams into the passed file
+        object. The record and all chunks are inserted in one transaction.
+        Returns the blob id and number of chunks
+        '''
+        blob_id = uuid.uuid4()
+        with cls.metadata.bind.begin() as connection:
+            connection.execute(cls.__table__.insert(), {
+                'id': blob_id, 'object_type': object_type, 'object_id': object_id, 'binary_blob': None})
+            with BlobChunkWriter(connection, blob_id, chunk_size) as writer:
+                write(writer)
+        return str(blob_id), writer.chunks
+
+    @classmethod
+    def iter_chunks(cls,
+                    connection: Any,
+                    blob_id: str,
+                    chunks: int,
+                    verify: bool = True) -> Iterator[bytes]:
+        '''
+        Stream the chunks of a blob in order through a server side cursor
+
+        :param verify: validate the checksum of every chunk
+        '''
+        query = select(BinaryBlobChunk.chunk_index, BinaryBlobChunk.checksum, BinaryBlobChunk.data)\
+            .where(BinaryBlobChunk.blob_id == blob_id)\
+            .order_by(BinaryBlobChunk.chunk_index)
+        # Chunks are large, so only buffer one row at a time
+        result = connection.execution_options(stream_results=True, max_row_buffer=1).execute(query)
+        index = -1
+        for index, (chunk_index, checksum, data) in enumerate(result):
+            if chunk_index != index:
+                raise SimpleMLError(f'Missing chunk {index} of binary blob {blob_id}')
+            if verify and hashlib.sha256(data).hexdigest() != checksum:
+                raise SimpleMLError(f'Checksum mismatch in chunk {index} of binary blob {blob_id}')
+            yield data
+        if index + 1 != chunks:
+            raise SimpleMLError(f'Expected {chunks} chunks for binary blob {blob_id}, found {index + 1}')
+
+    @classmethod
+    @contextmanager
+    def open_chunked(cls,
+                     blob_id: str,
+                     chunks: int,
+                     verify: bool = True) -> Iterator[BinaryIO]:
+        '''
+        Readable (buffered) file object over the chunks of a blob
+        '''
+        with cls.metadata.bind.connect() as connection:
+            yield io.BufferedReader(IteratorStream(cls.iter_chunks(connection, blob_id, chunks, verify=verify)))
+
+    @classmethod
+    def verify_chunks(cls, blob_id: str, chunks: int) -> List[int]:
+        '''
+        Indices of missing or corrupted chunks (empty if the blob is intact).
+        Reads one chunk at a time
+        '''
+        query = select(BinaryBlobChunk.chunk_index, BinaryBlobChunk.checksum, BinaryBlobChunk.data)\
+            .where(BinaryBlobChunk.blob_id == blob_id)
+        with cls.metadata.bind.connect() as connection:
+            result = connection.execution_options(stream_results=True, max_row_buffer=1).execute(query)
+            intact = {chunk_index for chunk_index, checksum, data in result
+                      if hashlib.sha256(data).hexdigest() == checksum}
+        return [i for i in range(chunks) if i not in intact]
+
+
+class BinaryBlobChunk(BinaryStorageSqlalchemy):
+    __tablename__ = 'binary_blob_chunks'
+
+    blob_id = Column(GUID, primary_key=True)
+    chunk_index = Column(Integer, primary_key=True, autoincrement=False)
+    # sha256 hex digest of the chunk data
+    checksum = Column(String(64), nullable=False)
+    data = Column(LargeBinary, nullable=False)
+
+
+class BlobChunkWriter(io.RawIOBase):
+    '''
+    Writable file object that inserts a chunk row every `chunk_size` bytes.
+    The final (partial) chunk is inserted on close
+    '''
+
+    def __init__(self, connection: Any, blob_id: uuid.UUID, chunk_size: int = DEFAULT_BLOB_CHUNK_BYTES):
+        self.connection = connection
+        self.blob_id = blob_id
+        self.chunk_size = chunk_size
+        self.chunks: int = 0
+        self.size: int = 0
+        self._buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        view = memoryview(b).cast('B')
+        written = len(view)
+        # Slice large writes into chunks without buffering them whole
+        while view:
+            take = self.chunk_size - len(self._buffer)
+            self._buffer += view[:take]
+            view = view[take:]
+            if len(self._buffer) == self.chunk_size:
+                self._insert_chunk()
+        self.size += written
+        return written
+
+    def _insert_chunk(self) -> None:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        self.connection.execute(BinaryBlobChunk.__table__.insert(), {
+            'blob_id': self.blob_id, 'chunk_index': self.chunks,
+            'checksum': hashlib.sha256(data).hexdigest(), 'data': data})
+        self.chunks += 1
+
+    def close(self) -> None:
+        if not self.closed and self._buffer:
+            self._insert_chunk()
+        super(BlobChunkWriter, self).close()
@@ -29,6 +29,8 @@ else:
 # Config Sections
 PATH_SECTION = 'path'
 CLOUD_SECTION = 'cloud'
+HASHING_SECTION = 'hashing'
+PERSISTENCE_SECTION = 'persistence'
 
 # Filestores
 if PATH_SECTION in CONFIG:
@@ -46,9 +48,15 @@ else:
 
 PICKLE_DIRECTORY = 'pickle/'
 HDF5_DIRECTORY = 'HDF5/'
+MMAP_DIRECTORY = 'mmap/'
+PARQUET_DIRECTORY = 'parquet/'
 FILESTORE_DIRECTORY = os.path.join(SIMPLEML_DIRECTORY, 'filestore/')
 PICKLED_FILESTORE_DIRECTORY = os.path.join(FILESTORE_DIRECTORY, PICKLE_DIRECTORY)
 HDF5_FILESTORE_DIRECTORY = os.path.join(FILESTORE_DIRECTORY, HDF5_DIRECTORY)
+MMAP_FILESTORE_DIRECTORY = os.path.join(FILESTORE_DIRECTORY, MMAP_DIRECTORY)
+PARQUET_FILESTORE_DIRECTORY = os.path.join(FILESTORE_DIRECTORY, PARQUET_DIRECTORY)
+# Created on first use
+ARTIFACT_CACHE_DIRECTORY = os.path.join(SIMPLEML_DIRECTORY, 'artifact_cache/')
 
 
 # Create Paths if they don't exist - use try/excepts to catch race conditions
@@ -70,3 +78,9 @@ if not os.path.exists(PICKLED_FILESTORE_DIRECTORY):
 
 if not os.path.exists(HDF5_FILESTORE_DIRECTORY):
     safe_makedirs(HDF5_FILESTORE_DIRECTORY)
+
+if not os.path.exists(MMAP_FILESTORE_DIRECTORY):
+    safe_makedirs(MMAP_FILESTORE_DIRECTORY)
+
+if not os.path.exists(PARQUET_FILESTORE_DIRECTORY):
+    safe_makedirs(PARQUET_FILESTORE_DIRECTORY)
@@ -0,0 +1,41 @@
+'''
+Helper module to estimate the in-memory footprint of objects. Used by the
+bounded caches to decide when to evict entries
+'''
+
+__author__ = 'Elisha Yadgaran'
+
+import sys
+import numpy as np
+import pandas as pd
+
+from typing import Any
+
+
+def estimate_memory_usage(obj: Any) -> int:
+    '''
+    Best effort approximation of the number of bytes held by an object.
+    Exact for numpy arrays, deep for pandas containers and shallow (plus
+    elements) for builtin containers. Everything else falls back to
+    `sys.getsizeof`
+    '''
+    if obj is None:
+        return 0
+
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=True))
+
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(estimate_memory_usage(i) for i in obj)
+
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(
+            estimate_memory_usage(k) + estimate_memory_usage(v) for k, v in obj.items())
+
+    return sys.getsizeof(obj)
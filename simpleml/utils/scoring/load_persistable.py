@@ -10,6 +10,7 @@ import logging
 from typing import Any, Dict
 
 from simpleml.persistables.base_persistable import Persistable
+from simpleml.persistables.persistable_cache import PERSISTABLE_CACHE
 from simpleml.datasets.base_dataset import Dataset
 from simpleml.pipelines.base_pipeline import Pipeline
 from simpleml.models.base_model import Model
@@ -27,13 +28,21 @@ class PersistableLoader(object):
 
     Sqlalchemy-mixins active record style allows for keyword based filtering:
         `BaseClass.where(**filters).order_by(**ordering).first()`
+
+    If enabled, loaded persistables are kept in the process wide
+    `PERSISTABLE_CACHE` so repeated loads return the already hydrated object
+    (and artifacts)
     '''
     @classmethod
     def load_persistable(cls, persistable_class: Persistable, filters: Dict[str, Any]) -> Persistable:
         persistable = persistable_class.where(**filters).order_by(persistable_class.version.desc()).first()
         if persistable is not None:
+            cached = PERSISTABLE_CACHE.get(persistable.id, persistable.hash_)
+            if cached is not None:
+                return cached
             cls.validate_environment(persistable)
             persistable.load(load_externals=False)
+            PERSISTABLE_CACHE.put(persistable)
             return persistable
         else:
             raise SimpleMLError('No persistable found for specified filters: {}'.format(filters))
@@ -12,6 +12,7 @@ from typing import Dict, Any, Optional, Tuple
 
 from simpleml.registries import SIMPLEML_REGISTRY
 from simpleml.persistables.base_persistable import Persistable
+from simpleml.persistables.persistable_cache import PERSISTABLE_CACHE
 from simpleml.datasets.base_dataset import Dataset
 from simpleml.pipelines.base_pipeline import Pipeline
 from simpleml.models.base_model import Model
@@ -57,6 +58,9 @@ class PersistableCreator(with_metaclass(ABCMeta, object)):
         '''
         Base method to query for dependency
         Raises TrainingError if dependency does not exist
+
+        Dependencies already loaded in this process are reused from the
+        `PERSISTABLE_CACHE`, if enabled
         '''
         if not dependency_kwargs:
             raise TrainingError('Must pass at least one key:value to look up in database')
@@ -64,7 +68,11 @@ class PersistableCreator(with_metaclass(ABCMeta, object)):
             *dependency_cls.determine_filters(**dependency_kwargs))
         if dependency is None:
             raise TrainingError('Expected dependency is missing')
+        cached = PERSISTABLE_CACHE.get(dependency.id, dependency.hash_)
+        if cached is not None:
+            return cached
         dependency.load()
+        PERSISTABLE_CACHE.put(dependency)
         return dependency
 
     @classmethod
@@ -184,12 +192,13 @@ class DatasetCreator(PersistableCreator):
                 # Build dummy object to retrieve hash to look for
                 new_dataset = cls.retrieve_from_registry(registered_name)(**kwargs)
                 new_dataset.add_pipeline(pipeline)
-                new_dataset.build_dataframe()
+                # Data is built lazily on hash, datasets that support chunked
+                # generation are hashed without materializing the dataframe
 
                 filters = {
                     'name': new_dataset.name,
                     'registered_name': new_dataset.registered_name,
-                    'hash_': new_dataset._hash()
+                    'hash_': new_dataset._cached_hash()
                 }
 
             else:
@@ -263,7 +272,7 @@ class PipelineCreator(PersistableCreator):
             filters = {
                 'name': new_pipeline.name,
                 'registered_name': new_pipeline.registered_name,
-                'hash_': new_pipeline._hash()
+                'hash_': new_pipeline._cached_hash()
             }
 
         return Pipeline, filters
@@ -328,7 +337,7 @@ class ModelCreator(PersistableCreator):
             filters = {
                 'name': new_model.name,
                 'registered_name': new_model.registered_name,
-                'hash_': new_model._hash()
+                'hash_': new_model._cached_hash()
             }
 
         return Model, filters
@@ -398,7 +407,7 @@ class MetricCreator(PersistableCreator):
             filters = {
                 'name': new_metric.name,
                 'registered_name': registered_name,
-                'hash_': new_metric._hash()
+                'hash_': new_metric._cached_hash()
             }
 
         return Metric, filters